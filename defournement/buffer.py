@@ -0,0 +1,109 @@
+#-*- coding:utf-8 -*-
+"""
+Write-behind buffer:
+- Buffer.add()
+- Buffer.flush()
+- Buffer.close()
+"""
+import logging
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+class Buffer(object):
+    """
+    Accumulate items and hand them over to a callback by batches:
+    every `size` items or every `interval` seconds, whichever comes first.
+    """
+
+    def __init__(self, callback, size=100, interval=0.5, strict=False):
+        """
+        Initialize the buffer.
+        :param callback: Called with the list of buffered items.
+        :type callback: callable
+        :param size: The number of items triggering a flush.
+        :type size: int
+        :param interval: The maximum delay before a flush, in seconds.
+        :type interval: float
+        :param strict: Raise the callback errors from `flush()`, those of the periodic flushes
+                       included, instead of logging them: the items are dropped either way.
+        :type strict: bool
+        """
+        self.callback = callback
+        self.size = size
+        self.interval = interval
+        self.strict = strict
+        self._error = None
+        self._items = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def start(self):
+        """
+        Start the periodic flush.
+        """
+        self._closed.clear()
+        self._thread = threading.Thread(target=self._run, name='buffer-flush')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def _run(self):
+        """
+        Flush every `interval` seconds until closed.
+        """
+        while not self._closed.wait(self.interval):
+            if self._error is not None:
+                #Held until the owner flushes.
+                continue
+            try:
+                self.flush()
+            except Exception as exc:#pylint:disable=broad-except
+                LOGGER.exception('Cannot flush the buffered items')
+                self._error = exc
+
+    def add(self, item):
+        """
+        Buffer an item, flushing if the batch is full.
+        """
+        with self._lock:
+            self._items.append(item)
+            full = len(self._items) >= self.size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Hand the buffered items over to the callback.
+        Flushes are serialized so that the batches keep their order.
+        :raises: If strict, the error of this flush or of a periodic flush since the last call.
+        """
+        with self._flush_lock:
+            error, self._error = self._error, None
+            if error is not None:
+                raise error
+            with self._lock:
+                items, self._items = self._items, []
+            if not items:
+                return
+            try:
+                self.callback(items)
+            except Exception:#pylint:disable=broad-except
+                if self.strict:
+                    raise
+                LOGGER.exception('Cannot flush %s items', len(items))
+
+    def close(self):
+        """
+        Stop the periodic flush and flush the remaining items.
+        """
+        self._closed.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
@@ -0,0 +1,242 @@
+#-*- coding:utf-8 -*-
+"""
+In-process caches:
+- LRUCache
+- TTLCache
+- ResponseCache
+"""
+import collections
+import threading
+import time
+
+class LRUCache(object):
+    """
+    Thread-safe mapping bounded to `size` entries,
+    evicting the least recently used one.
+    """
+
+    def __init__(self, size):
+        """
+        Initialize the cache.
+        :param size: The maximum number of entries.
+        :type size: int
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Retrieve an entry, marking it as recently used.
+        :returns: The value, `default` if missing.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Insert or replace an entry.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove an entry, if any.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all the entries.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        The cache counters.
+        :rtype: dict
+        """
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+class TTLCache(object):
+    """
+    Thread-safe mapping whose entries expire after their own time to live.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Retrieve an entry, if it did not expire.
+        :returns: The value, `default` if missing or expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[1] < time.time():
+                del self._data[key]
+                return default
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        """
+        Insert or replace an entry.
+        :param ttl: The entry time to live, in seconds.
+        :type ttl: float
+        """
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        """
+        Remove an entry, if any.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all the entries.
+        """
+        with self._lock:
+            self._data.clear()
+
+class ResponseCache(object):
+    """
+    Thread-safe read-through cache, bounded to `size` entries living `ttl` seconds,
+    evicting the least recently used one. The entries belong to groups,
+    invalidated as a whole.
+    A read started before an invalidation of its group is not stored: see `epoch()`.
+    """
+
+    def __init__(self, size, ttl):
+        """
+        Initialize the cache.
+        :param size: The maximum number of entries.
+        :type size: int
+        :param ttl: The entries time to live, in seconds.
+        :type ttl: float
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._groups = {}
+        self._epochs = collections.OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, entry):
+        self._data.pop(entry, None)
+        keys = self._groups.get(entry[0])
+        if keys is not None:
+            keys.discard(entry[1])
+            if not keys:
+                del self._groups[entry[0]]
+
+    def epoch(self, group):
+        """
+        The invalidations counter of a group, to read before computing one of its values.
+        The counters of the `size` groups last invalidated are kept: forgetting one,
+        or clearing the cache, moves every group on.
+        :rtype: tuple
+        """
+        with self._lock:
+            return (self._floor, self._epochs.get(group, 0))
+
+    def get(self, group, key, default=None):
+        """
+        Retrieve an entry, if it did not expire, marking it as recently used.
+        :returns: The value, `default` if missing or expired.
+        """
+        entry = (group, key)
+        with self._lock:
+            try:
+                value, expires = self._data.pop(entry)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires < time.time():
+                self._remove(entry)
+                self.misses += 1
+                return default
+            self._data[entry] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, group, key, value, epoch):
+        """
+        Insert or replace an entry, unless invalidated since `epoch`.
+        :param epoch: The `epoch()` of the group read before computing the value.
+        :type epoch: tuple
+        :returns: True if stored.
+        :rtype: bool
+        """
+        entry = (group, key)
+        with self._lock:
+            if epoch != (self._floor, self._epochs.get(group, 0)):
+                return False
+            self._data.pop(entry, None)
+            self._data[entry] = (value, time.time() + self.ttl)
+            self._groups.setdefault(group, set()).add(key)
+            while len(self._data) > self.size:
+                self._remove(next(iter(self._data)))
+            return True
+
+    def invalidate(self, *groups):
+        """
+        Remove the entries of groups.
+        """
+        with self._lock:
+            for group in groups:
+                self._epochs[group] = self._epochs.pop(group, 0) + 1
+                for key in self._groups.pop(group, ()):
+                    self._data.pop((group, key), None)
+            while len(self._epochs) > self.size:
+                self._epochs.popitem(last=False)
+                self._floor += 1
+
+    def clear(self):
+        """
+        Remove all the entries.
+        """
+        with self._lock:
+            self._floor += 1
+            self._data.clear()
+            self._groups.clear()
+            self._epochs.clear()
+
+    def stats(self):
+        """
+        The cache counters.
+        :rtype: dict
+        """
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
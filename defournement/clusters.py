@@ -0,0 +1,128 @@
+#-*- coding:utf-8 -*-
+"""
+Clusters: the kubernetes API servers, and the placement of the namespaces.
+- names()
+- resolve()
+- configuration()
+- place()
+Without the `clusters` setting, there is a single cluster, named `default`,
+configured by the `api_*` settings. Otherwise each cluster `<c>` is
+configured by `<c>_api_host`, `<c>_api_ca_file` and `<c>_api_key`.
+"""
+import bisect
+import hashlib
+import threading
+import farine.settings
+from kubernetes import client
+
+DEFAULT = 'default'
+
+_LOCK = threading.Lock()
+_RING = {'names': None, 'ring': None}
+
+def names():
+    """
+    The clusters names. The first one holds the deployments recorded without cluster.
+    :rtype: list
+    """
+    value = farine.settings.defournement.get('clusters', '')
+    return [name.strip() for name in value.split(',') if name.strip()] or [DEFAULT]
+
+def resolve(cluster):
+    """
+    The cluster of a deployment: the first one if not recorded.
+    :param cluster: The recorded cluster.
+    :type cluster: str
+    :rtype: str
+    """
+    return cluster or names()[0]
+
+def configuration(cluster):
+    """
+    The client configuration of a cluster.
+    Settings:
+     - api_pool_size : the maximum number of connections kept, per cluster. Default to `api_concurrency`:
+                       the requests in flight beyond it would open and close a connection each.
+    :param cluster: The cluster name.
+    :type cluster: str
+    :rtype: kubernetes.client.Configuration
+    """
+    settings = farine.settings.defournement
+    prefix = '' if cluster == DEFAULT else '{}_'.format(cluster)
+    configuration = client.Configuration()
+    configuration.host = settings[prefix + 'api_host']
+    configuration.ssl_ca_cert = settings[prefix + 'api_ca_file']
+    configuration.api_key['authorization'] = settings[prefix + 'api_key']
+    configuration.api_key_prefix['authorization'] = 'Bearer'
+    configuration.connection_pool_maxsize = int(settings.get('api_pool_size') or settings.get('api_concurrency', 64))
+    return configuration
+
+class HashRing(object):
+    """
+    Consistent hashing ring: adding or removing a node only moves
+    the keys of that node.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        """
+        :param nodes: The nodes.
+        :type nodes: list
+        :param replicas: The points of each node on the ring.
+        :type replicas: int
+        """
+        points = sorted((self._hash('{}:{}'.format(node, i)), node) for node in nodes for i in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def get(self, key):
+        """
+        The node of a key.
+        :param key: The key.
+        :type key: str
+        :rtype: str
+        """
+        index = bisect.bisect(self.hashes, self._hash(key)) % len(self.hashes)
+        return self.nodes[index]
+
+def _ring():
+    """
+    The ring of the current clusters.
+    """
+    current = tuple(names())
+    with _LOCK:
+        if _RING['names'] != current:
+            _RING['ring'] = HashRing(current)
+            _RING['names'] = current
+        return _RING['ring']
+
+def place(namespace):
+    """
+    The cluster of a new deployment: its namespace explicit mapping,
+    the cluster its namespace is already deployed on, or the consistent hash of its namespace.
+    A namespace stays on its cluster when the clusters change.
+    Settings:
+     - cluster_map : the explicit placements, as namespace:cluster,... Default to none.
+    :param namespace: The deployment namespace.
+    :type namespace: str
+    :rtype: str
+    """
+    from defournement.models import Deployment
+    current = names()
+    if len(current) == 1:
+        return current[0]
+    for item in farine.settings.defournement.get('cluster_map', '').split(','):
+        name, _, cluster = item.partition(':')
+        if name.strip() == namespace and cluster.strip() in current:
+            return cluster.strip()
+    recorded = list(Deployment.select(Deployment.cluster).where(Deployment.namespace == namespace)
+                    .order_by(Deployment.date_created.desc()).limit(1).tuples())
+    if recorded:
+        #Recorded without cluster: the first one.
+        cluster = resolve(recorded[0][0])
+        if cluster in current:
+            return cluster
+    return _ring().get(namespace)
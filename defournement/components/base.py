@@ -0,0 +1,203 @@
+#-*- coding:utf-8 -*-
+"""
+Base kubernetes component :
+- deploy()
+- exists()
+- lookup()
+- manifest()
+"""
+import hashlib
+import json
+import logging
+import farine.settings
+from kubernetes.client.rest import ApiException
+import defournement.informer
+import defournement.metrics
+from defournement.throttle import CircuitOpen
+
+LOGGER = logging.getLogger(__name__)
+
+HASH_ANNOTATION = 'defournement.baguette.io/spec-hash'
+APPLIED_ANNOTATION = 'defournement.baguette.io/last-applied'
+
+def _pointer(path, key):
+    """
+    Append `key` to a JSON pointer, escaped as per RFC 6901.
+    """
+    return '{}/{}'.format(path, key.replace('~', '~0').replace('/', '~1'))
+
+def json_patch(source, target, path=''):
+    """
+    Compute the JSON patch (RFC 6902) turning `source` into `target`.
+    Objects are compared key by key, everything else is replaced as a whole.
+    :param source: The previous document.
+    :type source: dict
+    :param target: The new document.
+    :type target: dict
+    :returns: The patch operations.
+    :rtype: list
+    """
+    ops = []
+    for key in source:
+        if key not in target:
+            ops.append({'op': 'remove', 'path': _pointer(path, key)})
+    for key, value in target.items():
+        pointer = _pointer(path, key)
+        if key not in source:
+            ops.append({'op': 'add', 'path': pointer, 'value': value})
+        elif isinstance(value, dict) and isinstance(source[key], dict):
+            ops.extend(json_patch(source[key], value, pointer))
+        elif value != source[key]:
+            ops.append({'op': 'replace', 'path': pointer, 'value': value})
+    return ops
+
+class Component(object):
+    """
+    A component whose specifications are stamped with their hash,
+    so that an unchanged component is never written again.
+    The subclasses implement :
+    - specifications()
+    - read() : raises ApiException.
+    - patch(body) : raises ApiException.
+    - create(manifest) : on a conflict, returns `conflict(manifest)`.
+    - update(manifest)
+    and may set `compiler`, rendering the same manifest from the definition.
+    A failure returns False, except `CircuitOpen`: the API server is unhealthy,
+    not the component, the caller waits and retries.
+    """
+    kind = None
+    compiler = None
+
+    def manifest(self):
+        """
+        Render the specifications as a plain dict, annotated with their hash
+        and their serialized form, used to compute the next minimal patch.
+        Settings:
+         - manifest_compiler : render with the compiler rather than the client models. Default to true.
+        :returns: The manifest.
+        :rtype: dict
+        """
+        if self.compiler is not None and farine.settings.defournement.get('manifest_compiler', 'true').lower() == 'true':
+            manifest = self.compiler(self.definition)
+        else:
+            manifest = self.api_client.sanitize_for_serialization(self.specifications())
+        applied = json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+        metadata = manifest.setdefault('metadata', {})
+        annotations = metadata.setdefault('annotations', {})
+        annotations[HASH_ANNOTATION] = hashlib.sha1(applied.encode('utf-8')).hexdigest()
+        annotations[APPLIED_ANNOTATION] = applied
+        return manifest
+
+    def lookup(self):
+        """
+        Read the component from the informer once it is synced,
+        from the API server otherwise.
+        :raises: ApiException
+        """
+        namespace = self.definition['namespace']
+        informer = defournement.informer.informer(self.definition.get('cluster'))
+        if informer is None or not informer.has_synced(self.kind) or namespace in informer.exclude_namespaces:
+            return self.read()
+        obj = informer.get(self.kind, namespace, self.definition['repo'])
+        if obj is None:
+            raise ApiException(status=404, reason='Not Found')
+        return obj
+
+    @defournement.metrics.component('exists', checked=False)
+    def exists(self):
+        """
+        Check the existence of the component.
+        :rtype: bool
+        """
+        try:
+            self.lookup()
+        except ApiException as exc:
+            if exc.status != 404:
+                LOGGER.error(exc)
+            return False
+        except CircuitOpen:
+            raise
+        except Exception:#pylint:disable=broad-except
+            LOGGER.exception('Cannot read the %s', self.kind)
+            return False
+        return True
+
+    @defournement.metrics.component('deploy')
+    def deploy(self):
+        """
+        Deploy the component with a single read:
+        - create it if it does not exist,
+        - skip it if its specifications did not change,
+        - otherwise patch what changed.
+        :returns: The deploy status.
+        :rtype: bool
+        """
+        manifest = self.manifest()
+        try:
+            current = self.lookup()
+        except ApiException as exc:
+            if exc.status != 404:
+                LOGGER.error(exc)
+                return False
+            return self.create(manifest)
+        except CircuitOpen:
+            raise
+        except Exception:#pylint:disable=broad-except
+            LOGGER.exception('Cannot read the %s', self.kind)
+            return False
+        return self._apply(manifest, current)
+
+    def conflict(self, manifest):
+        """
+        The component to create already exists: the informer store is stale,
+        or a concurrent deploy created it. Apply the manifest to the live one.
+        :param manifest: The manifest to apply.
+        :type manifest: dict
+        :returns: The deploy status.
+        :rtype: bool
+        """
+        LOGGER.info('%s already exists', self.kind)
+        try:
+            current = self.read()
+        except CircuitOpen:
+            raise
+        except Exception:#pylint:disable=broad-except
+            LOGGER.exception('Cannot read the %s', self.kind)
+            return False
+        return self._apply(manifest, current)
+
+    def _apply(self, manifest, current):
+        """
+        Apply the manifest to the live component: skip it if unchanged, patch what changed otherwise.
+        :rtype: bool
+        """
+        #1. Unchanged
+        annotations = (current.metadata.annotations if current.metadata else None) or {}
+        expected = manifest['metadata']['annotations']
+        if annotations.get(HASH_ANNOTATION) == expected[HASH_ANNOTATION]:
+            LOGGER.info('%s unchanged', self.kind)
+            return True
+        #2. Not created by this version: full update.
+        applied = annotations.get(APPLIED_ANNOTATION)
+        if not applied:
+            return self.update(manifest)
+        #3. Minimal patch, leaving the other annotations untouched.
+        target = dict(manifest, metadata=dict(manifest['metadata']))
+        del target['metadata']['annotations']
+        ops = json_patch(json.loads(applied), target)
+        ops.extend({'op': 'add', 'path': _pointer('/metadata/annotations', key), 'value': value}
+                   for key, value in expected.items())
+        try:
+            self.patch(ops)
+        except ApiException as exc:
+            #The live object drifted from the last applied one.
+            if exc.status != 422:
+                LOGGER.error(exc)
+                return False
+            return self.update(manifest)
+        except CircuitOpen:
+            raise
+        except Exception:#pylint:disable=broad-except
+            LOGGER.exception('Cannot patch the %s', self.kind)
+            return False
+        return True
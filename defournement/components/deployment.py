@@ -5,37 +5,60 @@ Kubernetes deployment component :
 - delete()
 - deploy()
 - exists()
+- patch()
+- read()
 - update()
 """
 import logging
 from kubernetes import client
 from kubernetes.client.rest import ApiException
+import defournement.metrics
+from defournement.throttle import CircuitOpen
+import defournement.utils
+from defournement.components.base import Component
+import defournement.manifests
 
 LOGGER = logging.getLogger(__name__)
 
-class Deployment(object):
+class Deployment(Component):
+    kind = 'deployment'
+    compiler = staticmethod(defournement.manifests.deployment)
 
-    def __init__(self, definition):
+    def __init__(self, definition, api_client=None):
         """
         Initialize the definition.
+        :param definition: The application definition.
+        :type definition: dict
+        :param api_client: The kubernetes API client. Default to the process-wide one of the definition cluster.
+        :type api_client: kubernetes.client.ApiClient
         """
         self.definition = definition
+        self.api_client = api_client or defournement.utils.api_client(definition.get('cluster'))
 
-    def exists(self):
+    @defournement.metrics.component('read')
+    def read(self):
         """
-        Check the existence of the deployment.
-        :returns: The deploy status.
-        :rtype: bool
+        Read the live deployment.
+        :raises: ApiException
         """
-        v1beta1 = client.ExtensionsV1beta1Api()
-        try:
-            v1beta1.read_namespaced_deployment(
-                self.definition['repo'],
-                self.definition['namespace'])
-        except:
-            LOGGER.exception('Deployment does not exist')
-            return False
-        return True
+        v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
+        return v1beta1.read_namespaced_deployment(
+            name=self.definition['repo'],
+            namespace=self.definition['namespace'])
+
+    @defournement.metrics.component('patch')
+    def patch(self, body):
+        """
+        Patch the live deployment.
+        :param body: The JSON patch operations.
+        :type body: list
+        :raises: ApiException
+        """
+        v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
+        return v1beta1.patch_namespaced_deployment(
+            name=self.definition['repo'],
+            namespace=self.definition['namespace'],
+            body=body)
 
     def specifications(self):
         """
@@ -112,49 +135,49 @@ class Deployment(object):
                 spec=spec)
         return deployment
 
-    def create(self):
+    @defournement.metrics.component('create')
+    def create(self, manifest=None):
         """
         Create a deployment.
+        :param manifest: The manifest to apply. Default to the current one.
+        :type manifest: dict
         """
         LOGGER.info('deployment.create()')
         #1. Retrieve the container spec
-        deployment = self.specifications()
+        deployment = manifest or self.manifest()
         #2. Apply
         try:
-            v1beta1 = client.ExtensionsV1beta1Api()
+            v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
             v1beta1.create_namespaced_deployment(body=deployment, namespace=self.definition['namespace'])
         except ApiException as exc:
+            if exc.status == 409:
+                return self.conflict(deployment)
             LOGGER.error(exc)
             return False
         return True
 
-    def update(self):
+    @defournement.metrics.component('update')
+    def update(self, manifest=None):
         """
         Update a deployment.
+        :param manifest: The manifest to apply. Default to the current one.
+        :type manifest: dict
         """
         LOGGER.info('deployment.update()')
         #1. Retrieve the container spec
-        deployment = self.specifications()
+        deployment = manifest or self.manifest()
         #2. Patch
         try:
-            v1beta1 = client.ExtensionsV1beta1Api()
+            v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
             v1beta1.patch_namespaced_deployment(name=self.definition['repo'], namespace=self.definition['namespace'], body=deployment)
+        except CircuitOpen:
+            raise
         except:
             LOGGER.exception('Cannot update the deployment')
             return False
         return True
 
-    def deploy(self):
-        """
-        Deploy a deployment.
-        :returns: The deploy status.
-        :rtype: bool
-        """
-        LOGGER.info('deployment.deploy()')
-        if not self.exists():
-            return self.create()
-        return self.update()
-
+    @defournement.metrics.component('delete')
     def delete(self):
         """
         Delete a deployment resource. Idempotent.
@@ -162,7 +185,7 @@ class Deployment(object):
         :rtype: bool
         """
         try:
-            v1beta1 = client.ExtensionsV1beta1Api()
+            v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
             v1beta1.delete_namespaced_deployment(
             name=self.definition['name'],
             namespace=self.definition['namespace'],
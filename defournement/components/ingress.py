@@ -5,36 +5,60 @@ Kubernetes ingress component :
 - delete()
 - deploy()
 - exists()
+- patch()
+- read()
 - update()
 """
 import logging
 from kubernetes import client
 from kubernetes.client.rest import ApiException
+import defournement.metrics
+from defournement.throttle import CircuitOpen
+import defournement.utils
+from defournement.components.base import Component
+import defournement.manifests
 
 LOGGER = logging.getLogger(__name__)
 
-class Ingress(object):
+class Ingress(Component):
+    kind = 'ingress'
+    compiler = staticmethod(defournement.manifests.ingress)
 
-    def __init__(self, definition):
+    def __init__(self, definition, api_client=None):
         """
         Initialize the definition.
+        :param definition: The application definition.
+        :type definition: dict
+        :param api_client: The kubernetes API client. Default to the process-wide one of the definition cluster.
+        :type api_client: kubernetes.client.ApiClient
         """
         self.definition = definition
+        self.api_client = api_client or defournement.utils.api_client(definition.get('cluster'))
 
-    def exists(self):
+    @defournement.metrics.component('read')
+    def read(self):
         """
-        Check if an ingress rule already exists.
-        :rtype: bool
+        Read the live ingress.
+        :raises: ApiException
         """
-        v1beta1 = client.ExtensionsV1beta1Api()
-        try:
-            v1beta1.read_namespaced_ingress(
-                name=self.definition['repo'],
-                namespace=self.definition['namespace'])
-        except:
-            LOGGER.exception('Ingress rule does not exist')
-            return False
-        return True
+        v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
+        return v1beta1.read_namespaced_ingress(
+            name=self.definition['repo'],
+            namespace=self.definition['namespace'])
+
+    @defournement.metrics.component('patch')
+    def patch(self, body):
+        """
+        Patch the live ingress.
+        :param body: The JSON patch operations.
+        :type body: list
+        :raises: ApiException
+        """
+        v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
+        return v1beta1.patch_namespaced_ingress(
+            name=self.definition['repo'],
+            namespace=self.definition['namespace'],
+            body=body)
 
     def specifications(self):
         """
@@ -59,51 +83,52 @@ class Ingress(object):
             spec=spec
         )
 
-    def create(self):
+    @defournement.metrics.component('create')
+    def create(self, manifest=None):
         """
         Create an ingress rule.
+        :param manifest: The manifest to apply. Default to the current one.
+        :type manifest: dict
         """
         #1. Retrieve the spec
-        ingress = self.specifications()
+        ingress = manifest or self.manifest()
         #2. Apply
         try:
-            v1beta1 = client.ExtensionsV1beta1Api()
+            v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
             v1beta1.create_namespaced_ingress(self.definition['namespace'], body=ingress)
         except ApiException as exc:
+            if exc.status == 409:
+                return self.conflict(ingress)
             if exc.status != 404:
                 LOGGER.error(exc)
             return False
         return True
 
-    def update(self):
+    @defournement.metrics.component('update')
+    def update(self, manifest=None):
         """
         Update an ingress rule.
+        :param manifest: The manifest to apply. Default to the current one.
+        :type manifest: dict
         """
         #1. Retrieve the spec
-        ingress = self.specifications()
+        ingress = manifest or self.manifest()
         #2. Apply
         try:
-            v1beta1 = client.ExtensionsV1beta1Api()
+            v1beta1 = client.ExtensionsV1beta1Api(self.api_client)
             v1beta1.patch_namespaced_ingress(
                 name=self.definition['repo'],
                 namespace=self.definition['namespace'],
                 body=ingress
             )
+        except CircuitOpen:
+            raise
         except:
             LOGGER.exception('Cannot update the ingress rule')
             return False
         return True
 
-    def deploy(self):
-        """
-        Deploy an ingress rule.
-        :returns: The deploy status.
-        :rtype: bool
-        """
-        if not self.exists():
-            return self.create()
-        return self.update()
-    
+    @defournement.metrics.component('delete')
     def delete(self):
         """
         Delete an ingress rule.
@@ -7,46 +7,147 @@ Kubernetes namespace component :
 - exists()
 """
 import logging
+import os
+import threading
+import farine.settings
 from kubernetes import client
 from kubernetes.client.rest import ApiException
+from defournement.cache import TTLCache
+import defournement.clusters
+import defournement.informer
+import defournement.metrics
+from defournement.throttle import CircuitOpen
+import defournement.utils
 
 LOGGER = logging.getLogger(__name__)
 
+_LOCK = threading.Lock()
+_CACHE = {'pid': None, 'caches': {}}
+
+def _invalidate(cache, kind, event_type, obj):
+    """
+    Informer listener keeping the namespaces cache up to date.
+    """
+    if kind != 'namespace':
+        return
+    if event_type == 'SYNC':
+        cache.clear()
+    elif event_type == 'DELETED':
+        cache.delete(obj.metadata.name)
+
+def namespaces(cluster=None):
+    """
+    Retrieve the process-wide namespaces existence cache of a cluster, created on first use.
+    It is invalidated by a namespace watch: the informer one if enabled,
+    a namespace only informer otherwise.
+    Settings:
+     - namespace_watch : invalidate the cache with a namespace watch. Default to true.
+    :param cluster: The cluster name. Default to the first one.
+    :type cluster: str
+    :rtype: TTLCache
+    """
+    cluster = defournement.clusters.resolve(cluster)
+    with _LOCK:
+        if _CACHE['pid'] != os.getpid():
+            _CACHE['caches'] = {}
+            _CACHE['pid'] = os.getpid()
+        if cluster not in _CACHE['caches']:
+            cache = TTLCache()
+            listener = lambda kind, event_type, obj: _invalidate(cache, kind, event_type, obj)
+            informer = defournement.informer.informer(cluster)
+            if informer is not None:
+                informer.add_listener(listener)
+            elif farine.settings.defournement.get('namespace_watch', 'true').lower() == 'true':
+                exclude = farine.settings.defournement['exclude_namespaces'].split(',')
+                informer = defournement.informer.Informer(defournement.utils.api_client(cluster), exclude, kinds=['namespace'])
+                informer.add_listener(listener)
+                informer.start()
+            _CACHE['caches'][cluster] = cache
+        return _CACHE['caches'][cluster]
+
 class Namespace(object):
+    kind = 'namespace'
 
-    def __init__(self, name):
+    def __init__(self, name, api_client=None, cluster=None):
         """
         Initialize the definition.
+        :param name: The namespace name.
+        :type name: str
+        :param api_client: The kubernetes API client. Default to the process-wide one of the cluster.
+        :type api_client: kubernetes.client.ApiClient
+        :param cluster: The cluster name. Default to the first one.
+        :type cluster: str
         """
         self.name = name
+        self.cluster = defournement.clusters.resolve(cluster)
+        self.api_client = api_client or defournement.utils.api_client(self.cluster)
+
+    @staticmethod
+    def _ttl(exists):
+        """
+        The time to live of a cached existence.
+        Settings:
+         - namespace_cache_ttl : for an existing namespace, in seconds. Default to 300.
+         - namespace_negative_ttl : for a missing namespace, in seconds. Default to 5.
+        """
+        if exists:
+            return float(farine.settings.defournement.get('namespace_cache_ttl', 300))
+        return float(farine.settings.defournement.get('namespace_negative_ttl', 5))
 
+    @defournement.metrics.component('exists', checked=False)
     def exists(self):
         """
         Check if a namespace already exists.
         :rtype: bool
         """
-        v1api = client.CoreV1Api()
-        try:
-            v1api.read_namespace(name=self.name)
-        except:
-            LOGGER.exception('Namespace does not exist')
-            return False
-        return True
+        cache = namespaces(self.cluster)
+        exists = cache.get(self.name)
+        if exists is not None:
+            return exists
+        informer = defournement.informer.informer(self.cluster)
+        if informer is not None and informer.has_synced('namespace') and self.name not in informer.exclude_namespaces:
+            exists = informer.get('namespace', None, self.name) is not None
+        else:
+            v1api = client.CoreV1Api(self.api_client)
+            try:
+                v1api.read_namespace(name=self.name)
+                exists = True
+            except ApiException as exc:
+                if exc.status != 404:
+                    LOGGER.error(exc)
+                    return False
+                exists = False
+            except CircuitOpen:
+                raise
+            except Exception:#pylint:disable=broad-except
+                LOGGER.exception('Cannot read namespace')
+                return False
+        cache.set(self.name, exists, self._ttl(exists))
+        return exists
 
+    @defournement.metrics.component('create')
     def create(self):
         """
         Create the namespace.
         :returns: Creation status.
         :rtype: bool
         """
-        v1api = client.CoreV1Api()
+        v1api = client.CoreV1Api(self.api_client)
         try:
             v1api.create_namespace(body=client.V1Namespace(metadata=client.V1ObjectMeta(name=self.name)))
+        except ApiException as exc:
+            if exc.status != 409:
+                LOGGER.error(exc)
+                return False
+        except CircuitOpen:
+            raise
         except:
             LOGGER.exception('Cannot create namespace')
             return False
+        namespaces(self.cluster).set(self.name, True, self._ttl(True))
         return True
 
+    @defournement.metrics.component('deploy')
     def deploy(self):
         """
         Deploy a namespace.
@@ -57,6 +158,7 @@ class Namespace(object):
             self.create()
         return True
 
+    @defournement.metrics.component('delete')
     def delete(self):
         """
         Delete a namespace.
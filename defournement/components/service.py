@@ -5,36 +5,60 @@ Kubernetes service component :
 - delete()
 - deploy()
 - exists()
+- patch()
+- read()
 - update()
 """
 import logging
 from kubernetes import client
 from kubernetes.client.rest import ApiException
+import defournement.metrics
+from defournement.throttle import CircuitOpen
+import defournement.utils
+from defournement.components.base import Component
+import defournement.manifests
 
 LOGGER = logging.getLogger(__name__)
 
-class Service(object):
+class Service(Component):
+    kind = 'service'
+    compiler = staticmethod(defournement.manifests.service)
 
-    def __init__(self, definition):
+    def __init__(self, definition, api_client=None):
         """
         Initialize the definition.
+        :param definition: The application definition.
+        :type definition: dict
+        :param api_client: The kubernetes API client. Default to the process-wide one of the definition cluster.
+        :type api_client: kubernetes.client.ApiClient
         """
         self.definition = definition
+        self.api_client = api_client or defournement.utils.api_client(definition.get('cluster'))
 
-    def exists(self):
+    @defournement.metrics.component('read')
+    def read(self):
         """
-        Check if a service already exists.
-        :rtype: bool
+        Read the live service.
+        :raises: ApiException
         """
-        v1api = client.CoreV1Api()
-        try:
-            v1api.read_namespaced_service(
-                name=self.definition['repo'],
-                namespace=self.definition['namespace'])
-        except:
-            LOGGER.exception('Namespace does not exist')
-            return False
-        return True
+        v1api = client.CoreV1Api(self.api_client)
+        return v1api.read_namespaced_service(
+            name=self.definition['repo'],
+            namespace=self.definition['namespace'])
+
+    @defournement.metrics.component('patch')
+    def patch(self, body):
+        """
+        Patch the live service.
+        :param body: The JSON patch operations.
+        :type body: list
+        :raises: ApiException
+        """
+        v1api = client.CoreV1Api(self.api_client)
+        return v1api.patch_namespaced_service(
+            name=self.definition['repo'],
+            namespace=self.definition['namespace'],
+            body=body)
 
     def specifications(self):
         """
@@ -59,54 +83,60 @@ class Service(object):
                 spec=spec
         )
 
-    def create(self):
+    @defournement.metrics.component('create')
+    def create(self, manifest=None):
         """
         Create a service resource.
+        :param manifest: The manifest to apply. Default to the current one.
+        :type manifest: dict
         :returns: The service creation status.
         :rtype: bool
         """
         #1. Retrieve the spec
-        service = self.specifications()
+        service = manifest or self.manifest()
         #2. Apply
         try:
-            v1api = client.CoreV1Api()
+            v1api = client.CoreV1Api(self.api_client)
             v1api.create_namespaced_service(self.definition['namespace'], body=service)
+        except ApiException as exc:
+            if exc.status == 409:
+                return self.conflict(service)
+            LOGGER.error(exc)
+            return False
+        except CircuitOpen:
+            raise
         except:
             LOGGER.exception('Cannot create the service')
             return False
         return True
 
-    def update(self):
+    @defournement.metrics.component('update')
+    def update(self, manifest=None):
         """
         Update a service resource.
+        :param manifest: The manifest to apply. Default to the current one.
+        :type manifest: dict
         :returns: The service creation status.
         :rtype: bool
         """
         #1. Retrieve the spec
-        service = self.specifications()
+        service = manifest or self.manifest()
         #2. Apply
         try:
-            v1api = client.CoreV1Api()
+            v1api = client.CoreV1Api(self.api_client)
             v1api.patch_namespaced_service(
                 name=self.definition['repo'],
                 namespace=self.definition['namespace'],
                 body=service
             )
+        except CircuitOpen:
+            raise
         except:
             LOGGER.exception('Cannot update the service')
             return False
         return True
 
-    def deploy(self):
-        """
-        Deploy a service.
-        :returns: The deploy status.
-        :rtype: bool
-        """
-        if not self.exists():
-            return self.create()
-        return self.update()
-
+    @defournement.metrics.component('delete')
     def delete(self):
         """
         Delete a service.
@@ -0,0 +1,142 @@
+#-*- coding:utf-8 -*-
+"""
+AMQP consumers apart from farine's:
+- BatchConsumer
+- consume()
+- WaitServer
+- method()
+"""
+import collections
+import contextlib
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+import farine.discovery
+from farine.connectors import sql
+from farine.amqp.consumer import Consumer
+from farine.rpc.server import Server
+
+LOGGER = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+_WAITS = {'pid': None, 'pool': None}
+
+class BatchConsumer(Consumer):
+    """
+    Consumer whose messages are acked once their batch is processed, after the callback returned:
+    - the prefetch lets a whole batch be delivered unacked.
+    - the `settle()` method of the callback owner is called on the consumer thread,
+      at least every second: the kombu channels are not thread-safe.
+    """
+
+    @property
+    def prefetch_count(self):
+        """
+        Settings:
+         - create_prefetch : the number of unacked messages delivered. Default to twice `create_batch_size`,
+                             unlimited without batches.
+        """
+        size = int(self.settings.get('create_batch_size', 1))
+        if size <= 1:
+            return None
+        return int(self.settings.get('create_prefetch') or 2 * size)
+
+    def on_iteration(self):
+        settle = getattr(getattr(self.callback, '__self__', None), 'settle', None)
+        if settle is not None:
+            settle()
+
+def consume(*args, **kwargs):
+    """
+    `farine.amqp.consume()`, with a `BatchConsumer`.
+    """
+    def wrapper(method):
+        farine.discovery.ENTRYPOINTS.append((BatchConsumer, method, args, kwargs))
+        def subwrapper(self, *args, **kwargs):
+            LOGGER.info('Received message : %s %s , call %s.', args, kwargs, method.__name__)
+            return method(self, *args, **kwargs)
+        return subwrapper
+    return wrapper
+
+class _Deferred(object):
+    """
+    A message acked once its call is served, on the consumer thread: only its properties are read meanwhile.
+    """
+
+    def __init__(self, message):
+        self.properties = dict(message.properties)
+
+    def ack(self):
+        pass
+
+class WaitServer(Server):
+    """
+    RPC server whose calls block, e.g. `wait()`: each call is served and replied to
+    on the process-wide waits pool, then acked on the consumer thread, at least every second.
+    The unacked calls are bounded by the prefetch, as many as the pool threads: a call
+    delivered starts at once, the others stay in the queue. A call interrupted
+    by the process end is redelivered: the blocking calls must be read-only.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(WaitServer, self).__init__(*args, **kwargs)
+        self.settled = collections.deque()
+
+    @property
+    def prefetch_count(self):
+        """
+        Settings:
+         - wait_concurrency : the number of blocking calls served at once, per process. Default to 64.
+        """
+        return int(self.settings.get('wait_concurrency', 64))
+
+    def main_callback(self, result, message):#pylint:disable=arguments-differ
+        with _LOCK:
+            #Threads do not survive a fork.
+            if _WAITS['pid'] != os.getpid():
+                _WAITS['pool'] = ThreadPool(self.prefetch_count)
+                _WAITS['pid'] = os.getpid()
+            pool = _WAITS['pool']
+        pool.apply_async(self._serve, (result, message))
+
+    def _serve(self, result, message):
+        """
+        Serve a call on a thread of the pool, then hand its message to the consumer thread.
+        """
+        try:
+            Server.main_callback(self, result, _Deferred(message))
+        finally:
+            self.settled.append(message)
+
+    def on_iteration(self):
+        while self.settled:
+            self.settled.popleft().ack()
+
+    @contextlib.contextmanager
+    def database(self):
+        """
+        `Server.database()` for concurrent calls: each one connects its own database, from its own thread,
+        instead of sharing the `db` of the service instance.
+        """
+        db = sql.setup(self.settings)
+        if db:
+            sql.init('.'.join(self.callback.__self__.__module__.split('.')[:-1]), db)
+            db.connect()
+        try:
+            yield
+        finally:
+            if db:
+                db.close()
+
+def method(*args, **kwargs):
+    """
+    `farine.rpc.method()`, with a `WaitServer`.
+    """
+    def wrapper(_method):
+        farine.discovery.ENTRYPOINTS.append((WaitServer, _method, args, kwargs))
+        def subwrapper(self, *args, **kwargs):
+            LOGGER.info('Received message : %s %s , call %s.', args, kwargs, _method.__name__)
+            return _method(self, *args, **kwargs)
+        return subwrapper
+    return wrapper
@@ -0,0 +1,251 @@
+#-*- coding:utf-8 -*-
+"""
+Coordination of the watch replicas, through the database:
+- coordinator()
+- Leader : a single replica watches, the others stand by.
+- Shards : the namespaces are spread over the live replicas.
+"""
+import logging
+import socket
+import threading
+import farine.settings
+from farine.connectors import sql
+from defournement.clusters import HashRing
+from defournement.models import WatchMember
+
+LOGGER = logging.getLogger(__name__)
+
+#pg_advisory_lock key of the watch leader.
+LEADER_KEY = 0x646567
+
+def member_name():
+    """
+    The name of this replica.
+    Settings:
+     - coordination_member : the replica name, stable across restarts to resume its watch. Default to the hostname.
+    :rtype: str
+    """
+    return farine.settings.defournement.get('coordination_member') or socket.gethostname()
+
+class Coordinator(object):
+    """
+    Decide what this replica watches, from a heartbeat thread.
+    `generation` is incremented on every change: the watch then relists.
+    The heartbeat runs on a database of its own: farine binds the models
+    to a new one on every call, which would move the session under its locks.
+    The subclasses implement :
+    - tick() : called every `interval` seconds by the heartbeat thread, raises on failure.
+    - lost() : called when a tick failed, must stop watching.
+    - release() : called by the heartbeat thread once stopped.
+    - active() : whether this replica has something to watch.
+    - owns(namespace) : whether this replica writes the statuses of a namespace.
+    """
+    #Name suffixing the watch state: each member resumes its own version.
+    state_suffix = None
+
+    def __init__(self, interval=2.0):
+        """
+        :param interval: The heartbeat interval, in seconds.
+        :type interval: float
+        """
+        self.interval = interval
+        self.generation = 0
+        self.stopping = threading.Event()
+        self._changed = threading.Condition(threading.Lock())
+        self._thread = None
+        self.db = None
+
+    def start(self):
+        """
+        Start the heartbeat.
+        """
+        self.stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='coordination')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the heartbeat, and give up what this replica holds.
+        """
+        self.stopping.set()
+        with self._changed:
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1)
+
+    def _run(self):
+        """
+        Tick every `interval` seconds until stopped, then release.
+        The session of `database()` is the heartbeat thread one: it holds the locks.
+        """
+        while not self.stopping.is_set():
+            try:
+                self.tick()
+            except Exception:#pylint:disable=broad-except
+                LOGGER.exception('Coordination heartbeat failed')
+                self.lost()
+            self.stopping.wait(self.interval)
+        try:
+            self.release()
+        except Exception:#pylint:disable=broad-except
+            LOGGER.exception('Cannot release the coordination')
+
+    def database(self):
+        """
+        The database of the heartbeat, created on first use.
+        :rtype: peewee.Database
+        """
+        if self.db is None:
+            self.db = sql.setup(farine.settings.defournement)
+        return self.db
+
+    def close(self):
+        """
+        Close the heartbeat connection for good: it may still hold a lock,
+        it is never handed back to the pool.
+        """
+        if self.db is not None and not self.db.is_closed():
+            getattr(self.db, 'manual_close', self.db.close)()
+
+    def _bump(self):
+        """
+        Signal a change to the watch.
+        """
+        with self._changed:
+            self.generation += 1
+            self._changed.notify_all()
+
+    def wait_active(self, stopping):
+        """
+        Block until this replica has something to watch, or `stopping` is set.
+        :param stopping: The watch stop event.
+        :type stopping: threading.Event
+        """
+        with self._changed:
+            while not self.active() and not stopping.is_set() and not self.stopping.is_set():
+                self._changed.wait(self.interval)
+
+class Leader(Coordinator):
+    """
+    Hold a session advisory lock: the lock is released as soon as the
+    leader connection dies, and a standby replica takes over on its next tick.
+    """
+
+    def __init__(self, interval=2.0):
+        super(Leader, self).__init__(interval)
+        self.leader = False
+
+    def tick(self):
+        """
+        Try to take the lock, or check the connection still holds it.
+        """
+        db = self.database()
+        if self.leader:
+            db.execute_sql('SELECT 1')
+            return
+        if db.execute_sql('SELECT pg_try_advisory_lock(%s)', (LEADER_KEY,)).fetchone()[0]:
+            LOGGER.info('Watch leadership acquired by %s', member_name())
+            self.leader = True
+            self._bump()
+
+    def lost(self):
+        """
+        The connection failed: the lock is gone with it.
+        """
+        if self.leader:
+            LOGGER.warning('Watch leadership lost by %s', member_name())
+            self.leader = False
+            self._bump()
+        self.close()
+
+    def release(self):
+        if self.leader:
+            self.leader = False
+            self.database().execute_sql('SELECT pg_advisory_unlock(%s)', (LEADER_KEY,))
+        self.close()
+
+    def active(self):
+        return self.leader
+
+    def owns(self, namespace):
+        return self.leader
+
+class Shards(Coordinator):
+    """
+    Heartbeat in the members table, and own the namespaces the consistent
+    hash ring of the live members places on this replica.
+    """
+
+    def __init__(self, interval=2.0, ttl=10.0):
+        """
+        :param interval: The heartbeat interval, in seconds.
+        :type interval: float
+        :param ttl: The heartbeat age after which a member is dead, in seconds.
+        :type ttl: float
+        """
+        super(Shards, self).__init__(interval)
+        self.ttl = ttl
+        self.name = member_name()
+        self.state_suffix = self.name
+        self.members = []
+        self.ring = None
+
+    def tick(self):
+        """
+        Heartbeat, then rebalance if the live members changed.
+        """
+        db = self.database()
+        WatchMember.heartbeat(self.name, db)
+        members = WatchMember.alive(self.ttl, db)
+        if self.name not in members:
+            members = sorted(members + [self.name])
+        if members != self.members:
+            LOGGER.info('Watch members: %s', ', '.join(members))
+            self.ring = HashRing(members)
+            self.members = members
+            self._bump()
+
+    def lost(self):
+        """
+        The heartbeat failed: the others will take this replica namespaces
+        over, so stop writing until it is back.
+        """
+        if self.ring is not None:
+            self.ring = None
+            self.members = []
+            self._bump()
+        self.close()
+
+    def release(self):
+        WatchMember.leave(self.name, self.database())
+        self.close()
+
+    def active(self):
+        return self.ring is not None
+
+    def owns(self, namespace):
+        ring = self.ring
+        return ring is not None and ring.get(namespace) == self.name
+
+def coordinator():
+    """
+    Build the coordinator of the watch.
+    Settings:
+     - watch_coordination : none, leader or shard. Default to none: every replica watches everything.
+     - coordination_interval : the heartbeat interval, in seconds. Default to 2.
+     - coordination_ttl : the heartbeat age after which a shard member is dead, in seconds. Default to 10.
+    :returns: The coordinator, not started, None if disabled.
+    :rtype: Coordinator
+    """
+    settings = farine.settings.defournement
+    mode = settings.get('watch_coordination', 'none').lower()
+    interval = float(settings.get('coordination_interval', 2))
+    if mode == 'leader':
+        return Leader(interval)
+    if mode == 'shard':
+        return Shards(interval, float(settings.get('coordination_ttl', 10)))
+    if mode != 'none':
+        LOGGER.error('Unknown watch_coordination %s: disabled', mode)
+    return None
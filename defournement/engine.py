@@ -0,0 +1,68 @@
+#-*- coding:utf-8 -*-
+"""
+Concurrent execution engine, keeping many rollouts in flight per process:
+- api_slot()
+- submit()
+- spawn()
+"""
+import contextlib
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+import farine.settings
+
+_LOCK = threading.Lock()
+_POOL = {'pid': None, 'pool': None}
+_COMPONENTS = {'pid': None, 'pool': None}
+_SLOTS = {'pid': None, 'slots': None}
+
+def submit(func, *args):
+    """
+    Run `func` on the process-wide rollouts pool.
+    Settings:
+     - rollout_concurrency : the number of rollouts in flight. Default to 256.
+    :returns: The pending result.
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    with _LOCK:
+        #Threads do not survive a fork.
+        if _POOL['pid'] != os.getpid():
+            _POOL['pool'] = ThreadPool(int(farine.settings.defournement.get('rollout_concurrency', 256)))
+            _POOL['pid'] = os.getpid()
+        pool = _POOL['pool']
+    return pool.apply_async(func, args)
+
+def spawn(func, *args):
+    """
+    Run `func` on the process-wide components pool, apart from the rollouts one:
+    a rollout waits for its components without holding one of their threads.
+    The components are not capped, their API requests are: see `api_slot()`.
+    Settings:
+     - component_concurrency : the number of components deployed at once. Default to three per rollout in flight.
+    :returns: The pending result.
+    :rtype: multiprocessing.pool.AsyncResult
+    """
+    with _LOCK:
+        if _COMPONENTS['pid'] != os.getpid():
+            settings = farine.settings.defournement
+            size = settings.get('component_concurrency') or 3 * int(settings.get('rollout_concurrency', 256))
+            _COMPONENTS['pool'] = ThreadPool(int(size))
+            _COMPONENTS['pid'] = os.getpid()
+        pool = _COMPONENTS['pool']
+    return pool.apply_async(func, args)
+
+@contextlib.contextmanager
+def api_slot():
+    """
+    Hold one of the process-wide API request slots: a global limit
+    on the requests in flight, whatever the number of rollouts.
+    Settings:
+     - api_concurrency : the number of API requests in flight. Default to 64.
+    """
+    with _LOCK:
+        if _SLOTS['pid'] != os.getpid():
+            _SLOTS['slots'] = threading.BoundedSemaphore(int(farine.settings.defournement.get('api_concurrency', 64)))
+            _SLOTS['pid'] = os.getpid()
+        slots = _SLOTS['slots']
+    with slots:
+        yield
@@ -0,0 +1,60 @@
+#-*- coding:utf-8 -*-
+"""
+Watch events decoding:
+- RawWatch
+- summary()
+The watch only reads a few fields of each deployment: decoding the
+whole model, pod template, containers and probes included, is most of its CPU.
+"""
+import collections
+import datetime
+from kubernetes import watch
+
+#The fields of a deployment the watch reads.
+Summary = collections.namedtuple('Summary', ['kind', 'namespace', 'name', 'resource_version', 'labels', 'unavailable_replicas', 'updates'])
+
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+class RawWatch(watch.Watch):
+    """
+    Watch yielding the objects as decoded from the JSON lines, without building the models.
+    """
+
+    def get_return_type(self, func):
+        return None
+
+def _parse_time(value):
+    """
+    Parse a kubernetes timestamp, as a naive UTC datetime.
+    :returns: The datetime, None if invalid.
+    """
+    try:
+        return datetime.datetime.strptime(value, _TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+def _raw_summary(obj):
+    metadata = obj.get('metadata') or {}
+    status = obj.get('status') or {}
+    updates = [_parse_time(condition.get('lastUpdateTime')) for condition in status.get('conditions') or []]
+    return Summary(obj.get('kind'), metadata.get('namespace'), metadata.get('name'), metadata.get('resourceVersion'),
+                   metadata.get('labels'), status.get('unavailableReplicas'), [update for update in updates if update is not None])
+
+def _model_summary(obj):
+    conditions = getattr(obj.status, 'conditions', None)
+    updates = []
+    if isinstance(conditions, list):
+        updates = [condition.last_update_time for condition in conditions if isinstance(condition.last_update_time, datetime.datetime)]
+    return Summary(obj.kind, obj.metadata.namespace, obj.metadata.name, obj.metadata.resource_version,
+                   obj.metadata.labels, getattr(obj.status, 'unavailable_replicas', None), updates)
+
+def summary(obj):
+    """
+    Extract the fields the watch reads from a deployment.
+    :param obj: The deployment, raw or model.
+    :type obj: dict or client.ExtensionsV1beta1Deployment
+    :rtype: Summary
+    """
+    if isinstance(obj, dict):
+        return _raw_summary(obj)
+    return _model_summary(obj)
@@ -0,0 +1,249 @@
+#-*- coding:utf-8 -*-
+"""
+Informer: local cache of the cluster objects, kept up to date by a watch.
+- informer()
+- Informer.start()
+- Informer.add_listener()
+- Informer.get()
+- Informer.has_synced()
+"""
+import logging
+import os
+import random
+import threading
+import farine.settings
+from kubernetes import client, watch
+from kubernetes.client.rest import ApiException
+import defournement.clusters
+import defournement.utils
+
+LOGGER = logging.getLogger(__name__)
+
+#kind: (API, list method)
+KINDS = {
+    'deployment': ('ExtensionsV1beta1Api', 'list_deployment_for_all_namespaces'),
+    'ingress': ('ExtensionsV1beta1Api', 'list_ingress_for_all_namespaces'),
+    'namespace': ('CoreV1Api', 'list_namespace'),
+    'service': ('CoreV1Api', 'list_service_for_all_namespaces'),
+}
+
+_LOCK = threading.Lock()
+_INFORMER = {'pid': None, 'informers': {}}
+
+def informer(cluster=None):
+    """
+    Retrieve the process-wide informer of a cluster, started on first use.
+    Settings:
+     - informer : enable the informer. Default to false.
+    :param cluster: The cluster name. Default to the first one.
+    :type cluster: str
+    :returns: The informer, None if disabled.
+    :rtype: Informer
+    """
+    if farine.settings.defournement.get('informer', 'false').lower() != 'true':
+        return None
+    cluster = defournement.clusters.resolve(cluster)
+    with _LOCK:
+        #Threads do not survive a fork.
+        if _INFORMER['pid'] != os.getpid():
+            _INFORMER['informers'] = {}
+            _INFORMER['pid'] = os.getpid()
+        if cluster not in _INFORMER['informers']:
+            exclude = farine.settings.defournement['exclude_namespaces'].split(',')
+            _INFORMER['informers'][cluster] = Informer(defournement.utils.api_client(cluster), exclude).start()
+        return _INFORMER['informers'][cluster]
+
+class Store(object):
+    """
+    Thread-safe objects store, indexed by (namespace, name).
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._objects)
+
+    @staticmethod
+    def key(obj):
+        """
+        The index of an object.
+        :rtype: tuple
+        """
+        return (obj.metadata.namespace, obj.metadata.name)
+
+    def replace(self, objects):
+        """
+        Replace the whole content, after a list.
+        """
+        objects = dict((self.key(obj), obj) for obj in objects)
+        with self._lock:
+            self._objects = objects
+
+    def apply(self, event_type, obj):
+        """
+        Apply a watch event.
+        """
+        with self._lock:
+            if event_type == 'DELETED':
+                self._objects.pop(self.key(obj), None)
+            else:
+                self._objects[self.key(obj)] = obj
+
+    def get(self, namespace, name):
+        """
+        Retrieve an object.
+        :returns: The object, None if missing.
+        """
+        return self._objects.get((namespace, name))
+
+class Informer(object):
+    """
+    List then watch each kind of object in a thread,
+    to answer the reads from memory.
+    """
+
+    def __init__(self, api_client, exclude_namespaces=None, kinds=None):
+        """
+        Initialize the stores.
+        :param api_client: The kubernetes API client.
+        :type api_client: kubernetes.client.ApiClient
+        :param exclude_namespaces: The namespaces to ignore.
+        :type exclude_namespaces: list
+        :param kinds: The kinds to watch. Default to all the KINDS.
+        :type kinds: list
+        """
+        self.api_client = api_client
+        self.exclude_namespaces = set(exclude_namespaces or [])
+        self.kinds = kinds or sorted(KINDS)
+        self.stores = dict((kind, Store()) for kind in self.kinds)
+        self.synced = dict((kind, threading.Event()) for kind in self.kinds)
+        self.listeners = []
+        self.stopping = threading.Event()
+
+    def add_listener(self, callback):
+        """
+        Register a callback, called with (kind, event type, object) on each event,
+        and with (kind, 'SYNC', None) after each list.
+        :param callback: The callback.
+        :type callback: callable
+        """
+        self.listeners.append(callback)
+
+    def _notify(self, kind, event_type, obj):
+        """
+        Call the listeners, never raising.
+        """
+        for listener in self.listeners:
+            try:
+                listener(kind, event_type, obj)
+            except Exception:#pylint:disable=broad-except
+                LOGGER.exception('Informer listener failed')
+
+    def start(self):
+        """
+        Start one reflector thread per kind.
+        """
+        for kind in self.kinds:
+            thread = threading.Thread(target=self._reflect, args=(kind,), name='informer-{}'.format(kind))
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the reflectors, at the end of their current stream.
+        """
+        self.stopping.set()
+
+    def has_synced(self, kind):
+        """
+        Check if the store of `kind` holds a full list.
+        :rtype: bool
+        """
+        return kind in self.synced and self.synced[kind].is_set()
+
+    def get(self, kind, namespace, name):
+        """
+        Retrieve an object from the store.
+        :param kind: The object kind.
+        :type kind: str
+        :param namespace: The object namespace, None for a namespace.
+        :type namespace: str
+        :param name: The object name.
+        :type name: str
+        :returns: The object, None if missing.
+        """
+        return self.stores[kind].get(namespace, name)
+
+    def _ignored(self, kind, obj):
+        """
+        Check if the object is or belongs to an excluded namespace.
+        """
+        if kind == 'namespace':
+            return obj.metadata.name in self.exclude_namespaces
+        return obj.metadata.namespace in self.exclude_namespaces
+
+    def _selectors(self, kind):
+        """
+        The server-side filter of the excluded namespaces.
+        :returns: The list keyword arguments.
+        :rtype: dict
+        """
+        selector = defournement.utils.exclude_selector(self.exclude_namespaces, 'metadata.name' if kind == 'namespace' else 'metadata.namespace')
+        return {'field_selector': selector} if selector else {}
+
+    def _list(self, kind):
+        """
+        List the objects of `kind`, page by page, and replace its store.
+        :returns: The resource version to watch from.
+        :rtype: str
+        """
+        api, method = KINDS[kind]
+        method = getattr(getattr(client, api)(self.api_client), method)
+        objects = []
+        kwargs = dict(self._selectors(kind), limit=500)
+        while True:
+            result = method(**kwargs)
+            for obj in result.items:
+                if not self._ignored(kind, obj):
+                    objects.append(obj)
+            if not result.metadata._continue:#pylint:disable=protected-access
+                break
+            kwargs['_continue'] = result.metadata._continue#pylint:disable=protected-access
+        self.stores[kind].replace(objects)
+        self.synced[kind].set()
+        self._notify(kind, 'SYNC', None)
+        return result.metadata.resource_version
+
+    def _reflect(self, kind):
+        """
+        Keep the store of `kind` up to date until stopped.
+        """
+        api, method = KINDS[kind]
+        method = getattr(getattr(client, api)(self.api_client), method)
+        timeout = int(farine.settings.defournement.get('watch_timeout', 300))
+        version = None
+        failures = 0
+        while not self.stopping.is_set():
+            try:
+                if version is None:
+                    version = self._list(kind)
+                for event in watch.Watch().stream(method, resource_version=version, timeout_seconds=timeout, _request_timeout=timeout + 30, **self._selectors(kind)):
+                    if event['type'] == 'ERROR':
+                        raw = event.get('raw_object') or {}
+                        raise ApiException(status=raw.get('code'), reason=raw.get('message'))
+                    obj = event['object']
+                    version = obj.metadata.resource_version
+                    if not self._ignored(kind, obj):
+                        self.stores[kind].apply(event['type'], obj)
+                        self._notify(kind, event['type'], obj)
+                failures = 0
+            except Exception as exc:#pylint:disable=broad-except
+                #410 Gone or unknown state: relist.
+                if not (isinstance(exc, ApiException) and exc.status == 410):
+                    LOGGER.exception('Informer %s interrupted', kind)
+                    failures += 1
+                    self.stopping.wait(min(60, 2 ** failures) * random.uniform(0.5, 1))
+                version = None
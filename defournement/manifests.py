@@ -0,0 +1,102 @@
+#-*- coding:utf-8 -*-
+"""
+Manifest compiler: renders a definition straight into the JSON-ready dict
+the kubernetes client would serialize from the components specifications(),
+without building the client models.
+- deployment()
+- ingress()
+- service()
+"""
+
+#Invariant parts, shared by every manifest: never mutate them.
+_RESOURCES = {'cpu': '100m', 'memory': '100Mi'}
+_SECURITY = {'allowPrivilegeEscalation': False, 'runAsNonRoot': True}
+_STRATEGY = {'type': 'RollingUpdate', 'rollingUpdate': {'maxSurge': 1, 'maxUnavailable': 1}}
+
+def _model(**attributes):
+    """
+    A serialized client model: its None attributes are left out.
+    """
+    return dict((key, value) for key, value in attributes.items() if value is not None)
+
+def _probe(definition, health):
+    """
+    The readiness or liveness probe.
+    """
+    _exec, tcp_socket, http_get = None, None, None
+    if health['command'] == 'COMMAND':
+        _exec = _model(command=health['value'])
+    elif health['command'] == 'TCP':
+        tcp_socket = _model(port=health['port'])
+    else:
+        http_get = _model(path=health['path'], port=health['port'], scheme=health['command'])
+    probe = _model(failureThreshold=definition['failure_threshold'],
+                   initialDelaySeconds=definition['initial_delay_seconds'],
+                   periodSeconds=definition['interval_seconds'],
+                   successThreshold=definition['success_threshold'],
+                   timeoutSeconds=definition['timeout_seconds'],
+                   tcpSocket=tcp_socket,
+                   httpGet=http_get)
+    if _exec is not None:
+        probe['exec'] = _exec
+    return probe
+
+def deployment(definition):
+    """
+    Render the deployment manifest, as `components.Deployment.specifications()`.
+    :param definition: The application definition.
+    :type definition: dict
+    :rtype: dict
+    """
+    repo = definition['repo']
+    readiness, liveness = None, None
+    for health in definition['healthchecks']:
+        if health['type'] == 'readiness':
+            readiness = _probe(definition, health)
+        else:
+            liveness = _probe(definition, health)
+    container = _model(name=repo,
+                       image=definition['tag'],
+                       ports=[_model(containerPort=port['number'], protocol=port['protocol']) for port in definition['ports']],
+                       resources={'limits': _RESOURCES, 'requests': _RESOURCES},
+                       readinessProbe=readiness,
+                       livenessProbe=liveness,
+                       securityContext=_SECURITY)
+    template = {
+        'metadata': {'labels': {'name': repo, 'repo': repo, 'owner': definition['owner'], 'branch': definition['branch'], 'fullname': definition['name']}},
+        'spec': {'containers': [container]},
+    }
+    return {
+        'apiVersion': 'extensions/v1beta1',
+        'kind': 'Deployment',
+        'metadata': {'name': repo, 'labels': {'uid': definition['uid'], 'repo': repo, 'owner': definition['owner'], 'branch': definition['branch'], 'fullname': definition['name'], 'name': repo}},
+        'spec': {'replicas': 1, 'strategy': _STRATEGY, 'template': template},
+    }
+
+def service(definition):
+    """
+    Render the service manifest, as `components.Service.specifications()`.
+    :param definition: The application definition.
+    :type definition: dict
+    :rtype: dict
+    """
+    repo = definition['repo']
+    ports = [_model(port=port['number'], targetPort=port['number'], protocol=port['protocol']) for port in definition['ports']]
+    return {
+        'metadata': {'name': repo},
+        'spec': {'type': 'ClusterIP', 'ports': ports, 'selector': {'name': repo}},
+    }
+
+def ingress(definition):
+    """
+    Render the ingress manifest, as `components.Ingress.specifications()`.
+    :param definition: The application definition.
+    :type definition: dict
+    :rtype: dict
+    """
+    repo = definition['repo']
+    paths = [{'path': '/', 'backend': {'serviceName': repo, 'servicePort': port['number']}} for port in definition['ports']]
+    return {
+        'metadata': {'name': repo},
+        'spec': {'rules': [_model(host=definition['domain_name'], http={'paths': paths})]},
+    }
@@ -0,0 +1,362 @@
+#-*- coding:utf-8 -*-
+"""
+Process-wide metrics, in the Prometheus text format:
+- Counter
+- Gauge
+- Histogram
+- render()
+- start()
+The updates only take a per-child lock: they are safe on the hot paths.
+"""
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+import farine.settings
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_LOCK = threading.Lock()
+_REGISTRY = []
+_STARTED = {'pid': None}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    """
+    Format a labels set.
+    """
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append('{}="{}"'.format(extra[0], extra[1]))
+    return '{{{}}}'.format(','.join(pairs)) if pairs else ''
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class Metric(object):
+    """
+    A metric, and its children by label values.
+    The subclasses set `kind` and implement :
+    - _child() : a new child, for a label values set.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Register the metric.
+        :param name: The metric name.
+        :type name: str
+        :param documentation: The metric help.
+        :type documentation: str
+        :param labelnames: The label names.
+        :type labelnames: tuple
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _LOCK:
+            _REGISTRY.append(self)
+
+    def labels(self, *values):
+        """
+        The child of a label values set, created on first use.
+        """
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def samples(self):
+        """
+        The (suffix, label values, extra label, value) samples.
+        """
+        for values, child in sorted(self._children.items()):
+            for suffix, extra, value in child.samples():
+                yield suffix, values, extra, value
+
+    def render(self):
+        """
+        The metric, in the Prometheus text format.
+        :rtype: str
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix, values, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, _labels(self.labelnames, values, extra), _number(value)))
+        return '\n'.join(lines)
+
+class _Value(object):
+    """
+    A counter or gauge child, optionally read from a function.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = float(value)
+
+    def set_function(self, function):
+        """
+        Read the value from `function` when rendered.
+        """
+        self.function = function
+
+    def samples(self):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:#pylint:disable=broad-except
+                LOGGER.exception('Cannot read a metric')
+                return
+        yield '', None, value
+
+class Counter(Metric):
+    """
+    A monotonic counter.
+    """
+    kind = 'counter'
+
+    def _child(self):
+        return _Value()
+
+class Gauge(Metric):
+    """
+    A value that goes up and down.
+    """
+    kind = 'gauge'
+
+    def _child(self):
+        return _Value()
+
+class _Buckets(object):
+    """
+    A histogram child.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Record an observation.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        """
+        Observe the duration of a block, in seconds.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start)
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield '_bucket', ('le', _number(bound)), cumulative
+        yield '_sum', None, total
+        yield '_count', None, cumulative
+
+class Histogram(Metric):
+    """
+    Observations counted in fixed buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: The buckets upper bounds, sorted.
+        :type buckets: tuple
+        """
+        self.buckets = tuple(buckets)
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+def rpc(name):
+    """
+    Decorator recording the duration and the failures of an RPC or consumer method.
+    :param name: The method name.
+    :type name: str
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with RPC_SECONDS.labels(name).time():
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    RPC_FAILURES.labels(name).inc()
+                    raise
+        return wrapper
+    return decorator
+
+def component(operation, checked=True):
+    """
+    Decorator recording the duration and the failures of a component call.
+    :param operation: The operation name.
+    :type operation: str
+    :param checked: A False result is a failure.
+    :type checked: bool
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with COMPONENT_SECONDS.labels(self.kind, operation).time():
+                try:
+                    result = func(self, *args, **kwargs)
+                except Exception:
+                    COMPONENT_FAILURES.labels(self.kind, operation).inc()
+                    raise
+            if checked and result is False:
+                COMPONENT_FAILURES.labels(self.kind, operation).inc()
+            return result
+        return wrapper
+    return decorator
+
+def render():
+    """
+    All the metrics, in the Prometheus text format.
+    :rtype: str
+    """
+    with _LOCK:
+        metrics = list(_REGISTRY)
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Serve the metrics on any path.
+    """
+
+    def do_GET(self):#pylint:disable=invalid-name
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):#pylint:disable=arguments-differ
+        pass
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def serve(port, host='127.0.0.1'):
+    """
+    Serve the metrics over HTTP, from a thread.
+    :param port: The port.
+    :type port: int
+    :returns: The server.
+    """
+    server = _Server((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http')
+    thread.daemon = True
+    thread.start()
+    return server
+
+def write_textfile(path):
+    """
+    Write the metrics in a file, atomically, for the node exporter textfile collector.
+    :param path: The file path.
+    :type path: str
+    """
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as output:
+        output.write(render())
+    os.rename(tmp, path)
+
+def _write_forever(path, interval):
+    while True:
+        try:
+            write_textfile(path)
+        except Exception:#pylint:disable=broad-except
+            LOGGER.exception('Cannot write the metrics in %s', path)
+        time.sleep(interval)
+
+def start():
+    """
+    Expose the metrics of this process, once.
+    Settings:
+     - metrics_port : serve them over HTTP on this local port. Default to 0, disabled.
+     - metrics_host : the address to serve them on. Default to 127.0.0.1.
+     - metrics_textfile : write them in this file. Default to none.
+     - metrics_interval : the textfile refresh interval, in seconds. Default to 15.
+    """
+    settings = farine.settings.defournement
+    with _LOCK:
+        if _STARTED['pid'] == os.getpid():
+            return
+        _STARTED['pid'] = os.getpid()
+    port = int(settings.get('metrics_port', 0))
+    if port:
+        try:
+            serve(port, settings.get('metrics_host', '127.0.0.1'))
+        except socket.error:
+            LOGGER.exception('Cannot serve the metrics on port %s', port)
+    path = settings.get('metrics_textfile')
+    if path:
+        thread = threading.Thread(target=_write_forever, args=(path, float(settings.get('metrics_interval', 15))), name='metrics-textfile')
+        thread.daemon = True
+        thread.start()
+
+COMPONENT_SECONDS = Histogram('defournement_component_seconds', 'Duration of the component calls.', ('kind', 'operation'))
+COMPONENT_FAILURES = Counter('defournement_component_failures_total', 'Failed component calls.', ('kind', 'operation'))
+API_SECONDS = Histogram('defournement_api_request_seconds', 'Duration of the API server requests, retries included.', ('cluster', 'method'))
+API_RETRIES = Counter('defournement_api_retries_total', 'Retried API server requests.', ('cluster',))
+QUERY_SECONDS = Histogram('defournement_query_seconds', 'Duration of the database queries.', ('query',))
+RPC_SECONDS = Histogram('defournement_rpc_seconds', 'Duration of the RPC and consumer calls.', ('method',))
+RPC_FAILURES = Counter('defournement_rpc_failures_total', 'RPC and consumer calls that raised.', ('method',))
+WATCH_EVENTS = Counter('defournement_watch_events_total', 'Watch events received.', ('cluster', 'type'))
+WATCH_EVENT_AGE = Histogram('defournement_watch_event_age_seconds', 'Age of the deployment last update when its event is received.', ('cluster',))
+WATCH_LAG = Histogram('defournement_watch_lag_seconds', 'Delay between an event reception and its status write.')
+STATUS_BUFFER = Gauge('defournement_status_buffer_depth', 'Statuses waiting in the write buffer.')
+STATUS_CACHE = Counter('defournement_status_cache_total', 'Last status cache lookups.', ('result',))
+STATUS_WAITERS = Gauge('defournement_status_waiters', 'Clients waiting for a status transition.')
+RESPONSE_CACHE = Counter('defournement_response_cache_total', 'Responses cache lookups.', ('method', 'result'))
+RESPONSE_CACHE_SIZE = Gauge('defournement_response_cache_size', 'Responses kept in the cache.')
+SKIPPED_WRITES = Counter('defournement_status_skipped_writes_total', 'Watch statuses not written, being no transition.')
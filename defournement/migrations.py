@@ -0,0 +1,185 @@
+#-*- coding:utf-8 -*-
+"""
+Versioned schema migrations, applied in place:
+- migrate()
+- pending()
+"""
+import logging
+from defournement.models import Deployment, backfill_status
+
+LOGGER = logging.getLogger(__name__)
+
+#pg_advisory_lock key: only one replica migrates at a time.
+LOCK_KEY = 0x646566
+
+class Migration(object):
+    """
+    A schema version.
+    """
+
+    def __init__(self, version, description, statements=(), callback=None, concurrent_index=None):
+        """
+        :param version: The schema version, applied in increasing order.
+        :type version: int
+        :param description: What the migration does.
+        :type description: str
+        :param statements: The SQL statements.
+        :type statements: list
+        :param callback: Called after the statements, e.g. to backfill data.
+        :type callback: callable
+        :param concurrent_index: The index built concurrently by the statements, if any:
+                                 they then run outside of a transaction.
+        :type concurrent_index: str
+        """
+        self.version = version
+        self.description = description
+        self.statements = statements
+        self.callback = callback
+        self.concurrent_index = concurrent_index
+
+MIGRATIONS = [
+    Migration(1, 'Denormalized deployment status',
+              ['ALTER TABLE "deployment" ADD COLUMN IF NOT EXISTS "status" VARCHAR(255)'],
+              callback=backfill_status),
+    Migration(2, 'Watch state',
+              ['CREATE TABLE IF NOT EXISTS "watchstate" ("name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+               '"resource_version" VARCHAR(255) NOT NULL, "date_updated" TIMESTAMP DEFAULT NOW())']),
+    Migration(3, 'Deployment owner index',
+              ['CREATE INDEX CONCURRENTLY IF NOT EXISTS "deployment_owner_date_created" '
+               'ON "deployment" ("owner", "date_created" DESC)'],
+              concurrent_index='deployment_owner_date_created'),
+    Migration(4, 'Status uid index',
+              ['CREATE INDEX CONCURRENTLY IF NOT EXISTS "status_uid_id_date_created" '
+               'ON "status" ("uid_id", "date_created" DESC)'],
+              concurrent_index='status_uid_id_date_created'),
+    Migration(5, 'Deployment cluster',
+              ['ALTER TABLE "deployment" ADD COLUMN IF NOT EXISTS "cluster" VARCHAR(255)']),
+    Migration(6, 'Watch members',
+              ['CREATE TABLE IF NOT EXISTS "watchmember" ("name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+               '"date_heartbeat" TIMESTAMP NOT NULL DEFAULT NOW())']),
+    Migration(7, 'Rollout steps',
+              ['CREATE TABLE IF NOT EXISTS "rollout_step" ("id" SERIAL NOT NULL PRIMARY KEY, '
+               '"uid_id" VARCHAR(255) NOT NULL REFERENCES "deployment" ("uid") ON DELETE CASCADE, '
+               '"step" VARCHAR(255) NOT NULL, "duration" REAL NOT NULL, "api_calls" INTEGER NOT NULL, '
+               '"success" BOOLEAN NOT NULL, "date_created" TIMESTAMP NOT NULL DEFAULT NOW())',
+               'CREATE INDEX IF NOT EXISTS "rollout_step_uid_id" ON "rollout_step" ("uid_id")']),
+    #The keyset pages seek on (date_created, key): the key completes the index order.
+    Migration(8, 'Deployment owner index with the uid',
+              ['CREATE INDEX CONCURRENTLY IF NOT EXISTS "deployment_owner_date_created_uid" '
+               'ON "deployment" ("owner", "date_created" DESC, "uid" DESC)',
+               'DROP INDEX CONCURRENTLY IF EXISTS "deployment_owner_date_created"'],
+              concurrent_index='deployment_owner_date_created_uid'),
+    Migration(9, 'Status uid index with the id',
+              callback=lambda: _status_index(Deployment._meta.database),#pylint:disable=protected-access
+              concurrent_index='status_uid_id_date_created_id'),
+    Migration(10, 'Deployment namespace index',
+              ['CREATE INDEX CONCURRENTLY IF NOT EXISTS "deployment_namespace_date_created" '
+               'ON "deployment" ("namespace", "date_created" DESC)'],
+              concurrent_index='deployment_namespace_date_created'),
+    Migration(11, 'Rollout step date index',
+              ['CREATE INDEX CONCURRENTLY IF NOT EXISTS "rollout_step_date_created" '
+               'ON "rollout_step" ("date_created")'],
+              concurrent_index='rollout_step_date_created'),
+    #The retention only rolls up the statuses dated since its previous pass.
+    Migration(12, 'Status date index',
+              callback=lambda: _status_date_index(Deployment._meta.database),#pylint:disable=protected-access
+              concurrent_index='status_date_created'),
+]
+
+def _status_index(db):
+    """
+    Build the status index of the keyset pages. A partitioned table (see `defournement.retention`)
+    cannot build it concurrently: it is built on its parent, its partitions are small.
+    """
+    if db.execute_sql("SELECT relkind FROM pg_class WHERE relname = 'status' AND pg_table_is_visible(oid)").fetchone()[0] != 'p':
+        db.execute_sql('CREATE INDEX CONCURRENTLY IF NOT EXISTS "status_uid_id_date_created_id" '
+                       'ON "status" ("uid_id", "date_created" DESC, "id" DESC)')
+        db.execute_sql('DROP INDEX CONCURRENTLY IF EXISTS "status_uid_id_date_created"')
+        return
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "status_history_uid_id_date_created_id" '
+                   'ON "status" ("uid_id", "date_created" DESC, "id" DESC)')
+    db.execute_sql('DROP INDEX IF EXISTS "status_history_uid_id_date_created"')
+
+def _status_date_index(db):
+    """
+    Build the status index of the retention passes, on the parent of a partitioned table: see `_status_index()`.
+    """
+    if db.execute_sql("SELECT relkind FROM pg_class WHERE relname = 'status' AND pg_table_is_visible(oid)").fetchone()[0] != 'p':
+        db.execute_sql('CREATE INDEX CONCURRENTLY IF NOT EXISTS "status_date_created" ON "status" ("date_created")')
+        return
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "status_history_date_created" ON "status" ("date_created")')
+
+def _drop_invalid_index(db, name):
+    """
+    A failed concurrent build leaves an invalid index behind, that
+    IF NOT EXISTS would keep: drop it first.
+    """
+    cursor = db.execute_sql('SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+                            'WHERE pg_class.relname = %s AND NOT pg_index.indisvalid', (name,))
+    if cursor.fetchone():
+        db.execute_sql('DROP INDEX CONCURRENTLY IF EXISTS "{}"'.format(name))
+
+def _apply(db, migration):
+    """
+    Apply a migration and record its version.
+    """
+    record = ('INSERT INTO "schema_version" ("version", "description") VALUES (%s, %s)',
+              (migration.version, migration.description))
+    if migration.concurrent_index is None:
+        with db.atomic():
+            for statement in migration.statements:
+                db.execute_sql(statement)
+            if migration.callback:
+                migration.callback()
+            db.execute_sql(*record)
+        return
+    #CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    conn = db.get_conn()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        _drop_invalid_index(db, migration.concurrent_index)
+        for statement in migration.statements:
+            db.execute_sql(statement)
+        if migration.callback:
+            migration.callback()
+        db.execute_sql(*record)
+    finally:
+        conn.autocommit = autocommit
+
+def pending(db=None):
+    """
+    The versions not applied yet, e.g. by the migrate task of a replica starting.
+    :param db: The database. Default to the models one.
+    :rtype: list
+    """
+    db = db or Deployment._meta.database#pylint:disable=protected-access
+    applied = set()
+    #Read only: the migrate task creates the versions table.
+    if db.execute_sql("SELECT to_regclass('schema_version')").fetchone()[0] is not None:
+        applied = set(row[0] for row in db.execute_sql('SELECT "version" FROM "schema_version"').fetchall())
+    return sorted(migration.version for migration in MIGRATIONS if migration.version not in applied)
+
+def migrate(db=None):
+    """
+    Apply the pending migrations, holding an advisory lock.
+    :param db: The database. Default to the models one.
+    :returns: The versions applied.
+    :rtype: list
+    """
+    db = db or Deployment._meta.database#pylint:disable=protected-access
+    db.execute_sql('CREATE TABLE IF NOT EXISTS "schema_version" ("version" INTEGER NOT NULL PRIMARY KEY, '
+                   '"description" VARCHAR(255) NOT NULL, "date_applied" TIMESTAMP DEFAULT NOW())')
+    db.execute_sql('SELECT pg_advisory_lock(%s)', (LOCK_KEY,))
+    try:
+        applied = set(row[0] for row in db.execute_sql('SELECT "version" FROM "schema_version"').fetchall())
+        done = []
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version in applied:
+                continue
+            LOGGER.info('Migrating to %s: %s', migration.version, migration.description)
+            _apply(db, migration)
+            done.append(migration.version)
+        return done
+    finally:
+        db.execute_sql('SELECT pg_advisory_unlock(%s)', (LOCK_KEY,))
@@ -9,12 +9,17 @@ class Deployment(Model):
      - owner
      - namespace
      - name
+     - status : the latest status, denormalized from the Status table.
+     - cluster : the cluster it is deployed on, None for the first one.
      - date_created
+    Its indexes are created by the migrations: see `defournement.migrations`.
     """
     uid = UUIDField(primary_key=True)
     owner = CharField()
     namespace = CharField()
     name = CharField()
+    status = CharField(null=True)
+    cluster = CharField(null=True)
     date_created = DateTimeField(default=datetime.datetime.now)
 
 class Status(Model):
@@ -22,7 +27,213 @@ class Status(Model):
     Status table representation:
      - status : deploying, unhealthy, running, terminating, terminated, aborted
      - date_created
+    Its indexes are created by the migrations: see `defournement.migrations`.
     """
     uid = ForeignKeyField(Deployment)
     status = CharField()
     date_created = DateTimeField(default=datetime.datetime.now)
+
+    @classmethod
+    def record(cls, uid, status, date_created=None):
+        """
+        Insert a new status and keep `Deployment.status` in sync.
+        :param uid: The deployment uid.
+        :type uid: str
+        :param status: The new status.
+        :type status: str
+        :param date_created: The status date. Default to now.
+        :type date_created: datetime.datetime
+        :returns: The status created.
+        :rtype: Status
+        """
+        fields = {'uid': uid, 'status': status}
+        if date_created:
+            fields['date_created'] = date_created
+        with cls._meta.database.atomic():
+            row = cls.create(**fields)
+            Deployment.update(status=status).where(Deployment.uid == uid).execute()
+        return row
+
+    @classmethod
+    def record_many(cls, rows):
+        """
+        Insert statuses with a single multi-row insert, in one transaction,
+        and keep `Deployment.status` in sync.
+        :param rows: The statuses, as dicts with uid, status and date_created, oldest first.
+        :type rows: list
+        """
+        latest = {}
+        for row in rows:
+            latest[row['uid']] = row['status']
+        uids = {}
+        for uid, status in latest.items():
+            uids.setdefault(status, []).append(uid)
+        with cls._meta.database.atomic():
+            cls.insert_many(rows).execute()
+            for status, keys in uids.items():
+                Deployment.update(status=status).where(Deployment.uid << keys).execute()
+
+class RolloutStep(Model):
+    """
+    RolloutStep table representation, the timeline of a rollout:
+     - step : namespace, service, ingress, deployment
+     - duration : in seconds.
+     - api_calls : the API server requests sent, retries included.
+     - success
+     - date_created
+    """
+    uid = ForeignKeyField(Deployment)
+    step = CharField()
+    duration = FloatField()
+    api_calls = IntegerField()
+    success = BooleanField()
+    date_created = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        db_table = 'rollout_step'
+
+class WatchState(Model):
+    """
+    WatchState table representation:
+     - name : the watched resource.
+     - resource_version : the last processed resource version.
+     - date_updated
+    """
+    name = CharField(primary_key=True)
+    resource_version = CharField()
+    date_updated = DateTimeField(default=datetime.datetime.now)
+
+    @classmethod
+    def load(cls, name):
+        """
+        Retrieve the last processed resource version.
+        :param name: The watched resource.
+        :type name: str
+        :returns: The resource version, None if never watched.
+        :rtype: str
+        """
+        try:
+            return cls.get(cls.name == name).resource_version
+        except cls.DoesNotExist:
+            return None
+
+    @classmethod
+    def store(cls, name, resource_version):
+        """
+        Persist the last processed resource version.
+        :param name: The watched resource.
+        :type name: str
+        :param resource_version: The resource version.
+        :type resource_version: str
+        """
+        resource_version = str(resource_version)
+        updated = cls.update(resource_version=resource_version, date_updated=datetime.datetime.now()).where(cls.name == name).execute()
+        if not updated:
+            cls.create(name=name, resource_version=resource_version)
+
+class WatchMember(Model):
+    """
+    WatchMember table representation, the live watch replicas:
+     - name : the replica name.
+     - date_heartbeat : its last heartbeat, from the database clock.
+    """
+    name = CharField(primary_key=True)
+    date_heartbeat = DateTimeField(default=datetime.datetime.now)
+
+    @classmethod
+    def heartbeat(cls, name, db=None):
+        """
+        Record a heartbeat of a replica.
+        :param name: The replica name.
+        :type name: str
+        :param db: The database. Default to the model one.
+        """
+        db = db or cls._meta.database
+        db.execute_sql('INSERT INTO "watchmember" ("name", "date_heartbeat") VALUES (%s, NOW()) '
+                       'ON CONFLICT ("name") DO UPDATE SET "date_heartbeat" = NOW()', (name,))
+
+    @classmethod
+    def alive(cls, ttl, db=None):
+        """
+        Retrieve the replicas with a recent heartbeat.
+        :param ttl: The heartbeat age, in seconds, after which a replica is dead.
+        :type ttl: float
+        :param db: The database. Default to the model one.
+        :returns: The replicas names, sorted.
+        :rtype: list
+        """
+        db = db or cls._meta.database
+        cursor = db.execute_sql(
+            'SELECT "name" FROM "watchmember" WHERE "date_heartbeat" > NOW() - %s * INTERVAL \'1 second\' ORDER BY "name"', (ttl,))
+        return [row[0] for row in cursor.fetchall()]
+
+    @classmethod
+    def leave(cls, name, db=None):
+        """
+        Remove a replica.
+        :param name: The replica name.
+        :type name: str
+        :param db: The database. Default to the model one.
+        """
+        db = db or cls._meta.database
+        db.execute_sql('DELETE FROM "watchmember" WHERE "name" = %s', (name,))
+
+def rollout_stats(since, owner=None):
+    """
+    Compute the rollouts statistics of the deployments created since a date:
+    the time from deploying to the first running status, and the duration of each step.
+    :param since: The oldest creation date.
+    :type since: datetime.datetime
+    :param owner: Restrict to the deployments of an owner. Default to all of them.
+    :type owner: str
+    :returns: The deployments count, the running percentiles and the steps ones.
+    :rtype: dict
+    """
+    db = Deployment._meta.database#pylint:disable=protected-access
+    where, params = '"deployment"."date_created" >= %s', [since]
+    if owner is not None:
+        where += ' AND "deployment"."owner" = %s'
+        params.append(owner)
+    #The status date bound only lets a partitioned table skip the older partitions.
+    cursor = db.execute_sql(
+        'SELECT COUNT(*), COUNT("seconds"), '
+        'percentile_cont(0.5) WITHIN GROUP (ORDER BY "seconds"), '
+        'percentile_cont(0.9) WITHIN GROUP (ORDER BY "seconds"), '
+        'percentile_cont(0.99) WITHIN GROUP (ORDER BY "seconds") '
+        'FROM (SELECT EXTRACT(EPOCH FROM MIN("status"."date_created") FILTER (WHERE "status"."status" = \'running\') '
+        '- MIN("status"."date_created") FILTER (WHERE "status"."status" = \'deploying\')) AS "seconds" '
+        'FROM "deployment" JOIN "status" ON "status"."uid_id" = "deployment"."uid" '
+        'WHERE {} AND "status"."date_created" >= %s GROUP BY "deployment"."uid") AS "rollouts"'.format(where),
+        params + [since])
+    count, running, p50, p90, p99 = cursor.fetchone()
+    output = {'count': count, 'running': {'count': running, 'p50': p50, 'p90': p90, 'p99': p99}, 'steps': {}}
+    cursor = db.execute_sql(
+        'SELECT "rollout_step"."step", COUNT(*), '
+        'COUNT(*) FILTER (WHERE NOT "rollout_step"."success"), '
+        'AVG("rollout_step"."api_calls"), '
+        'percentile_cont(0.5) WITHIN GROUP (ORDER BY "rollout_step"."duration"), '
+        'percentile_cont(0.9) WITHIN GROUP (ORDER BY "rollout_step"."duration"), '
+        'percentile_cont(0.99) WITHIN GROUP (ORDER BY "rollout_step"."duration") '
+        'FROM "rollout_step" JOIN "deployment" ON "deployment"."uid" = "rollout_step"."uid_id" '
+        'WHERE {} GROUP BY "rollout_step"."step"'.format(where),
+        params)
+    for step, total, failures, api_calls, p50, p90, p99 in cursor.fetchall():
+        output['steps'][step] = {'count': total, 'failures': failures, 'api_calls': float(api_calls),
+                                 'p50': p50, 'p90': p90, 'p99': p99}
+    return output
+
+def backfill_status():
+    """
+    Fill `Deployment.status` for the rows created before the column existed,
+    using the latest `Status` row of each deployment.
+    :returns: The number of deployments updated.
+    :rtype: int
+    """
+    if not Deployment.select().where(Deployment.status >> None).exists():
+        return 0
+    cursor = Deployment._meta.database.execute_sql(#pylint:disable=protected-access
+        'UPDATE "deployment" SET "status" = "latest"."status" '
+        'FROM (SELECT DISTINCT ON ("uid_id") "uid_id", "status" FROM "status" '
+        'ORDER BY "uid_id", "date_created" DESC, "id" DESC) AS "latest" '
+        'WHERE "latest"."uid_id" = "deployment"."uid" AND "deployment"."status" IS NULL')
+    return cursor.rowcount
@@ -0,0 +1,234 @@
+#-*- coding:utf-8 -*-
+"""
+Status transitions notifications:
+- publish()
+- hub()
+- add_listener()
+- remove_listener()
+- Hub.subscribe()
+- Hub.dispatch()
+Every status written is published on the `status_exchange` AMQP exchange,
+and handed over to the waiters and the listeners of this process. A subscriber
+thread hands them the transitions published by the other replicas as well.
+"""
+import logging
+import os
+import socket
+import threading
+import farine.settings
+from farine.amqp.publisher import Publisher
+from kombu import Connection, Exchange, Queue
+from kombu.mixins import ConsumerMixin
+from defournement.buffer import Buffer
+import defournement.metrics
+
+LOGGER = logging.getLogger(__name__)
+
+ROUTING_KEY = 'status'
+
+_LOCK = threading.Lock()
+_STATE = {'pid': None, 'hub': None, 'buffer': None, 'subscriber': None}
+_LISTENERS = []
+
+class Waiter(object):
+    """
+    A client waiting for a deployment to reach one of some statuses.
+    """
+
+    def __init__(self, uid, statuses):
+        self.uid = uid
+        self.statuses = set(statuses)
+        self.transition = None
+        self._reached = threading.Event()
+
+    def notify(self, transition):
+        """
+        Wake the client up if the transition is one it waits for.
+        """
+        if self.transition is None and transition['status'] in self.statuses:
+            self.transition = transition
+            self._reached.set()
+
+    def wait(self, timeout):
+        """
+        Block until a status is reached.
+        :param timeout: The longest wait, in seconds.
+        :type timeout: float
+        :returns: The transition reached, None on timeout.
+        :rtype: dict
+        """
+        self._reached.wait(timeout)
+        return self.transition
+
+class Hub(object):
+    """
+    The waiters of this process, by deployment uid.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+    def subscribe(self, uid, statuses):
+        """
+        Register a waiter, before reading the current status: no transition is missed.
+        :param uid: The deployment uid.
+        :type uid: str
+        :param statuses: The statuses waited for.
+        :type statuses: list
+        :rtype: Waiter
+        """
+        waiter = Waiter(uid, statuses)
+        with self._lock:
+            self._waiters.setdefault(uid, []).append(waiter)
+        return waiter
+
+    def unsubscribe(self, waiter):
+        """
+        Forget a waiter.
+        """
+        with self._lock:
+            waiters = self._waiters.get(waiter.uid, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(waiter.uid, None)
+
+    def dispatch(self, transitions):
+        """
+        Hand transitions over to their waiters.
+        :param transitions: The transitions, as dicts with uid, owner, status and date_created.
+        :type transitions: list
+        """
+        for transition in transitions:
+            with self._lock:
+                waiters = list(self._waiters.get(transition['uid'], ()))
+            for waiter in waiters:
+                waiter.notify(transition)
+
+def _exchange(name):
+    settings = farine.settings.defournement
+    return Exchange(name, type=settings['type'], durable=settings['durable'], delivery_mode=settings['delivery_mode'])
+
+class Subscriber(ConsumerMixin):
+    """
+    Consume the transitions published by every replica, on a queue of this process.
+    """
+
+    def __init__(self, hub, name):
+        """
+        :param hub: The waiters of this process, None until a client waits.
+        :type hub: Hub
+        :param name: The exchange name.
+        :type name: str
+        """
+        self.hub = hub
+        self.connection = Connection(farine.settings.defournement['amqp_uri'])
+        self.queue = Queue('{}.{}.{}'.format(name, socket.gethostname(), os.getpid()), exchange=_exchange(name),
+                           routing_key=ROUTING_KEY, exclusive=True, auto_delete=True, durable=False)
+
+    def get_consumers(self, _Consumer, channel):#pylint:disable=arguments-differ
+        return [_Consumer(queues=[self.queue], callbacks=[self.on_message], accept=['json'])]
+
+    def on_message(self, body, message):
+        _dispatch(self.hub, body.get('transitions', []))
+        message.ack()
+
+def _reset():
+    """
+    Threads and connections do not survive a fork.
+    """
+    if _STATE['pid'] != os.getpid():
+        _STATE.update({'pid': os.getpid(), 'hub': None, 'buffer': None, 'subscriber': None})
+        del _LISTENERS[:]
+
+def _dispatch(local, transitions):
+    """
+    Hand transitions over to the waiters and the listeners, never raising.
+    """
+    for callback in ([local.dispatch] if local is not None else []) + list(_LISTENERS):
+        try:
+            callback(transitions)
+        except Exception:#pylint:disable=broad-except
+            LOGGER.exception('Cannot dispatch the transitions')
+
+def _subscribe():
+    """
+    Start the subscriber of this process, once. `_LOCK` must be held.
+    """
+    name = farine.settings.defournement.get('status_exchange')
+    if name and _STATE['subscriber'] is None:
+        _STATE['subscriber'] = Subscriber(_STATE['hub'], name)
+        thread = threading.Thread(target=_STATE['subscriber'].run, name='status-subscriber')
+        thread.daemon = True
+        thread.start()
+
+def add_listener(callback):
+    """
+    Register a callback, called with every batch of transitions written by any replica.
+    :param callback: The callback.
+    :type callback: callable
+    """
+    with _LOCK:
+        _reset()
+        _LISTENERS.append(callback)
+        _subscribe()
+
+def remove_listener(callback):
+    """
+    Unregister a callback, if registered.
+    :param callback: The callback.
+    :type callback: callable
+    """
+    with _LOCK:
+        if callback in _LISTENERS:
+            _LISTENERS.remove(callback)
+
+def hub():
+    """
+    Retrieve the process-wide hub of the waiters, subscribed on first use.
+    Settings:
+     - status_exchange : the exchange the transitions are published on. Default to none, disabled:
+                         the waiters only see the transitions written by this process.
+    :rtype: Hub
+    """
+    with _LOCK:
+        _reset()
+        if _STATE['hub'] is None:
+            _STATE['hub'] = Hub()
+            defournement.metrics.STATUS_WAITERS.labels().set_function(lambda: len(_STATE['hub'] or ()))
+            if _STATE['subscriber'] is not None:
+                _STATE['subscriber'].hub = _STATE['hub']
+            _subscribe()
+        return _STATE['hub']
+
+def _send(publisher, transitions):
+    publisher.send({'transitions': transitions}, routing_key=ROUTING_KEY)
+
+def publish(transitions):
+    """
+    Notify status transitions once written: to the waiters of this process,
+    and on the exchange, by batches sent from a thread.
+    :param transitions: The transitions, as dicts with uid, owner, status and date_created.
+    :type transitions: list
+    """
+    if not transitions:
+        return
+    transitions = [{'uid': transition['uid'], 'owner': transition['owner'], 'status': transition['status'],
+                    'date_created': transition['date_created'].strftime('%Y-%m-%dT%H:%M:%S.%f')} for transition in transitions]
+    name = farine.settings.defournement.get('status_exchange')
+    with _LOCK:
+        _reset()
+        local = _STATE['hub']
+        if name and _STATE['buffer'] is None:
+            publisher = Publisher(name, ROUTING_KEY, service='defournement')
+            _STATE['buffer'] = Buffer(lambda items: _send(publisher, items), 100, 0.05).start()
+        remote = _STATE['buffer'] if name else None
+    _dispatch(local, transitions)
+    if remote is not None:
+        for transition in transitions:
+            remote.add(transition)
@@ -0,0 +1,92 @@
+#-*- coding:utf-8 -*-
+"""
+Keyset pagination, on (date_created, key) in descending order:
+- encode_cursor()
+- decode_cursor()
+- paginate()
+"""
+import base64
+import datetime
+import json
+from farine.connectors.sql import Param, Tuple
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def encode_cursor(date, key, reverse=False, total=None):
+    """
+    Build an opaque cursor token.
+    :param date: The date_created of the boundary row.
+    :type date: datetime.datetime
+    :param key: The key of the boundary row.
+    :param reverse: True to page towards the most recent rows (previous page).
+    :type reverse: bool
+    :param total: The number of rows, counted once for all the pages.
+    :type total: int
+    :returns: The cursor.
+    :rtype: str
+    """
+    data = [date.strftime(DATE_FORMAT), str(key), 1 if reverse else 0]
+    if total is not None:
+        data.append(total)
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor token.
+    :param cursor: The cursor.
+    :type cursor: str
+    :returns: The boundary date, key, direction and total, None if not carried.
+    :rtype: tuple
+    :raises: ValueError if the cursor is invalid.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+        date, key, reverse = data[:3]
+        total = int(data[3]) if len(data) > 3 else None
+        return datetime.datetime.strptime(date, DATE_FORMAT), key, bool(reverse), total
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def paginate(query, date_field, key_field, limit, cursor=None, total=None):
+    """
+    Retrieve a page with an index seek, instead of an offset.
+    :param query: The filtered query.
+    :type query: SelectQuery
+    :param date_field: The date_created field.
+    :param key_field: The unique field breaking the ties.
+    :param limit: The page size.
+    :type limit: int
+    :param cursor: The cursor returned by the previous call. Default to the first page.
+    :type cursor: str
+    :param total: The number of rows, carried by the cursors built. Default to the one of `cursor`.
+    :type total: int
+    :returns: The rows, most recent first, the next and the previous cursors.
+    :rtype: tuple
+    :raises: ValueError if the cursor is invalid.
+    """
+    reverse = False
+    if cursor:
+        date, key, reverse, carried = decode_cursor(cursor)
+        if total is None:
+            total = carried
+        #A row value comparison: one index range, where the OR form would be planned as a filter.
+        row, boundary = Tuple(date_field, key_field), Tuple(Param(date_field.db_value(date)), Param(key_field.db_value(key)))
+        query = query.where(row > boundary if reverse else row < boundary)
+    if reverse:
+        query = query.order_by(date_field.asc(), key_field.asc())
+    else:
+        query = query.order_by(date_field.desc(), key_field.desc())
+    rows = list(query.limit(limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if reverse:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+    first, last = rows[0], rows[-1]
+    #A forward page has a next page if there are more rows, and a previous one if it came from a cursor.
+    has_next = more if not reverse else True
+    has_previous = bool(cursor) if not reverse else more
+    next_cursor = encode_cursor(getattr(last, date_field.name), getattr(last, key_field.name), total=total) if has_next else None
+    previous_cursor = encode_cursor(getattr(first, date_field.name), getattr(first, key_field.name), True, total) if has_previous else None
+    return rows, next_cursor, previous_cursor
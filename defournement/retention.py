@@ -0,0 +1,316 @@
+#-*- coding:utf-8 -*-
+"""
+Status history retention:
+- rollup()
+- partition()
+- ensure_partitions()
+- purge_partitions()
+- purge_steps()
+- run()
+The recent history is kept in full. Past `status_retention_days`, only the
+transitions are kept: a status equal to the previous one of the same
+deployment is deleted, by small batches of deployments. Each pass rolls up
+the statuses dated since the limit of the previous one, checkpointed as `status_rollup`.
+"""
+import datetime
+import logging
+import re
+import time
+import farine.settings
+from defournement.models import Deployment, WatchState
+import defournement.migrations
+from defournement.migrations import _drop_invalid_index#pylint:disable=protected-access
+
+LOGGER = logging.getLogger(__name__)
+
+PARTITION = re.compile(r'^status_p(\d{4})(\d{2})$')
+CHECKPOINT = 'status_rollup'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+def _db():
+    return Deployment._meta.database#pylint:disable=protected-access
+
+def _month(date, months=0):
+    """
+    The first day of the month of `date`, shifted by `months`.
+    """
+    index = date.year * 12 + date.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+def _wait(stopping, pause):
+    """
+    Pause between two batches.
+    :returns: Whether to stop.
+    :rtype: bool
+    """
+    if stopping is not None:
+        return stopping.wait(pause)
+    if pause:
+        time.sleep(pause)
+    return False
+
+def rollup(before, batch_size=100, pause=0, stopping=None, since=None):
+    """
+    Roll the history older than `before` up into its transitions, for the
+    deployments created before `before`. Each batch is a short transaction.
+    :param before: The retention limit.
+    :type before: datetime.datetime
+    :param since: Only roll up the statuses dated from `since`: the older ones were by a previous pass.
+                  Default to all of them.
+    :type since: datetime.datetime
+    :param batch_size: The number of deployments per batch.
+    :type batch_size: int
+    :param pause: The pause between two batches, in seconds.
+    :type pause: float
+    :param stopping: Set to interrupt the rollup.
+    :type stopping: threading.Event
+    :returns: The number of statuses deleted.
+    :rtype: int
+    """
+    db = _db()
+    last, deleted = '', 0
+    while True:
+        if since is None:
+            uids = [row[0] for row in db.execute_sql(
+                'SELECT "uid" FROM "deployment" WHERE "uid" > %s AND "date_created" < %s ORDER BY "uid" LIMIT %s',
+                (last, before, batch_size)).fetchall()]
+        else:
+            uids = [row[0] for row in db.execute_sql(
+                'SELECT DISTINCT "uid_id" FROM "status" WHERE "date_created" >= %s AND "date_created" < %s '
+                'AND "uid_id" > %s ORDER BY "uid_id" LIMIT %s',
+                (since, before, last, batch_size)).fetchall()]
+        if not uids:
+            return deleted
+        with db.atomic():
+            #The previous status of the first one since `since` is older: the whole history is read.
+            cursor = db.execute_sql(
+                'DELETE FROM "status" WHERE "id" IN ('
+                'SELECT "id" FROM (SELECT "id", "status", "date_created", '
+                'lag("status") OVER (PARTITION BY "uid_id" ORDER BY "date_created", "id") AS "previous" '
+                'FROM "status" WHERE "uid_id" IN %s) AS "history" '
+                'WHERE "status" = "previous" AND "date_created" >= %s AND "date_created" < %s)',
+                (tuple(uids), since or datetime.datetime.min, before))
+            deleted += cursor.rowcount
+        last = uids[-1]
+        if len(uids) < batch_size or _wait(stopping, pause):
+            return deleted
+
+def is_partitioned(db=None):
+    """
+    Whether the status table is partitioned.
+    :rtype: bool
+    """
+    db = db or _db()
+    row = db.execute_sql('SELECT "relkind" FROM pg_class WHERE "relname" = %s AND pg_table_is_visible(oid)', ('status',)).fetchone()
+    return bool(row) and row[0] == 'p'
+
+def partition(db=None, now=None, lock_timeout=5000):
+    """
+    Convert the status table into a table partitioned by month (Postgres 12+).
+    The current table is kept as the partition holding all the rows until the
+    next month: no row is copied, nor scanned while the table is locked. Idempotent.
+    The `status_default` partition holds the rows of the months not created yet.
+    :param db: The database. Default to the models one.
+    :param now: The current date. Default to now.
+    :type now: datetime.datetime
+    :param lock_timeout: The longest wait for the table lock, in milliseconds: the swap
+                         is retried by the next pass rather than queueing the writes.
+    :type lock_timeout: int
+    :returns: Whether the table was converted.
+    :rtype: bool
+    """
+    db = db or _db()
+    if is_partitioned(db):
+        return False
+    if int(db.execute_sql('SHOW server_version_num').fetchone()[0]) < 120000:
+        #Before 12, SET NOT NULL ignores the validated constraint: a full scan under the lock.
+        LOGGER.warning('The status table is only partitioned from Postgres 12')
+        return False
+    boundary = _month(now or datetime.datetime.now(), 1)
+    #1. Build what the partition needs without blocking the writes.
+    conn = db.get_conn()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        _drop_invalid_index(db, 'status_id_date_created')
+        db.execute_sql('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "status_id_date_created" ON "status" ("id", "date_created")')
+        db.execute_sql('ALTER TABLE "status" DROP CONSTRAINT IF EXISTS "status_legacy_range"')
+        db.execute_sql('ALTER TABLE "status" ADD CONSTRAINT "status_legacy_range" '
+                       'CHECK ("date_created" IS NOT NULL AND "date_created" < %s) NOT VALID', (boundary,))
+        db.execute_sql('ALTER TABLE "status" VALIDATE CONSTRAINT "status_legacy_range"')
+    finally:
+        conn.autocommit = autocommit
+    #2. Swap the tables: the validated constraint spares the scans, of SET NOT NULL and ATTACH.
+    with db.atomic():
+        db.execute_sql('SET LOCAL lock_timeout = {:d}'.format(int(lock_timeout)))
+        db.execute_sql('ALTER TABLE "status" ALTER COLUMN "date_created" SET NOT NULL')
+        db.execute_sql('ALTER TABLE "status" RENAME TO "status_legacy"')
+        db.execute_sql('ALTER INDEX "status_pkey" RENAME TO "status_legacy_pkey"')
+        db.execute_sql('CREATE TABLE "status" ("id" INTEGER NOT NULL DEFAULT nextval(\'status_id_seq\'), '
+                       '"uid_id" VARCHAR(255) NOT NULL REFERENCES "deployment" ("uid"), '
+                       '"status" VARCHAR(255) NOT NULL, "date_created" TIMESTAMP NOT NULL DEFAULT NOW(), '
+                       'CONSTRAINT "status_pkey" PRIMARY KEY ("id", "date_created")) PARTITION BY RANGE ("date_created")')
+        db.execute_sql('ALTER TABLE "status" ATTACH PARTITION "status_legacy" FOR VALUES FROM (MINVALUE) TO (%s)', (boundary,))
+        db.execute_sql('CREATE TABLE "status_default" PARTITION OF "status" DEFAULT')
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "status_history_uid_id_date_created_id" ON "status" ("uid_id", "date_created" DESC, "id" DESC)')
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "status_history_date_created" ON "status" ("date_created")')
+        db.execute_sql('ALTER SEQUENCE "status_id_seq" OWNED BY "status"."id"')
+        db.execute_sql('ALTER TABLE "status_legacy" DROP CONSTRAINT "status_legacy_range"')
+    LOGGER.info('Status table partitioned from %s', boundary.date())
+    return True
+
+def _partitions(db):
+    """
+    The monthly partitions, by their first day.
+    """
+    cursor = db.execute_sql('SELECT child."relname" FROM pg_inherits '
+                            'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                            'WHERE parent."relname" = %s', ('status',))
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION.match(name)
+        if match:
+            partitions[datetime.datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+def _legacy_end(db):
+    """
+    The upper bound of the converted table partition, if any.
+    """
+    row = db.execute_sql('SELECT pg_get_expr(relpartbound, oid) FROM pg_class WHERE "relname" = %s', ('status_legacy',)).fetchone()
+    match = re.search(r"TO \('(\d{4}-\d{2}-\d{2})", row[0] or '') if row else None
+    return datetime.datetime.strptime(match.group(1), '%Y-%m-%d') if match else None
+
+def ensure_partitions(ahead=2, db=None, now=None):
+    """
+    Create the partitions of the current month and of the `ahead` next ones,
+    and of the past months written to the default partition meanwhile, their rows moved into them.
+    The months still held by the converted table are skipped.
+    :param ahead: The number of months created in advance.
+    :type ahead: int
+    :returns: The partitions created.
+    :rtype: list
+    """
+    db = db or _db()
+    now = now or datetime.datetime.now()
+    #The tables converted without it.
+    db.execute_sql('CREATE TABLE IF NOT EXISTS "status_default" PARTITION OF "status" DEFAULT')
+    existing = _partitions(db)
+    legacy_end = _legacy_end(db)
+    oldest = db.execute_sql('SELECT min("date_created") FROM "status_default"').fetchone()[0]
+    start = _month(min(oldest, now) if oldest else now)
+    created = []
+    while start <= _month(now, ahead):
+        end = _month(start, 1)
+        name = 'status_p{:%Y%m}'.format(start)
+        if start not in existing and not (legacy_end and start < legacy_end):
+            with db.atomic():
+                stray = db.execute_sql('SELECT 1 FROM "status_default" WHERE "date_created" >= %s AND "date_created" < %s LIMIT 1',
+                                       (start, end)).fetchone()
+                if stray:
+                    #Written while the maintenance was stopped: the new partition must not overlap them.
+                    db.execute_sql('ALTER TABLE "status" DETACH PARTITION "status_default"')
+                db.execute_sql('CREATE TABLE IF NOT EXISTS "{}" PARTITION OF "status" FOR VALUES FROM (%s) TO (%s)'.format(name),
+                               (start, end))
+                if stray:
+                    db.execute_sql('INSERT INTO "{}" SELECT * FROM "status_default" WHERE "date_created" >= %s AND "date_created" < %s'.format(name),
+                                   (start, end))
+                    db.execute_sql('DELETE FROM "status_default" WHERE "date_created" >= %s AND "date_created" < %s', (start, end))
+                    db.execute_sql('ALTER TABLE "status" ATTACH PARTITION "status_default" DEFAULT')
+            created.append(name)
+        start = end
+    return created
+
+def purge_partitions(before, db=None):
+    """
+    Drop the monthly partitions entirely older than `before`, transitions
+    included. The converted table and the default partition are never dropped:
+    the rollup keeps them small.
+    :param before: The purge limit.
+    :type before: datetime.datetime
+    :returns: The partitions dropped.
+    :rtype: list
+    """
+    db = db or _db()
+    dropped = []
+    for start, name in sorted(_partitions(db).items()):
+        if _month(start, 1) > before:
+            continue
+        db.execute_sql('ALTER TABLE "status" DETACH PARTITION "{}"'.format(name))
+        db.execute_sql('DROP TABLE "{}"'.format(name))
+        dropped.append(name)
+    return dropped
+
+def purge_steps(before, batch_size=1000, pause=0, stopping=None):
+    """
+    Delete the rollouts timeline older than `before`. Each batch is a short transaction.
+    :param before: The purge limit.
+    :type before: datetime.datetime
+    :param batch_size: The number of steps per batch.
+    :type batch_size: int
+    :param pause: The pause between two batches, in seconds.
+    :type pause: float
+    :param stopping: Set to interrupt the purge.
+    :type stopping: threading.Event
+    :returns: The number of steps deleted.
+    :rtype: int
+    """
+    db = _db()
+    deleted = 0
+    while True:
+        with db.atomic():
+            cursor = db.execute_sql(
+                'DELETE FROM "rollout_step" WHERE "id" IN ('
+                'SELECT "id" FROM "rollout_step" WHERE "date_created" < %s LIMIT %s)',
+                (before, batch_size))
+            deleted += cursor.rowcount
+        if cursor.rowcount < batch_size or _wait(stopping, pause):
+            return deleted
+
+def run(stopping=None):
+    """
+    A maintenance pass.
+    Settings:
+     - status_retention_days : the full history age, in days. Default to 30.
+     - status_retention_batch : the number of deployments rolled up per transaction. Default to 100.
+     - status_retention_pause : the pause between two batches, in milliseconds. Default to 100.
+     - status_partitioned : partition the status table by month. Default to false.
+     - status_partition_lock_timeout : the longest wait for the status table lock, in milliseconds. Default to 5000.
+     - status_partitions_ahead : the number of monthly partitions created in advance. Default to 2.
+     - status_purge_days : drop the partitions older than this, in days. Default to 0, never.
+     - rollout_step_retention_days : the rollouts timeline age, in days. Default to 30.
+    :param stopping: Set to interrupt the pass.
+    :type stopping: threading.Event
+    :returns: The statuses deleted, the partitions created and dropped, the steps deleted.
+    :rtype: dict
+    """
+    settings = farine.settings.defournement
+    now = datetime.datetime.now()
+    result = {'deleted': 0, 'created': [], 'dropped': [], 'steps': 0}
+    #The indexes the pass relies on are built by the migrate task: retried by the next pass.
+    if defournement.migrations.pending():
+        LOGGER.warning('Status retention postponed: the schema is not migrated')
+        return result
+    if settings.get('status_partitioned', 'false').lower() == 'true':
+        partition(now=now, lock_timeout=int(settings.get('status_partition_lock_timeout', 5000)))
+        result['created'] = ensure_partitions(int(settings.get('status_partitions_ahead', 2)), now=now)
+        purge = int(settings.get('status_purge_days', 0))
+        if purge:
+            result['dropped'] = purge_partitions(now - datetime.timedelta(days=purge))
+    before = now - datetime.timedelta(days=int(settings.get('status_retention_days', 30)))
+    since = WatchState.load(CHECKPOINT)
+    result['deleted'] = rollup(before,
+                               int(settings.get('status_retention_batch', 100)),
+                               int(settings.get('status_retention_pause', 100)) / 1000.0,
+                               stopping,
+                               datetime.datetime.strptime(since, DATE_FORMAT) if since else None)
+    #Interrupted: rolled up again from the same limit.
+    if stopping is None or not stopping.is_set():
+        WatchState.store(CHECKPOINT, before.strftime(DATE_FORMAT))
+    result['steps'] = purge_steps(now - datetime.timedelta(days=int(settings.get('rollout_step_retention_days', 30))),
+                                  pause=int(settings.get('status_retention_pause', 100)) / 1000.0,
+                                  stopping=stopping)
+    LOGGER.info('Status retention: %s rolled up, %s partitions created, %s dropped, %s steps deleted',
+                result['deleted'], len(result['created']), len(result['dropped']), result['steps'])
+    return result
@@ -0,0 +1,67 @@
+#-*- coding:utf-8 -*-
+"""
+Dependency-aware rollout of the components:
+- Rollout.run()
+"""
+import logging
+import time
+import defournement.engine
+import defournement.utils
+from defournement.throttle import CircuitOpen
+
+LOGGER = logging.getLogger(__name__)
+
+def _deploy(component):
+    """
+    Deploy a component, only raising `CircuitOpen`.
+    :returns: The deploy status, its duration in seconds and the API server requests it sent.
+    :rtype: tuple
+    """
+    calls = defournement.utils.api_calls()
+    start = time.time()
+    try:
+        result = component.deploy()
+    except CircuitOpen:
+        raise
+    except Exception:#pylint:disable=broad-except
+        LOGGER.exception('Cannot deploy %s', component.__class__.__name__)
+        result = False
+    return result, time.time() - start, defournement.utils.api_calls() - calls
+
+class Rollout(object):
+    """
+    Deploy components stage by stage:
+    the components of a stage run concurrently on the engine,
+    once every component of the previous stage is done.
+    """
+
+    def __init__(self, stages):
+        """
+        Initialize the stages.
+        :param stages: The components to deploy, as lists of (name, component).
+        :type stages: list
+        """
+        self.stages = stages
+        #(name, status, duration, API server requests) of each component, once run.
+        self.steps = []
+
+    def run(self):
+        """
+        Deploy every stage.
+        :returns: The deploy status of each component, in the stages order.
+        :rtype: list of (str, bool)
+        :raises: CircuitOpen when the API server is unhealthy, once the stage is done:
+                 the components are idempotent, the rollout can run again.
+        """
+        self.steps = []
+        for stage in self.stages:
+            if len(stage) == 1:
+                name, component = stage[0]
+                self.steps.append((name,) + _deploy(component))
+                continue
+            pending = [(name, defournement.engine.spawn(_deploy, component)) for name, component in stage]
+            #Every component is waited for before raising.
+            for name, result in pending:
+                result.wait()
+            self.steps.extend((name,) + result.get() for name, result in pending)
+        return [(name, result) for name, result, _, _ in self.steps]
@@ -8,20 +8,146 @@ Entrypoint for the deployment:
 - create_ingress()
 - create_service()
 - delete()
+- stats()
+- wait()
+- maintain()
+- migrate()
 - watch()
 """
+import collections
+import datetime
+import functools
+import inspect
 import logging
+import os
+import random
+import threading
+import time
 from farine.connectors.sql import fn
 import farine.amqp
 import farine.execute
 import farine.rpc
 from defournement.models import Deployment as Model
 from defournement.models import Status
+from defournement.models import IntegrityError
+from defournement.models import RolloutStep
+from defournement.models import rollout_stats
+from defournement.models import WatchState
+import defournement.clusters
 import defournement.components as cmpt
+import defournement.consumer
+import defournement.coordination
+import defournement.engine
+import defournement.metrics
+import defournement.migrations
+import defournement.notify
+import defournement.retention
+import defournement.throttle
+from defournement.buffer import Buffer
+from defournement.cache import LRUCache, ResponseCache
+from defournement.events import RawWatch, summary
+from defournement.pagination import decode_cursor, encode_cursor, paginate
+from defournement.rollout import Rollout
+from defournement.throttle import CircuitOpen
 import defournement.utils
 
+QUERY = defournement.metrics.QUERY_SECONDS
+
 LOGGER = logging.getLogger(__name__)
 
+_LOCK = threading.Lock()
+_RESPONSES = {'pid': None, 'cache': None, 'listener': None}
+_MISSING = object()
+
+def _key(uid):
+    """
+    The hex form of a deployment uid: the model reads UUIDs, the labels hold strings.
+    :rtype: str
+    """
+    return Model.uid.db_value(uid)
+
+def _notify(transitions):
+    """
+    Publish written transitions, with the uids the waiters subscribe with.
+    """
+    defournement.notify.publish([dict(transition, uid=_key(transition['uid'])) for transition in transitions])
+
+def _invalidate(cache, transitions):
+    """
+    Notification listener dropping the responses of the owners and deployments written.
+    """
+    groups = set()
+    for transition in transitions:
+        groups.add(('list', transition['owner']))
+        groups.add(('detail', transition['uid']))
+    cache.invalidate(*groups)
+
+def _responses():
+    """
+    Retrieve the process-wide cache of the list() and detail() responses, created on first use.
+    It is invalidated by every status written: by this process, and by the other replicas
+    through the `status_exchange` notifications.
+    Settings:
+     - response_cache_size : the number of responses kept. Default to 0, disabled.
+     - response_cache_ttl : their time to live, in seconds: how stale they can be
+                            when the other replicas do not notify. Default to 30.
+    :returns: The cache, None if disabled.
+    :rtype: ResponseCache
+    """
+    settings = farine.settings.defournement
+    size = int(settings.get('response_cache_size', 0))
+    if not size:
+        return None
+    with _LOCK:
+        if _RESPONSES['pid'] != os.getpid():
+            cache = ResponseCache(size, float(settings.get('response_cache_ttl', 30)))
+            #A forked process inherits the listener of the parent cache.
+            if _RESPONSES['listener'] is not None:
+                defournement.notify.remove_listener(_RESPONSES['listener'])
+            _RESPONSES['listener'] = functools.partial(_invalidate, cache)
+            defournement.notify.add_listener(_RESPONSES['listener'])
+            defournement.metrics.RESPONSE_CACHE_SIZE.labels().set_function(lambda: len(cache))
+            _RESPONSES['cache'] = cache
+            _RESPONSES['pid'] = os.getpid()
+        return _RESPONSES['cache']
+
+def _cached(group):
+    """
+    Decorator serving an RPC method through the responses cache.
+    :param group: Called with the call arguments, returns the group invalidating the response.
+    :type group: callable
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache = _responses()
+            if cache is None:
+                return func(self, *args, **kwargs)
+            call = inspect.getcallargs(func, self, *args, **kwargs)
+            del call['self']
+            key = tuple(sorted(call.items()))
+            try:
+                hash(key)
+            except TypeError:
+                return func(self, *args, **kwargs)
+            name = group(call)
+            output = cache.get(name, key, _MISSING)
+            if output is not _MISSING:
+                defournement.metrics.RESPONSE_CACHE.labels(func.__name__, 'hit').inc()
+                return output
+            defournement.metrics.RESPONSE_CACHE.labels(func.__name__, 'miss').inc()
+            epoch = cache.epoch(name)
+            output = func(self, *args, **kwargs)
+            cache.set(name, key, output, epoch)
+            return output
+        return wrapper
+    return decorator
+
+class ResourceGone(Exception):
+    """
+    The watched resource version is too old (410 Gone).
+    """
+
 class Defournement(object):
     """
     Deployment management:
@@ -32,9 +158,27 @@ class Defournement(object):
     def __init__(self):
         defournement.utils.k8s_config()
         self.exclude_namespaces= farine.settings.defournement['exclude_namespaces'].split(',')
+        self.stopping = threading.Event()
+        self.last_status = LRUCache(int(farine.settings.defournement.get('status_cache_size', 10000)))
+        self.skipped_writes = 0
+        self.status_listener = False
+        self.status_buffer = None
+        self.create_batch_size = int(farine.settings.defournement.get('create_batch_size', 1))
+        self.create_batch = None
+        self.create_lock = threading.Lock()
+        self.create_settled = collections.deque()
+        self.create_failures = 0
+        self.create_async = farine.settings.defournement.get('create_async', 'false').lower() == 'true'
+        self.error_batch = None
+        self.step_batch = None
+        self.timeline = farine.settings.defournement.get('rollout_timeline', 'true').lower() == 'true'
+        self.coordinator = None
+        defournement.metrics.start()
 
     @farine.rpc.method()
-    def list(self, owner, offset=0, limit=10):
+    @defournement.metrics.rpc('list')
+    @_cached(lambda call: ('list', call['owner']))
+    def list(self, owner, offset=0, limit=10, cursor=None):
         """
         Get the last deployment records given an owner.
         :param owner: The owner to retrieve the deployments.
@@ -43,77 +187,350 @@ class Defournement(object):
         :type limit: int
         :param limit: The number of deployments to retrieve. Default to 10.
         :type limit: int
+        :param cursor: The `next` or `previous` token of a previous call. Overrides the offset.
+        :type cursor: str
         :returns: The owner deployments.
         :type: dict
         """
         output = {'count':0, 'next':None, 'previous':None, 'results':[]}
-        output['count'] = Model.select(fn.count(Model.uid)).where(Model.owner == owner).scalar()
-        deployments = Model.select().where(Model.owner == owner).order_by(Model.date_created.desc()).offset(offset).limit(limit)
+        #1. Keyset : one index seek, whatever the depth. The count is carried by the cursor.
+        if cursor:
+            query = Model.select().where(Model.owner == owner)
+            try:
+                total = decode_cursor(cursor)[3]
+                if total is None:
+                    with QUERY.labels('list_count').time():
+                        total = Model.select(fn.count(Model.uid)).where(Model.owner == owner).scalar()
+                with QUERY.labels('list_page').time():
+                    deployments, output['next'], output['previous'] = paginate(query, Model.date_created, Model.uid, limit, cursor, total)
+            except ValueError:
+                return output
+            output['count'] = total
+            output['results'] = [deployment.to_json() for deployment in deployments]
+            return output
+        #2. Offset : one query, the page, its statuses and the total count.
+        total = fn.count(Model.uid).over().alias('total')
+        with QUERY.labels('list_page').time():
+            deployments = list(Model.select(Model, total).where(Model.owner == owner).order_by(Model.date_created.desc(), Model.uid.desc()).offset(offset).limit(limit))
         for deployment in deployments:
-            query = Status.select().where(Status.uid == deployment.uid).order_by(Status.date_created.desc()).get()
-            output['results'].append(deployment.to_json(extras={'status':query.status}))
+            output['count'] = deployment.total
+            output['results'].append(deployment.to_json())
+        #3. Out of range page : the window did not return the count.
+        if not deployments:
+            if offset:
+                with QUERY.labels('list_count').time():
+                    output['count'] = Model.select(fn.count(Model.uid)).where(Model.owner == owner).scalar()
+            return output
+        if offset + len(deployments) < output['count']:
+            output['next'] = encode_cursor(deployments[-1].date_created, deployments[-1].uid, total=output['count'])
+        if offset:
+            output['previous'] = encode_cursor(deployments[0].date_created, deployments[0].uid, True, output['count'])
         return output
 
     @farine.rpc.method()
-    def detail(self, owner, uid):
+    @defournement.metrics.rpc('detail')
+    @_cached(lambda call: ('detail', _key(call['uid'])))
+    def detail(self, owner, uid, limit=None, cursor=None):
         """
         Given an owner and an uid, retrieve the details.
         :param owner: The owner to retrieve the deployment details.
         :type owner: str
         :param uid: The deployment uid.
         :type uid: str
+        :param limit: The number of statuses to retrieve. Default to all of them.
+        :type limit: int
+        :param cursor: The `next` or `previous` token of a previous call.
+        :type cursor: str
         :returns: The deployment details.
         :type: list
         """
         output = {'count':0, 'next':None, 'previous':None, 'results':[]}
         #1. Check permission
-        exist = Model.select().where(Model.owner == owner, Model.uid == uid).scalar()
+        with QUERY.labels('detail_owner').time():
+            exist = Model.select().where(Model.owner == owner, Model.uid == uid).scalar()
         if not exist:
             return output
         # 2. Retrieve all the status
-        output['count'] = Status.select().where(Status.uid == uid).count()
-        query = Status.select().where(Status.uid == uid).order_by(Status.date_created.desc())
-        output['results'] = [q.to_json() for q in query]
+        query = Status.select().where(Status.uid == uid)
+        if not limit and not cursor:
+            with QUERY.labels('detail_count').time():
+                output['count'] = query.count()
+            with QUERY.labels('detail_history').time():
+                output['results'] = [q.to_json() for q in query.order_by(Status.date_created.desc(), Status.id.desc())]
+            return output
+        # 3. Or a page of them, the count carried by the cursor
+        try:
+            total = decode_cursor(cursor)[3] if cursor else None
+            if total is None:
+                with QUERY.labels('detail_count').time():
+                    total = query.count()
+            with QUERY.labels('detail_page').time():
+                statuses, output['next'], output['previous'] = paginate(query, Status.date_created, Status.id, limit or 10, cursor, total)
+        except ValueError:
+            return output
+        output['count'] = total
+        output['results'] = [q.to_json() for q in statuses]
         return output
 
-    @farine.amqp.consume(exchange='deployment', routing_key='create')
+    @defournement.consumer.consume(exchange='deployment', routing_key='create')
+    @defournement.metrics.rpc('create')
     def create(self, body, message):
         """
         Deploy an application.
+        With `create_batch_size` > 1, the messages are buffered and deployed
+        by batches, then acked: see `_create_many()` and `settle()`.
+        With `create_async`, the rollout runs on the engine and its pending result is returned.
+        The application is placed on the cluster of its namespace.
         :param body: The application definition.
         :type body: dict
         :param message: Message class.
         :type message: kombu.message.Message
         """
+        definition = body['definition']
+        definition['cluster'] = defournement.clusters.place(definition['namespace'])
+        #Paused while the API server is unhealthy, rather than recording failures.
+        defournement.throttle.breaker(definition['cluster']).wait_closed()
+        if self.create_batch_size > 1:
+            self._create_buffer().add((body, message))
+            self.settle()
+            return None
         message.ack()
         LOGGER.info(body)
-        definition = body['definition']
         #1. Create the Deployment model
-        Model.create(uid=definition['uid'], owner=definition['owner'], name=definition['name'], namespace=definition['namespace'])
-        Status.create(uid_id=definition['uid'], status='deploying')
-        #2. Namespace
-        component = cmpt.Namespace(definition['namespace'])
-        result = component.deploy()
-        if not result:
-            Status.create(uid=definition['uid'], status='error:namespace')
-        #3. Service
-        component = cmpt.Service(definition)
-        result = component.deploy()
-        if not result:
-            Status.create(uid=definition['uid'], status='error:service')
-        #4. Ingress
-        component = cmpt.Ingress(definition)
-        result = component.deploy()
-        if not result:
-            Status.create(uid=definition['uid'], status='error:ingress')
-        #5. Deployment
-        component = cmpt.Deployment(definition)
-        result = component.deploy()
-        if not result:
-            Status.create(uid=definition['uid'], status='error:deployment')
-        return result
+        with QUERY.labels('create').time():
+            Model.create(uid=definition['uid'], owner=definition['owner'], name=definition['name'], namespace=definition['namespace'], status='deploying', cluster=definition['cluster'])
+            Status.create(uid_id=definition['uid'], status='deploying')
+        _notify([{'uid': definition['uid'], 'owner': definition['owner'], 'status': 'deploying', 'date_created': datetime.datetime.now()}])
+        #2. Hand the rollout over to the engine: the consumer is free for the next message.
+        if self.create_async:
+            return defournement.engine.submit(self._rollout, definition)
+        return self._rollout(definition)
+
+    def _rollout(self, definition):
+        """
+        Deploy the components of an application, recording their errors.
+        :param definition: The application definition.
+        :type definition: dict
+        :returns: The deployment component status.
+        :rtype: bool
+        """
+        #Namespace first, then the service, ingress and deployment concurrently.
+        rollout = Rollout([
+            [('namespace', cmpt.Namespace(definition['namespace'], cluster=definition['cluster']))],
+            self._components(definition),
+        ])
+        while True:
+            try:
+                results = rollout.run()
+                break
+            except CircuitOpen:
+                #Not a failure of the deployment: deployed again once the API server recovers.
+                LOGGER.warning('Rollout of %s paused: the API server is unhealthy', definition['uid'])
+                defournement.throttle.breaker(definition['cluster']).wait_closed()
+        now = datetime.datetime.now()
+        errors = [{'uid': definition['uid'], 'owner': definition['owner'], 'status': 'error:{}'.format(name), 'date_created': now} for name, result in results if not result]
+        if errors and self.create_async:
+            #Many rollouts in flight: one connection writes their errors, by batches.
+            for row in errors:
+                self._error_buffer().add(row)
+        elif errors:
+            self._record_errors(errors)
+        self._record_steps([(definition['uid'],) + step for step in rollout.steps], now)
+        return dict(results)['deployment']
+
+    @staticmethod
+    def _record_errors(errors):
+        """
+        Write the errors of rollouts, then notify them.
+        :param errors: The errors, as dicts with uid, owner, status and date_created.
+        :type errors: list
+        """
+        with QUERY.labels('record_errors').time():
+            Status.record_many([{'uid': row['uid'], 'status': row['status'], 'date_created': row['date_created']} for row in errors])
+        _notify(errors)
+
+    def _error_buffer(self):
+        """
+        The buffer of the rollouts errors, started on first use.
+        :rtype: Buffer
+        """
+        with self.create_lock:
+            if self.error_batch is None:
+                self.error_batch = Buffer(self._record_errors).start()
+            return self.error_batch
+
+    def _record_steps(self, steps, date_created):
+        """
+        Record the timeline of rollouts, after their statuses: a failure is only logged.
+        Settings:
+         - rollout_timeline : record the duration and the API server requests of each step. Default to true.
+        :param steps: The (uid, name, status, duration, API server requests) of each step.
+        :type steps: list
+        :param date_created: The rollouts end.
+        :type date_created: datetime.datetime
+        """
+        if not self.timeline or not steps:
+            return
+        rows = [{'uid': uid, 'step': name, 'success': bool(result), 'duration': duration, 'api_calls': calls, 'date_created': date_created}
+                for uid, name, result, duration, calls in steps]
+        if self.create_async:
+            for row in rows:
+                self._step_buffer().add(row)
+            return
+        try:
+            with QUERY.labels('record_steps').time():
+                RolloutStep.insert_many(rows).execute()
+        except Exception:#pylint:disable=broad-except
+            LOGGER.exception('Cannot record the timeline of %s steps', len(rows))
+
+    def _step_buffer(self):
+        """
+        The buffer of the rollouts steps, started on first use.
+        :rtype: Buffer
+        """
+        with self.create_lock:
+            if self.step_batch is None:
+                self.step_batch = Buffer(lambda rows: RolloutStep.insert_many(rows).execute()).start()
+            return self.step_batch
+
+    @staticmethod
+    def _components(definition):
+        """
+        The components depending on the namespace.
+        :param definition: The application definition.
+        :type definition: dict
+        :returns: The components, as (name, component).
+        :rtype: list
+        """
+        return [('service', cmpt.Service(definition)),
+                ('ingress', cmpt.Ingress(definition)),
+                ('deployment', cmpt.Deployment(definition))]
+
+    def _create_buffer(self):
+        """
+        The buffer of the create messages, started on first use.
+        Settings:
+         - create_batch_size : the number of messages deployed together. Default to 1 (no batch).
+         - create_batch_interval : the maximum delay before deploying a batch, in milliseconds. Default to 200.
+        :rtype: Buffer
+        """
+        with self.create_lock:
+            if self.create_batch is None:
+                interval = int(farine.settings.defournement.get('create_batch_interval', 200)) / 1000.0
+                self.create_batch = Buffer(self._create_many, self.create_batch_size, interval).start()
+            return self.create_batch
+
+    def settle(self):
+        """
+        Ack the messages of the batches processed, requeue those of the batches failed once their delay expired.
+        Called on the consumer thread, by `create()` and by the consumer loop: a full batch is processed
+        by `create()` itself, the others by the buffer thread on its interval, and the kombu channels are not thread-safe.
+        Meanwhile the failed messages stay unacked: the prefetch holds the next ones back.
+        """
+        now = time.time()
+        delayed = []
+        while self.create_settled:
+            message, processed, retry = self.create_settled.popleft()
+            if processed:
+                message.ack()
+            elif retry <= now:
+                message.requeue()
+            else:
+                delayed.append((message, processed, retry))
+        self.create_settled.extend(delayed)
+
+    def _create_many(self, items):
+        """
+        Deploy a batch of applications:
+        the rows are inserted in one transaction, each namespace is deployed once,
+        then every component of the batch is deployed concurrently.
+        The messages are acked once the batch is processed, requeued on failure: see `settle()`.
+        An unhealthy API server fails the batch, the consumer then waits before the redelivery.
+        Settings:
+         - create_retry_delay : the delay before requeueing a failed batch, in seconds,
+                                doubled by each consecutive failure. Default to 1.
+         - create_retry_max : the longest delay, in seconds. Default to 60.
+        :param items: The (body, message) to deploy.
+        :type items: list
+        """
+        for cluster in set(body['definition']['cluster'] for body, _ in items):
+            defournement.throttle.breaker(cluster).wait_closed()
+        try:
+            with QUERY.labels('create_many').time():
+                definitions = self._insert_many([body['definition'] for body, _ in items])
+            now = datetime.datetime.now()
+            _notify([{'uid': definition['uid'], 'owner': definition['owner'], 'status': 'deploying', 'date_created': now} for definition in definitions])
+            LOGGER.info('Deploying a batch of %s applications', len(definitions))
+            #1. Each namespace once.
+            namespaces = sorted(set((definition['cluster'], definition['namespace']) for definition in definitions))
+            rollout = Rollout([[(key, cmpt.Namespace(key[1], cluster=key[0])) for key in namespaces]])
+            results = rollout.run()
+            failed = set(key for key, result in results if not result)
+            shared = dict((key, step) for key, step in zip(namespaces, rollout.steps))
+            #2. Every component of the batch.
+            stage = [((definition['uid'], name), component) for definition in definitions for name, component in self._components(definition)]
+            rollout = Rollout([stage])
+            results = rollout.run()
+            #3. The errors, then the timeline: a namespace step is shared by its deployments.
+            now = datetime.datetime.now()
+            owners = dict((definition['uid'], definition['owner']) for definition in definitions)
+            errors = [{'uid': definition['uid'], 'owner': definition['owner'], 'status': 'error:namespace', 'date_created': now} for definition in definitions if (definition['cluster'], definition['namespace']) in failed]
+            errors.extend({'uid': uid, 'owner': owners[uid], 'status': 'error:{}'.format(name), 'date_created': now} for (uid, name), result in results if not result)
+            if errors:
+                self._record_errors(errors)
+            steps = [(definition['uid'], 'namespace') + shared[(definition['cluster'], definition['namespace'])][1:] for definition in definitions]
+            steps.extend((uid, name, result, duration, calls) for (uid, name), result, duration, calls in rollout.steps)
+            self._record_steps(steps, now)
+        except Exception:
+            #E.g. the database is down: backed off, rather than redelivered at once.
+            settings = farine.settings.defournement
+            delay = min(float(settings.get('create_retry_delay', 1)) * 2 ** min(self.create_failures, 16),
+                        float(settings.get('create_retry_max', 60)))
+            self.create_failures += 1
+            retry = time.time() + delay
+            self.create_settled.extend((message, False, retry) for _, message in items)
+            raise
+        self.create_failures = 0
+        self.create_settled.extend((message, True, None) for _, message in items)
+
+    @staticmethod
+    def _insert_many(definitions):
+        """
+        Insert the Deployment and Status rows of a batch in one transaction.
+        If a row is rejected, the definitions are inserted one by one: those already
+        inserted and still deploying are kept, a requeued batch is deployed again.
+        :param definitions: The application definitions.
+        :type definitions: list
+        :returns: The definitions to deploy.
+        :rtype: list
+        """
+        def rows(definition):
+            deployment = {'uid': definition['uid'], 'owner': definition['owner'], 'name': definition['name'], 'namespace': definition['namespace'], 'status': 'deploying', 'cluster': definition['cluster']}
+            return deployment, {'uid': definition['uid'], 'status': 'deploying'}
+        try:
+            with Model._meta.database.atomic():#pylint:disable=protected-access
+                deployments, statuses = zip(*[rows(definition) for definition in definitions])
+                Model.insert_many(list(deployments)).execute()
+                Status.insert_many(list(statuses)).execute()
+            return definitions
+        except IntegrityError:
+            inserted = []
+            for definition in definitions:
+                deployment, status = rows(definition)
+                try:
+                    with Model._meta.database.atomic():#pylint:disable=protected-access
+                        Model.create(**deployment)
+                        Status.create(**status)
+                except IntegrityError:
+                    redelivered = Model.select().where(Model.uid == definition['uid'], Model.owner == definition['owner'], Model.status == 'deploying').exists()
+                    if not redelivered:
+                        LOGGER.exception('Cannot create the deployment %s', definition['uid'])
+                        continue
+                inserted.append(definition)
+            return inserted
 
     @farine.rpc.method()
+    @defournement.metrics.rpc('delete')
     def delete(self, owner, uid):
         """
         Delete a deployment.
@@ -123,45 +540,534 @@ class Defournement(object):
         :type message: kombu.message.Message
         """
         try:
-            current = Model.select().where(Model.owner == owner, Model.uid == uid).get()
+            with QUERY.labels('delete_owner').time():
+                current = Model.select().where(Model.owner == owner, Model.uid == uid).get()
         except Model.DoesNotExist:
             return True
-        Status.create(uid=uid, status='terminating')
-        component = cmpt.Deployment({'uid': uid, 'name': current.name, 'owner': owner, 'namespace': current.namespace})
+        with QUERY.labels('record').time():
+            Status.record(uid, 'terminating')
+        _notify([{'uid': uid, 'owner': owner, 'status': 'terminating', 'date_created': datetime.datetime.now()}])
+        component = cmpt.Deployment({'uid': uid, 'name': current.name, 'owner': owner, 'namespace': current.namespace, 'cluster': current.cluster})
         ##
         if not component.exists():
-            Status.create(uid=uid, status='terminated')
+            with QUERY.labels('record').time():
+                Status.record(uid, 'terminated')
+            _notify([{'uid': uid, 'owner': owner, 'status': 'terminated', 'date_created': datetime.datetime.now()}])
             return True
         result = component.delete()
         return result
 
+    @farine.rpc.method()
+    @defournement.metrics.rpc('stats')
+    def stats(self, owner=None, since=None):
+        """
+        Rollouts statistics: the time to running percentiles, in seconds,
+        and the duration, failures and API server requests of each step.
+        :param owner: Restrict to the deployments of an owner. Default to all of them.
+        :type owner: str
+        :param since: The oldest creation date, as YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS. Default to 7 days ago.
+        :type since: str
+        :returns: The statistics, empty if `since` is invalid.
+        :rtype: dict
+        """
+        if since is None:
+            start = datetime.datetime.now() - datetime.timedelta(days=7)
+        else:
+            start = None
+            for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+                try:
+                    start = datetime.datetime.strptime(since, fmt)
+                    break
+                except (TypeError, ValueError):
+                    continue
+            if start is None:
+                return {}
+        with QUERY.labels('stats').time():
+            output = rollout_stats(start, owner)
+        output['since'] = start.strftime('%Y-%m-%dT%H:%M:%S')
+        return output
+
+    @defournement.consumer.method()
+    @defournement.metrics.rpc('wait')
+    def wait(self, owner, uid, statuses=None, timeout=30):
+        """
+        Block until a deployment reaches one of `statuses`, instead of polling `detail()`.
+        The transitions are pushed to this process: see `defournement.notify`.
+        The waits are served on their own threads: see `defournement.consumer.WaitServer`.
+        Settings:
+         - wait_max_timeout : the longest wait, in seconds. Default to 60.
+        :param owner: The deployment owner.
+        :type owner: str
+        :param uid: The deployment uid.
+        :type uid: str
+        :param statuses: The statuses to wait for. Default to running, aborted and terminated.
+        :type statuses: list
+        :param timeout: The longest wait, in seconds. Default to 30.
+        :type timeout: float
+        :returns: The deployment status, and if it is one of `statuses`. No status if unknown.
+        :rtype: dict
+        """
+        statuses = statuses or ['running', 'aborted', 'terminated']
+        timeout = min(float(timeout), float(farine.settings.defournement.get('wait_max_timeout', 60)))
+        output = {'uid': uid, 'status': None, 'reached': False}
+        hub = defournement.notify.hub()
+        #Subscribed first: a transition written meanwhile is not missed.
+        waiter = hub.subscribe(_key(uid), statuses)
+        try:
+            with QUERY.labels('wait').time():
+                current = list(Model.select(Model.status).where(Model.owner == owner, Model.uid == uid).tuples())
+            if not current:
+                return output
+            output['status'] = current[0][0]
+            if output['status'] not in statuses:
+                transition = waiter.wait(timeout)
+                if transition is not None:
+                    output['status'] = transition['status']
+            output['reached'] = output['status'] in statuses
+            return output
+        finally:
+            hub.unsubscribe(waiter)
+
+    @farine.execute.method()
+    def maintain(self):
+        """
+        Roll the status history up, pass after pass, until stopped.
+        The history removed changes the `detail()` responses: those cached by this process are dropped,
+        the other replicas keep theirs for `response_cache_ttl` seconds at most.
+        Settings:
+         - status_retention_interval : the delay between two passes, in seconds. Default to 3600.
+        """
+        while not self.stopping.is_set():
+            try:
+                result = defournement.retention.run(self.stopping)
+            except Exception:#pylint:disable=broad-except
+                #E.g. the partition swap timed out on its lock: retried by the next pass.
+                LOGGER.exception('Status retention interrupted')
+                result = None
+            cache = _responses()
+            if cache is not None and (result is None or result['deleted'] or result['dropped']):
+                cache.clear()
+            self.stopping.wait(int(farine.settings.defournement.get('status_retention_interval', 3600)))
+
+    @farine.execute.method()
+    def migrate(self):
+        """
+        Upgrade the database schema in place.
+        """
+        versions = defournement.migrations.migrate()
+        if versions:
+            LOGGER.info('Schema migrated to %s', versions[-1])
+
     @farine.execute.method()
     def watch(self):
         """
-        Listen for deployments events.
+        Listen for deployments events, resuming from the last processed version.
+        Settings:
+         - watch_timeout : the server-side duration of a stream, in seconds. Default to 300.
+         - watch_checkpoint : the number of events between two version checkpoints. Default to 100.
+         - status_cache_size : the number of last statuses kept to skip the redundant writes. Default to 10000.
+         - status_batch_size : the number of statuses written by a single insert. Default to 100.
+         - status_batch_interval : the maximum delay before writing the statuses, in milliseconds. Default to 500.
+         - watch_namespaces : watch only these namespaces, one stream each, instead of
+                              all of them but the excluded ones. Default to none.
+         - watch_raw : decode only the fields read from the events, not the whole models. Default to true.
+         - watch_migration_interval : the delay between two checks of the pending migrations, in seconds. Default to 5.
+        With several clusters or namespaces, each one is watched by its own thread.
+        With several replicas, `watch_coordination` elects a single watcher or
+        spreads the namespaces over them: see `defournement.coordination`.
         """
-        from kubernetes import client, watch
-        from defournement.models import Status, IntegrityError
-        v1ext = client.ExtensionsV1beta1Api()
-        w = watch.Watch()
-        last_seen_version = 0
-        for event in w.stream(v1ext.list_deployment_for_all_namespaces, resource_version=last_seen_version, timeout_seconds=0):
-            if not event:
-                continue
-            if event['object'].metadata.namespace in self.exclude_namespaces:
-                continue
-            if event['type'] == 'ADDED':
-                continue
-            LOGGER.info("%s %s [%s] %s", event['type'], event['object'].kind, event['object'].metadata.namespace, event['object'].metadata.name)
-            last_seen_version = event['object'].metadata.resource_version
-            # Retrieve uid
-            uid = event['object'].metadata.labels['uid']
+        from kubernetes import client
+        settings = farine.settings.defournement
+        #Started with the migrate task: the statuses are written to the upgraded schema only.
+        while defournement.migrations.pending():
+            LOGGER.info('Waiting for the schema migrations')
+            if self.stopping.wait(int(settings.get('watch_migration_interval', 5))):
+                return
+        self._warm_status_cache()
+        if not self.status_listener:
+            defournement.notify.add_listener(self._forget_statuses)
+            self.status_listener = True
+        #Strict: a version is not checkpointed while its statuses are not written.
+        self.status_buffer = Buffer(self._flush_statuses,
+                                    int(settings.get('status_batch_size', 100)),
+                                    int(settings.get('status_batch_interval', 500)) / 1000.0, strict=True).start()
+        defournement.metrics.STATUS_BUFFER.labels().set_function(lambda: len(self.status_buffer))
+        defournement.metrics.STATUS_CACHE.labels('hit').set_function(lambda: self.last_status.hits)
+        defournement.metrics.STATUS_CACHE.labels('miss').set_function(lambda: self.last_status.misses)
+        defournement.metrics.SKIPPED_WRITES.labels().set_function(lambda: self.skipped_writes)
+        self.coordinator = defournement.coordination.coordinator()
+        if self.coordinator is not None:
+            self.coordinator.start()
+        namespaces = [namespace.strip() for namespace in settings.get('watch_namespaces', '').split(',') if namespace.strip()]
+        try:
+            targets = [(cluster, namespace) for cluster in defournement.clusters.names() for namespace in namespaces or [None]]
+            if len(targets) == 1:
+                cluster, namespace = targets[0]
+                self._watch_loop(client.ExtensionsV1beta1Api(defournement.utils.api_client(cluster)), cluster, namespace)
+                return
+            threads = []
+            for cluster, namespace in targets:
+                v1ext = client.ExtensionsV1beta1Api(defournement.utils.api_client(cluster))
+                name = 'watch-{}'.format(cluster) if namespace is None else 'watch-{}-{}'.format(cluster, namespace)
+                thread = threading.Thread(target=self._watch_loop, args=(v1ext, cluster, namespace), name=name)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                #A timeout keeps the main thread responsive to the signals.
+                while thread.is_alive():
+                    thread.join(1)
+        finally:
+            if self.coordinator is not None:
+                self.coordinator.stop()
+            self.status_buffer.close()
+
+    def _watch_state(self, cluster, namespace=None):
+        """
+        The watch state name of a cluster, of a namespace in per-namespace mode,
+        and of this replica if it watches a shard.
+        :rtype: str
+        """
+        name = 'deployment'
+        if cluster not in (None, defournement.clusters.DEFAULT):
+            name = '{}:{}'.format(name, cluster)
+        if namespace is not None:
+            name = '{}/{}'.format(name, namespace)
+        if self.coordinator is not None and self.coordinator.state_suffix:
+            name = '{}@{}'.format(name, self.coordinator.state_suffix)
+        return name
+
+    def _owns(self, namespace):
+        """
+        Check if this replica writes the statuses of a namespace.
+        :rtype: bool
+        """
+        return self.coordinator is None or self.coordinator.owns(namespace)
+
+    def _selectors(self, v1ext, namespace=None):
+        """
+        The deployment list method, its positional arguments and its server-side filters:
+        the label stamped on the deployments, and the excluded namespaces.
+        The method is passed as is, the watch reads its return type from its docstring.
+        Settings:
+         - watch_label_selector : only the deployments matching it. Default to uid.
+        :param v1ext: The extensions API.
+        :type v1ext: client.ExtensionsV1beta1Api
+        :param namespace: The watched namespace, None for all of them.
+        :type namespace: str
+        :returns: The method, its arguments and its keyword arguments.
+        :rtype: tuple
+        """
+        kwargs = {}
+        selector = farine.settings.defournement.get('watch_label_selector', 'uid')
+        if selector:
+            kwargs['label_selector'] = selector
+        if namespace is not None:
+            return v1ext.list_namespaced_deployment, (namespace,), kwargs
+        selector = defournement.utils.exclude_selector(self.exclude_namespaces)
+        if selector:
+            kwargs['field_selector'] = selector
+        return v1ext.list_deployment_for_all_namespaces, (), kwargs
+
+    def _watch_loop(self, v1ext, cluster=None, namespace=None):
+        """
+        Watch the deployments of a cluster until stopped, reconnecting on failures.
+        :param v1ext: The extensions API.
+        :type v1ext: client.ExtensionsV1beta1Api
+        :param cluster: The cluster name.
+        :type cluster: str
+        :param namespace: The watched namespace, None for all of them.
+        :type namespace: str
+        """
+        version = WatchState.load(self._watch_state(cluster, namespace))
+        relist = False
+        failures = 0
+        generation = 0
+        while not self.stopping.is_set():
+            if self.coordinator is not None:
+                #Standby until elected or given a shard, then reconcile what was missed.
+                self.coordinator.wait_active(self.stopping)
+                if self.stopping.is_set():
+                    break
+                if self.coordinator.generation != generation:
+                    generation = self.coordinator.generation
+                    relist = True
             try:
-                if event['type'] == 'DELETED':
-                    Status.create(uid=uid, status='terminated')
-                elif event['object'].status.unavailable_replicas in (None, 0):
-                    Status.create(uid=uid, status='running')
-                else:
-                    Status.create(uid=uid, status='unhealthy')
-            except IntegrityError:
-                LOGGER.exception('Unknown deployment uid')
+                if relist:
+                    version = self._relist(v1ext, cluster, namespace)
+                    self._checkpoint(version, cluster, namespace)
+                    relist = False
+                version = self._watch_stream(v1ext, version, cluster, namespace)
+                failures = 0
+            except ResourceGone:
+                LOGGER.warning('Deployment watch version %s of %s is gone: relisting', version, defournement.clusters.resolve(cluster))
+                relist = True
+            except Exception:#pylint:disable=broad-except
+                failures += 1
+                LOGGER.exception('Deployment watch interrupted')
+                #Jittered exponential backoff: the replicas must not reconnect together.
+                delay = min(60, 2 ** failures) * random.uniform(0.5, 1)
+                self.stopping.wait(delay)
+
+    def _watch_stream(self, v1ext, version, cluster=None, namespace=None):
+        """
+        Process one watch stream, until the server closes it.
+        :param v1ext: The extensions API.
+        :type v1ext: client.ExtensionsV1beta1Api
+        :param version: The resource version to start from.
+        :type version: str
+        :param cluster: The cluster name.
+        :type cluster: str
+        :param namespace: The watched namespace, None for all of them.
+        :type namespace: str
+        :returns: The last processed resource version.
+        :rtype: str
+        :raises: ResourceGone when the version is too old.
+        """
+        from kubernetes import watch
+        from kubernetes.client.rest import ApiException
+        settings = farine.settings.defournement
+        timeout = int(settings.get('watch_timeout', 300))
+        checkpoint = int(settings.get('watch_checkpoint', 100))
+        processed = 0
+        generation = self.coordinator.generation if self.coordinator is not None else None
+        method, args, kwargs = self._selectors(v1ext, namespace)
+        #The models are only worth building to debug.
+        w = RawWatch() if settings.get('watch_raw', 'true').lower() == 'true' else watch.Watch()
+        try:
+            for event in w.stream(method, *args, resource_version=version or 0, timeout_seconds=timeout, _request_timeout=timeout + 30, **kwargs):
+                if not event:
+                    continue
+                if event['type'] == 'ERROR':
+                    raw = event.get('raw_object') or {}
+                    if raw.get('code') == 410:
+                        raise ResourceGone()
+                    raise ApiException(status=raw.get('code'), reason=raw.get('message'))
+                obj = summary(event['object'])
+                defournement.metrics.WATCH_EVENTS.labels(cluster, event['type']).inc()
+                if self.coordinator is not None and self.coordinator.generation != generation:
+                    #Elected, deposed or rebalanced: relist.
+                    w.stop()
+                    break
+                self._process_event(event['type'], obj, cluster)
+                #Only the versions fully processed are checkpointed.
+                version = obj.resource_version
+                processed += 1
+                if processed % checkpoint == 0:
+                    self._checkpoint(version, cluster, namespace)
+                    LOGGER.debug('Status cache %s, %s writes skipped', self.last_status.stats(), self.skipped_writes)
+                if self.stopping.is_set():
+                    w.stop()
+        except ApiException as exc:
+            if exc.status == 410:
+                raise ResourceGone()
+            raise
+        #Not on failure: the events are replayed from the last checkpoint.
+        if processed:
+            self._checkpoint(version, cluster, namespace)
+        return version
+
+    def _process_event(self, event_type, obj, cluster):
+        """
+        Buffer the status of a watched deployment.
+        :param event_type: ADDED, MODIFIED or DELETED.
+        :type event_type: str
+        :param obj: The deployment fields.
+        :type obj: defournement.events.Summary
+        :param cluster: The cluster name.
+        :type cluster: str
+        """
+        if obj.namespace in self.exclude_namespaces:
+            return
+        if not self._owns(obj.namespace):
+            return
+        if event_type == 'ADDED':
+            return
+        # Retrieve uid: a custom label selector may let unstamped deployments through.
+        uid = (obj.labels or {}).get('uid')
+        if not uid:
+            return
+        LOGGER.info("%s %s [%s] %s", event_type, obj.kind, obj.namespace, obj.name)
+        self._observe_age(obj, cluster)
+        self._write_status(uid, self._deployment_status(obj, event_type == 'DELETED'))
+
+    def _relist(self, v1ext, cluster=None, namespace=None):
+        """
+        List the deployments of a cluster page by page to reconcile their status,
+        instead of replaying every event.
+        :param v1ext: The extensions API.
+        :type v1ext: client.ExtensionsV1beta1Api
+        :param cluster: The cluster name.
+        :type cluster: str
+        :param namespace: The watched namespace, None for all of them.
+        :type namespace: str
+        :returns: The resource version to resume the watch from.
+        :rtype: str
+        """
+        seen = set()
+        method, args, kwargs = self._selectors(v1ext, namespace)
+        kwargs['limit'] = 500
+        while True:
+            result = method(*args, **kwargs)
+            current = {}
+            for item in result.items:
+                if item.metadata.namespace in self.exclude_namespaces or not self._owns(item.metadata.namespace):
+                    continue
+                uid = (item.metadata.labels or {}).get('uid')
+                if uid:
+                    current[_key(uid)] = self._deployment_status(summary(item), False)
+            seen.update(current)
+            #Only write the statuses that changed.
+            if current:
+                with QUERY.labels('relist').time():
+                    known = list(Model.select(Model.uid, Model.status).where(Model.uid << list(current.keys())))
+                for deployment in known:
+                    uid = _key(deployment.uid)
+                    if deployment.status != current[uid]:
+                        self._write_status(uid, current[uid])
+            if not result.metadata._continue:#pylint:disable=protected-access
+                break
+            kwargs['_continue'] = result.metadata._continue#pylint:disable=protected-access
+        #The deletions missed while the version was gone, on this cluster (and namespace) only.
+        cluster = defournement.clusters.resolve(cluster)
+        located = Model.cluster == cluster
+        if cluster == defournement.clusters.names()[0]:
+            located |= Model.cluster >> None
+        if namespace is not None:
+            located &= Model.namespace == namespace
+        with QUERY.labels('relist_terminating').time():
+            terminating = list(Model.select(Model.uid, Model.namespace).where(Model.status == 'terminating', located))
+        for deployment in terminating:
+            if _key(deployment.uid) not in seen and self._owns(deployment.namespace):
+                self._write_status(_key(deployment.uid), 'terminated')
+        return result.metadata.resource_version
+
+    @staticmethod
+    def _observe_age(obj, cluster):
+        """
+        Record the age of the last update of a deployment, from its conditions.
+        :param obj: The deployment fields.
+        :type obj: defournement.events.Summary
+        """
+        if obj.updates:
+            latest = max(obj.updates)
+            now = datetime.datetime.now(latest.tzinfo) if latest.tzinfo else datetime.datetime.utcnow()
+            defournement.metrics.WATCH_EVENT_AGE.labels(cluster).observe(max(0, (now - latest).total_seconds()))
+
+    @staticmethod
+    def _deployment_status(obj, deleted):
+        """
+        Compute the status of a kubernetes deployment.
+        :param obj: The deployment fields.
+        :type obj: defournement.events.Summary
+        :param deleted: True if the deployment was deleted.
+        :type deleted: bool
+        :returns: The status.
+        :rtype: str
+        """
+        if deleted:
+            return 'terminated'
+        if obj.unavailable_replicas in (None, 0):
+            return 'running'
+        return 'unhealthy'
+
+    def _warm_status_cache(self):
+        """
+        Load the status of the most recent deployments in the last status cache.
+        The entries are kept by their hex uid, as read from the labels, and dropped
+        by the transitions other writers notify: see `_forget_statuses()`.
+        """
+        query = Model.select(Model.uid, Model.status).where(~(Model.status >> None)).order_by(Model.date_created.desc()).limit(self.last_status.size)
+        with QUERY.labels('warm').time():
+            deployments = list(query)
+        #Oldest first: the most recent deployments are the last evicted.
+        for deployment in reversed(deployments):
+            self.last_status.set(_key(deployment.uid), deployment.status)
+
+    def _forget_statuses(self, transitions):
+        """
+        Notification listener dropping the last statuses written by the RPCs and the rollouts,
+        of this process or of another replica: the next event of these deployments reads the database.
+        :param transitions: The transitions, as dicts with uid, owner, status and date_created.
+        :type transitions: list
+        """
+        for transition in transitions:
+            if transition['status'] not in ('running', 'unhealthy'):
+                self.last_status.delete(transition['uid'])
+
+    def _checkpoint(self, version, cluster=None, namespace=None):
+        """
+        Persist the last processed version, once its statuses are written.
+        :param version: The resource version.
+        :type version: str
+        :param cluster: The cluster name.
+        :type cluster: str
+        :param namespace: The watched namespace, None for all of them.
+        :type namespace: str
+        """
+        self.status_buffer.flush()
+        with QUERY.labels('checkpoint').time():
+            WatchState.store(self._watch_state(cluster, namespace), version)
+
+    def _write_status(self, uid, status):
+        """
+        Buffer a status coming from the cluster, only if it is a transition.
+        :param uid: The deployment uid.
+        :type uid: str
+        :param status: The status.
+        :type status: str
+        """
+        uid = _key(uid)
+        current = self.last_status.get(uid)
+        if current is None:
+            with QUERY.labels('status').time():
+                current = Model.select(Model.status).where(Model.uid == uid).scalar()
+        if current == status:
+            self.skipped_writes += 1
+            self.last_status.set(uid, status)
+            return
+        self.last_status.set(uid, status)
+        self.status_buffer.add({'uid': uid, 'status': status, 'date_created': datetime.datetime.now()})
+
+    def _flush_statuses(self, rows):
+        """
+        Write a batch of statuses, then notify them. The rows of unknown deployments are
+        rejected one by one instead of failing the whole batch.
+        :param rows: The statuses.
+        :type rows: list
+        """
+        uids = set(row['uid'] for row in rows)
+        with QUERY.labels('known').time():
+            known = dict((_key(uid), owner) for uid, owner in Model.select(Model.uid, Model.owner).where(Model.uid << list(uids)).tuples())
+        accepted = []
+        for row in rows:
+            if row['uid'] in known:
+                accepted.append(row)
+                continue
+            self.last_status.delete(row['uid'])
+            LOGGER.error('Unknown deployment uid')
+        if not accepted:
+            return
+        written = accepted
+        try:
+            with QUERY.labels('record_many').time():
+                Status.record_many(accepted)
+        except IntegrityError:
+            written = []
+            for row in accepted:
+                try:
+                    with QUERY.labels('record').time():
+                        Status.record(row['uid'], row['status'], date_created=row['date_created'])
+                    written.append(row)
+                except IntegrityError:
+                    self.last_status.delete(row['uid'])
+                    LOGGER.exception('Unknown deployment uid')
+        except Exception:
+            #Not written : the next event must not be skipped.
+            for uid in uids:
+                self.last_status.delete(uid)
+            raise
+        now = datetime.datetime.now()
+        for row in accepted:
+            defournement.metrics.WATCH_LAG.labels().observe((now - row['date_created']).total_seconds())
+        _notify([dict(row, owner=known[row['uid']]) for row in written])
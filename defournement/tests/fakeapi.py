@@ -0,0 +1,197 @@
+#-*- coding:utf-8 -*-
+"""
+Fake kubernetes API server, for the benchmarks:
+- namespaces, services, ingresses and deployments CRUD.
+- deployments watch, streaming the queued events.
+- configurable per-request latency and error rate.
+"""
+import json
+import random
+import re
+import threading
+import time
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+ROUTES = [
+    (re.compile(r'^/api/v1/namespaces(?:/(?P<name>[^/]+))?$'), 'namespaces'),
+    (re.compile(r'^/api/v1/namespaces/(?P<namespace>[^/]+)/services(?:/(?P<name>[^/]+))?$'), 'services'),
+    (re.compile(r'^/apis/extensions/v1beta1/namespaces/(?P<namespace>[^/]+)/ingresses(?:/(?P<name>[^/]+))?$'), 'ingresses'),
+    (re.compile(r'^/apis/extensions/v1beta1/namespaces/(?P<namespace>[^/]+)/deployments(?:/(?P<name>[^/]+))?$'), 'deployments'),
+    (re.compile(r'^/apis/extensions/v1beta1/deployments$'), 'deployments'),
+]
+
+def json_patch_apply(document, ops):
+    """
+    Apply RFC 6902 add/replace/remove operations.
+    """
+    for op in ops:
+        keys = [k.replace('~1', '/').replace('~0', '~') for k in op['path'].split('/')[1:]]
+        parent = document
+        for key in keys[:-1]:
+            parent = parent.setdefault(key, {})
+        if op['op'] == 'remove':
+            parent.pop(keys[-1], None)
+        else:
+            parent[keys[-1]] = op['value']
+    return document
+
+def _merge(document, patch):
+    """
+    Merge a full object patch.
+    """
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(document.get(key), dict):
+            _merge(document[key], value)
+        else:
+            document[key] = value
+    return document
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Request handler, backed by the server objects.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):#pylint:disable=arguments-differ
+        pass
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _status(self, code, reason):
+        self._send(code, {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure', 'reason': reason, 'code': code})
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        for regex, collection in ROUTES:
+            match = regex.match(url.path)
+            if match:
+                break
+        else:
+            return self._status(404, 'NotFound')
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            return self._status(500, 'InternalError')
+        params = match.groupdict()
+        namespace, name = params.get('namespace'), params.get('name')
+        if method == 'GET' and query.get('watch', ['false'])[0].lower() == 'true':
+            return self._watch()
+        if name is None and method == 'GET':
+            items = [obj for (col, ns, _), obj in list(self.server.objects.items()) if col == collection and namespace in (None, ns)]
+            return self._send(200, {'kind': 'List', 'apiVersion': 'v1', 'metadata': {'resourceVersion': str(self.server.version)}, 'items': items})
+        if method == 'POST':
+            obj = self._body()
+            name = obj['metadata']['name']
+            key = (collection, namespace, name)
+            with self.server.lock:
+                if key in self.server.objects:
+                    return self._status(409, 'AlreadyExists')
+                self.server.version += 1
+                obj['metadata'].update(namespace=namespace, resourceVersion=str(self.server.version))
+                self.server.objects[key] = obj
+            return self._send(201, obj)
+        key = (collection, namespace, name)
+        with self.server.lock:
+            obj = self.server.objects.get(key)
+            if obj is None:
+                return self._status(404, 'NotFound')
+            if method == 'DELETE':
+                del self.server.objects[key]
+                return self._send(200, {'kind': 'Status', 'status': 'Success'})
+            if method == 'PATCH':
+                patch = self._body()
+                if isinstance(patch, list):
+                    json_patch_apply(obj, patch)
+                else:
+                    _merge(obj, patch)
+                self.server.version += 1
+                obj['metadata']['resourceVersion'] = str(self.server.version)
+        return self._send(200, obj)
+
+    def _watch(self):
+        """
+        Stream the queued events, chunked, then close the stream.
+        """
+        with self.server.lock:
+            events, self.server.events = self.server.events, []
+        if not events and self.server.on_idle_watch:
+            self.server.on_idle_watch()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in events:
+            data = (json.dumps(event) + '\n').encode('utf-8')
+            self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_GET(self):#pylint:disable=invalid-name
+        self._handle('GET')
+
+    def do_POST(self):#pylint:disable=invalid-name
+        self._handle('POST')
+
+    def do_PATCH(self):#pylint:disable=invalid-name
+        self._handle('PATCH')
+
+    def do_DELETE(self):#pylint:disable=invalid-name
+        self._handle('DELETE')
+
+class FakeApiServer(ThreadingMixIn, HTTPServer):
+    """
+    In-memory kubernetes API server.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0, error_rate=0):
+        """
+        :param latency: The delay added to each request, in seconds.
+        :type latency: float
+        :param error_rate: The probability of a 500 response.
+        :type error_rate: float
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.objects = {}
+        self.events = []
+        self.version = 0
+        self.requests = 0
+        self.on_idle_watch = None
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self):
+        """
+        Serve in a thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
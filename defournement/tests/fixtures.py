@@ -11,6 +11,8 @@ import time
 import uuid
 import pytest
 import defournement
+import defournement.migrations
+import defournement.notify
 import defournement.service
 import farine.exceptions
 import farine.rpc
@@ -44,6 +46,7 @@ def init(postgres, tmpdir):
     db.execute_sql('CREATE TABLE "status" ("id" SERIAL NOT NULL PRIMARY KEY, "uid_id" VARCHAR(255) NOT NULL, "status" VARCHAR(255) NOT NULL, "date_created" TIMESTAMP DEFAULT NOW(), FOREIGN KEY(uid_id) REFERENCES deployment(uid))')
     db.close()
     farine.connectors.sql.init('defournement', db)
+    defournement.migrations.migrate()
 
 
 @pytest.fixture()
@@ -122,7 +125,7 @@ def db_factory():
         Deployment.create(owner=owner, uid=uid, name=name, namespace=namespace, date_created=date_created)
         status = ['deploying', 'aborted'] if fail else ['deploying', 'running']
         for state in status:
-            Status.create(uid=uid, status=state, date_created=date_created)
+            Status.record(uid, state, date_created=date_created)
         return uid
     return factory
 
@@ -152,5 +155,7 @@ def request_factory():
     return factory
 
 @pytest.fixture()
-def defour():
-    return defournement.service.Defournement()
+def defour(request):
+    instance = defournement.service.Defournement()
+    request.addfinalizer(lambda: defournement.notify.remove_listener(instance._forget_statuses))
+    return instance
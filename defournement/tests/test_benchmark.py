@@ -0,0 +1,143 @@
+#-*- coding:utf-8 -*-
+"""
+Benchmarks, against the fake kubernetes API server.
+Disabled unless DEFOURNEMENT_BENCHMARK=1. Options, from the environment:
+- BENCH_LATENCY : the API server latency, in milliseconds. Default to 5.
+- BENCH_ERROR_RATE : the API server error rate. Default to 0.
+- BENCH_DEPLOYS : the number of deploys. Default to 200.
+- BENCH_RPC_CALLS : the number of list()/detail() calls. Default to 500.
+- BENCH_EVENTS : the number of watch events. Default to 20000.
+- BENCH_MANIFESTS : the number of rendered manifests. Default to 5000.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+import sys
+from farine.connectors.sql import fn
+from .fixtures import *
+from .fakeapi import FakeApiServer
+
+pytestmark = pytest.mark.skipif(os.environ.get('DEFOURNEMENT_BENCHMARK') != '1', reason='DEFOURNEMENT_BENCHMARK=1 not set')
+
+def _env(name, default):
+    return type(default)(os.environ.get(name, default))
+
+def percentile(values, rank):
+    """
+    The `rank` percentile of `values`.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * rank / 100.0))]
+
+def report(capsys, name, **values):
+    """
+    Print a benchmark result.
+    """
+    with capsys.disabled():
+        sys.stdout.write('\n[bench] {} {}\n'.format(name, ' '.join('{}={}'.format(k, v) for k, v in sorted(values.items()))))
+
+@pytest.fixture()
+def fakeapi():
+    """
+    The fake API server, used by the kubernetes client.
+    """
+    server = FakeApiServer(_env('BENCH_LATENCY', 5.0) / 1000, _env('BENCH_ERROR_RATE', 0.0)).start()
+    farine.settings.defournement['api_host'] = server.url
+    yield server
+    server.stop()
+
+@pytest.fixture()
+def bigdb():
+    """
+    100k deployments over 1000 owners, and 1M statuses.
+    """
+    from defournement.models import Deployment
+    db = Deployment._meta.database
+    db.execute_sql('INSERT INTO "deployment" ("uid", "namespace", "name", "owner", "status", "date_created") '
+                   'SELECT md5(i::text), \'bench-\' || (i % 100), \'name-\' || i, \'owner-\' || (i % 1000), \'running\', '
+                   'NOW() - (i || \' seconds\')::interval FROM generate_series(1, 100000) AS i')
+    db.execute_sql('INSERT INTO "status" ("uid_id", "status", "date_created") '
+                   'SELECT md5((i % 100000 + 1)::text), CASE WHEN i % 10 = 0 THEN \'unhealthy\' ELSE \'running\' END, '
+                   'NOW() - (i || \' seconds\')::interval FROM generate_series(1, 1000000) AS i')
+    db.execute_sql('ANALYZE')
+
+def test_bench_create(fakeapi, definition_factory, capsys):
+    """
+    Deploys per second.
+    """
+    service = defournement.service.Defournement()
+    definitions = [definition_factory(ports=[80]) for _ in xrange(_env('BENCH_DEPLOYS', 200))]
+    start = time.time()
+    for definition in definitions:
+        service.create(definition, mock.Mock())
+    elapsed = time.time() - start
+    report(capsys, 'create', deploys_per_sec=round(len(definitions) / elapsed, 1), api_requests=fakeapi.requests)
+
+def test_bench_create_async(fakeapi, definition_factory, capsys):
+    """
+    Deploys per second, with the rollouts in flight on the engine.
+    """
+    service = defournement.service.Defournement()
+    service.create_async = True
+    definitions = [definition_factory(ports=[80]) for _ in xrange(_env('BENCH_DEPLOYS', 200))]
+    start = time.time()
+    pending = [service.create(definition, mock.Mock()) for definition in definitions]
+    for result in pending:
+        result.get()
+    elapsed = time.time() - start
+    report(capsys, 'create_async', deploys_per_sec=round(len(definitions) / elapsed, 1), api_requests=fakeapi.requests)
+
+def test_bench_rpc(bigdb, capsys):
+    """
+    list() and detail() latency, with 100k deployments and 1M statuses.
+    """
+    from defournement.models import Deployment
+    service = defournement.service.Defournement()
+    calls = _env('BENCH_RPC_CALLS', 500)
+    deployments = list(Deployment.select(Deployment.uid, Deployment.owner).order_by(fn.random()).limit(calls))
+    for name, call in (('list', lambda d: service.list(d.owner, 0, 50)),
+                       ('detail', lambda d: service.detail(d.owner, d.uid))):
+        timings = []
+        for deployment in deployments:
+            start = time.time()
+            call(deployment)
+            timings.append((time.time() - start) * 1000)
+        report(capsys, name, p50_ms=round(percentile(timings, 50), 2), p99_ms=round(percentile(timings, 99), 2))
+
+def test_bench_watch(fakeapi, db_factory, capsys):
+    """
+    Watch events ingested per second.
+    """
+    service = defournement.service.Defournement()
+    uids = [db_factory('owner', 'repo{}'.format(i), 'branch') for i in xrange(100)]
+    count = _env('BENCH_EVENTS', 20000)
+    for i in xrange(count):
+        fakeapi.events.append({'type': 'MODIFIED', 'object': {
+            'kind': 'Deployment',
+            'apiVersion': 'extensions/v1beta1',
+            'metadata': {'name': 'toto', 'namespace': 'bench', 'resourceVersion': str(i + 1), 'labels': {'uid': uids[i % len(uids)]}},
+            'status': {'unavailableReplicas': (i // len(uids)) % 2}}})
+    fakeapi.on_idle_watch = service.stopping.set
+    start = time.time()
+    service.watch()
+    elapsed = time.time() - start
+    report(capsys, 'watch', events_per_sec=round(count / elapsed, 1))
+
+def test_bench_manifest(definition2, capsys):
+    """
+    Deployment manifests rendered per second, with and without the compiler.
+    """
+    definition = definition2['definition']
+    definition.update({'failure_threshold': 5, 'initial_delay_seconds': 3, 'interval_seconds': 10,
+                       'success_threshold': 1, 'timeout_seconds': 10})
+    for health in definition['healthchecks']:
+        health['command'] = health['protocol']
+    component = defournement.components.Deployment(definition)
+    count = _env('BENCH_MANIFESTS', 5000)
+    results = {}
+    for name, enabled in (('compiled', 'true'), ('models', 'false')):
+        farine.settings.defournement['manifest_compiler'] = enabled
+        start = time.time()
+        for _ in xrange(count):
+            component.manifest()
+        results[name] = round(count / (time.time() - start), 1)
+    farine.settings.defournement['manifest_compiler'] = 'true'
+    report(capsys, 'manifest', **results)
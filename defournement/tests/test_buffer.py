@@ -0,0 +1,54 @@
+#-*- coding:utf-8 -*-
+"""
+Test the write-behind buffer.
+"""
+import time
+from defournement.buffer import Buffer
+
+def test_buffer_size():
+    """
+    Flush as soon as the batch is full.
+    """
+    batches = []
+    buf = Buffer(batches.append, size=2, interval=60).start()
+    buf.add(1)
+    assert batches == []
+    buf.add(2)
+    assert batches == [[1, 2]]
+    buf.add(3)
+    buf.close()
+    assert batches == [[1, 2], [3]]
+
+def test_buffer_interval():
+    """
+    Flush the pending items after the interval.
+    """
+    batches = []
+    buf = Buffer(batches.append, size=100, interval=0.01).start()
+    buf.add(1)
+    time.sleep(0.1)
+    assert batches == [[1]]
+    buf.close()
+    assert batches == [[1]]
+
+def test_buffer_strict():
+    """
+    Raise the failed flushes, the periodic ones included, to the owner.
+    """
+    calls = []
+    def callback(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise ValueError()
+    buf = Buffer(callback, size=100, interval=0.01, strict=True).start()
+    buf.add(1)
+    time.sleep(0.1)
+    assert calls == [[1]]
+    buf.add(2)
+    try:
+        buf.flush()
+        assert False
+    except ValueError:
+        pass
+    buf.close()
+    assert calls == [[1], [2]]
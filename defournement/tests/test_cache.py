@@ -0,0 +1,75 @@
+#-*- coding:utf-8 -*-
+"""
+Test the in-process caches.
+"""
+from defournement.cache import LRUCache
+
+def test_lru_eviction():
+    """
+    The least recently used entry is evicted first.
+    """
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'hits': 3, 'misses': 1}
+
+def test_response_groups():
+    """
+    Invalidating a group only removes its entries.
+    """
+    from defournement.cache import ResponseCache
+    cache = ResponseCache(10, 60)
+    assert cache.set('a', 1, 'a1', cache.epoch('a'))
+    assert cache.set('a', 2, 'a2', cache.epoch('a'))
+    assert cache.set('b', 1, 'b1', cache.epoch('b'))
+    cache.invalidate('a')
+    assert cache.get('a', 1) is None
+    assert cache.get('b', 1) == 'b1'
+    assert len(cache) == 1
+
+def test_response_epoch():
+    """
+    A value read before an invalidation of its group is not stored.
+    """
+    from defournement.cache import ResponseCache
+    cache = ResponseCache(10, 60)
+    epoch, other = cache.epoch('a'), cache.epoch('b')
+    cache.invalidate('a')
+    assert not cache.set('a', 1, 'stale', epoch)
+    assert cache.get('a', 1) is None
+    assert cache.set('b', 1, 'b1', other)
+
+def test_response_epoch_bounds():
+    """
+    The epochs of the groups last invalidated are kept: forgetting one, or clearing, moves every group on.
+    """
+    from defournement.cache import ResponseCache
+    cache = ResponseCache(2, 60)
+    epoch = cache.epoch('a')
+    cache.invalidate('b', 'c')
+    assert cache.set('a', 1, 'a1', epoch)
+    cache.invalidate('d')
+    assert not cache.set('a', 2, 'stale', epoch)
+    epoch = cache.epoch('a')
+    cache.clear()
+    assert not cache.set('a', 2, 'stale', epoch)
+
+def test_response_bounds():
+    """
+    The entries are evicted by size and expire.
+    """
+    from defournement.cache import ResponseCache
+    cache = ResponseCache(2, 60)
+    for key in xrange(3):
+        cache.set('a', key, key, cache.epoch('a'))
+    assert cache.get('a', 0) is None
+    assert cache.get('a', 2) == 2
+    cache.ttl = -1
+    cache.set('b', 1, 'b1', cache.epoch('b'))
+    assert cache.get('b', 1) is None
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 2}
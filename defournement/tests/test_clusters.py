@@ -0,0 +1,96 @@
+#-*- coding:utf-8 -*-
+"""
+Test the multi-cluster placement and routing.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+import defournement.clusters
+import defournement.utils
+from defournement.clusters import HashRing
+
+@pytest.fixture()
+def clusters():
+    """
+    Two clusters, a and b.
+    """
+    settings = farine.settings.defournement
+    settings['clusters'] = 'a,b'
+    for name in ('a', 'b'):
+        settings['{}_api_host'.format(name)] = 'https://{}.example.com'.format(name)
+        settings['{}_api_ca_file'.format(name)] = settings['api_ca_file']
+        settings['{}_api_key'.format(name)] = '{}_key'.format(name)
+    return ['a', 'b']
+
+def test_single_cluster():
+    """
+    Without clusters, everything is placed on the default one.
+    """
+    assert defournement.clusters.names() == ['default']
+    assert defournement.clusters.place('toto') == 'default'
+    assert defournement.clusters.resolve(None) == 'default'
+
+def test_hash_ring_stable():
+    """
+    Adding a cluster only moves the namespaces placed on it.
+    """
+    keys = ['namespace-{}'.format(i) for i in xrange(1000)]
+    before = HashRing(['a', 'b'])
+    after = HashRing(['a', 'b', 'c'])
+    moved = [key for key in keys if before.get(key) != after.get(key)]
+    assert all(after.get(key) == 'c' for key in moved)
+    assert 200 < len(moved) < 500
+    assert set(before.get(key) for key in keys) == set(['a', 'b'])
+
+def test_place_explicit(clusters):
+    """
+    The explicit mapping overrides the hash.
+    """
+    farine.settings.defournement['cluster_map'] = 'toto:b,titi:unknown'
+    assert defournement.clusters.place('toto') == 'b'
+    assert defournement.clusters.place('titi') in clusters
+    assert defournement.clusters.place('tata') == defournement.clusters.place('tata')
+
+def test_api_client_per_cluster(clusters):
+    """
+    Each cluster has its own client, configuration and breaker.
+    """
+    defournement.utils.k8s_config()
+    a, b = defournement.utils.api_client('a'), defournement.utils.api_client('b')
+    assert a is not b
+    assert a is defournement.utils.api_client()
+    assert b.configuration.host == 'https://b.example.com'
+    assert b.configuration.api_key['authorization'] == 'b_key'
+    assert defournement.components.Service({'cluster': 'b'}).api_client is b
+    assert defournement.components.Namespace('toto', cluster='b').api_client is b
+    assert defournement.throttle.breaker('a') is not defournement.throttle.breaker('b')
+
+def test_create_records_cluster(clusters, definition1):
+    """
+    A deployment records its cluster, and is deleted from it.
+    """
+    from defournement.models import Deployment
+    farine.settings.defournement['cluster_map'] = '{}:b'.format(definition1['definition']['namespace'])
+    service = defournement.service.Defournement()
+    with mock.patch.object(service, '_rollout', mock.Mock(return_value=True)) as rollout:
+        service.create(definition1, mock.Mock())
+        assert rollout.call_args[0][0]['cluster'] == 'b'
+    uid = definition1['definition']['uid']
+    assert Deployment.get(Deployment.uid == uid).cluster == 'b'
+    with mock.patch('defournement.components.Deployment.exists', mock.Mock(return_value=True)), \
+         mock.patch('defournement.components.Deployment.delete', mock.Mock(return_value=True)):
+        with mock.patch('defournement.components.Deployment.__init__', mock.Mock(return_value=None)) as init:
+            service.delete(definition1['definition']['owner'], uid)
+            assert init.call_args[0][0]['cluster'] == 'b'
+
+def test_place_sticky(clusters, db_factory):
+    """
+    A namespace already deployed stays on its cluster, the first one if not recorded.
+    """
+    from defournement.models import Deployment
+    uid = db_factory('stickyowner', 'stickyrepo', 'stickybranch', fail=False, date_created=datetime.datetime.now())
+    namespace = Deployment.get(Deployment.uid == uid).namespace
+    for cluster in clusters:
+        Deployment.update(cluster=cluster).where(Deployment.uid == uid).execute()
+        assert defournement.clusters.place(namespace) == cluster
+    Deployment.update(cluster=None).where(Deployment.uid == uid).execute()
+    assert defournement.clusters.place(namespace) == 'a'
@@ -0,0 +1,111 @@
+#-*- coding:utf-8 -*-
+"""
+Test the components deploy path.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+from defournement.components.base import APPLIED_ANNOTATION, HASH_ANNOTATION, json_patch
+
+def _live(annotations):
+    """
+    A live object carrying `annotations`.
+    """
+    obj = mock.Mock()
+    obj.metadata.annotations = annotations
+    return obj
+
+def test_json_patch():
+    """
+    Compute a minimal patch: only the changed keys are written.
+    """
+    source = {'a': 1, 'b': {'c': [1], 'd': 2}, 'e/f': 3}
+    target = {'a': 1, 'b': {'c': [1, 2], 'g': 4}}
+    ops = json_patch(source, target)
+    assert sorted(json.dumps(op, sort_keys=True) for op in ops) == sorted(json.dumps(op, sort_keys=True) for op in [
+        {'op': 'remove', 'path': '/e~1f'},
+        {'op': 'remove', 'path': '/b/d'},
+        {'op': 'replace', 'path': '/b/c', 'value': [1, 2]},
+        {'op': 'add', 'path': '/b/g', 'value': 4},
+    ])
+
+def test_deploy_unchanged(defour, definition1):
+    """
+    Deploy a service whose specifications did not change: must not write anything.
+    """
+    component = defournement.components.Service(definition1['definition'])
+    annotations = component.manifest()['metadata']['annotations']
+    with mock.patch.object(component, 'read', mock.Mock(return_value=_live(annotations))):
+        with mock.patch.object(component, 'patch') as patch, mock.patch.object(component, 'create') as create:
+            assert component.deploy()
+            assert not patch.called
+            assert not create.called
+
+def test_deploy_changed(defour, definition1):
+    """
+    Deploy a service whose ports changed: must patch the ports and the annotations only.
+    """
+    previous = defournement.components.Service(definition1['definition'])
+    annotations = previous.manifest()['metadata']['annotations']
+    definition1['definition']['ports'].append({'number': 8080, 'protocol': 'tcp', 'name': 'http'})
+    component = defournement.components.Service(definition1['definition'])
+    with mock.patch.object(component, 'read', mock.Mock(return_value=_live(annotations))):
+        with mock.patch.object(component, 'patch') as patch:
+            assert component.deploy()
+            ops = patch.call_args[0][0]
+            assert [op['path'] for op in ops if 'annotations' not in op['path']] == ['/spec/ports']
+            assert set(op['path'] for op in ops if 'annotations' in op['path']) == set([
+                '/metadata/annotations/' + HASH_ANNOTATION.replace('/', '~1'),
+                '/metadata/annotations/' + APPLIED_ANNOTATION.replace('/', '~1')])
+
+def test_deploy_not_found(defour, definition1):
+    """
+    Deploy a service which does not exist: must create it.
+    """
+    component = defournement.components.Service(definition1['definition'])
+    with mock.patch.object(component, 'read', mock.Mock(side_effect=ApiException(404))):
+        with mock.patch.object(component, 'create', mock.Mock(return_value=True)) as create:
+            assert component.deploy()
+            assert create.call_args[0][0]['metadata']['annotations'][HASH_ANNOTATION]
+
+def test_deploy_conflict(defour, definition1):
+    """
+    Deploy a service missing from a stale informer store, but existing: must patch it, not fail on the 409.
+    """
+    previous = defournement.components.Service(definition1['definition'])
+    annotations = previous.manifest()['metadata']['annotations']
+    definition1['definition']['ports'].append({'number': 8080, 'protocol': 'tcp', 'name': 'http'})
+    component = defournement.components.Service(definition1['definition'])
+    store = mock.Mock(exclude_namespaces=[])
+    store.get.return_value = None
+    with mock.patch('defournement.informer.informer', mock.Mock(return_value=store)), \
+         mock.patch('kubernetes.client.CoreV1Api.create_namespaced_service', mock.Mock(side_effect=ApiException(409))):
+        with mock.patch.object(component, 'read', mock.Mock(return_value=_live(annotations))), \
+             mock.patch.object(component, 'patch') as patch:
+            assert component.deploy()
+            assert [op['path'] for op in patch.call_args[0][0] if 'annotations' not in op['path']] == ['/spec/ports']
+
+def test_namespace_cache(defour, request_factory):
+    """
+    Deploy a namespace twice: must read it once.
+    """
+    name = gen_str().lower()
+    request = request_factory(200, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)) as rest:
+        assert defournement.components.Namespace(name).deploy()
+        assert defournement.components.Namespace(name).deploy()
+        assert rest.call_count == 1
+
+def test_namespace_negative_cache(defour, request_factory):
+    """
+    Deploy a missing namespace: must create it without reading it again.
+    """
+    from defournement.components.namespace import namespaces
+    name = gen_str().lower()
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(side_effect=ApiException(404))):
+        assert not defournement.components.Namespace(name).exists()
+    request = request_factory(200, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)) as rest:
+        assert defournement.components.Namespace(name).deploy()
+        assert rest.call_args[0][0] == 'POST'
+        assert rest.call_count == 1
+    assert namespaces().get(name) is True
@@ -0,0 +1,104 @@
+#-*- coding:utf-8 -*-
+"""
+Test the coordination of the watch replicas.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+import defournement.coordination
+from defournement.coordination import Leader, Shards
+
+def _until(condition, timeout=5):
+    """
+    Wait for `condition`.
+    """
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+def test_coordinator_disabled():
+    """
+    Without coordination, every replica watches everything.
+    """
+    assert defournement.coordination.coordinator() is None
+
+def test_leader_failover():
+    """
+    A single leader at a time, replaced once it stops.
+    """
+    first = Leader(0.1).start()
+    assert _until(first.active)
+    second = Leader(0.1).start()
+    time.sleep(0.5)
+    assert not second.active()
+    first.stop()
+    assert not first.active()
+    assert _until(second.active)
+    second.stop()
+
+def test_leader_rebind():
+    """
+    The leader keeps its lock when farine binds the models to another database.
+    """
+    from defournement.models import Deployment, WatchMember
+    first = Leader(0.1).start()
+    assert _until(first.active)
+    broken = mock.Mock(**{'execute_sql.side_effect': ValueError()})
+    with mock.patch.object(Deployment._meta, 'database', broken), \
+         mock.patch.object(WatchMember._meta, 'database', broken):
+        time.sleep(0.5)
+        assert first.active()
+    second = Leader(0.1).start()
+    time.sleep(0.5)
+    assert not second.active()
+    first.stop()
+    assert _until(second.active)
+    second.stop()
+
+def test_shards():
+    """
+    The namespaces are spread over the live members, without overlap.
+    """
+    namespaces = ['namespace-{}'.format(i) for i in xrange(100)]
+    farine.settings.defournement['coordination_member'] = 'a'
+    first = Shards(0.1).start()
+    farine.settings.defournement['coordination_member'] = 'b'
+    second = Shards(0.1).start()
+    assert _until(lambda: first.members == ['a', 'b'] and second.members == ['a', 'b'])
+    owned = [(first.owns(namespace), second.owns(namespace)) for namespace in namespaces]
+    assert all(a != b for a, b in owned)
+    assert any(a for a, _ in owned) and any(b for _, b in owned)
+    first.stop()
+    assert _until(lambda: second.members == ['b'])
+    assert all(second.owns(namespace) for namespace in namespaces)
+    second.stop()
+
+def test_watch_shard(defour, deploydb1):
+    """
+    Watch with a shard: only the owned namespaces are written.
+    """
+    coordinator = mock.Mock(generation=1, state_suffix='b')
+    coordinator.owns.side_effect = lambda namespace: namespace == 'mine'
+    events = []
+    for namespace in ('theirs', 'mine'):
+        obj = mock.Mock()
+        obj.kind = 'deployment'
+        obj.metadata.namespace = namespace
+        obj.metadata.name = 'toto'
+        obj.metadata.resource_version = '42'
+        obj.metadata.labels = {'uid': namespace}
+        obj.status.unavailable_replicas = 1
+        events.append({'type': 'MODIFIED', 'object': obj})
+    def stream(*args, **kwargs):
+        defour.stopping.set()
+        return events
+    with mock.patch('defournement.coordination.coordinator', mock.Mock(return_value=coordinator)), \
+         mock.patch.object(defour, '_relist', mock.Mock(return_value='1')) as relist, \
+         mock.patch.object(defour, '_write_status') as write, \
+         mock.patch('kubernetes.watch.Watch.stream', mock.Mock(side_effect=stream)):
+        defour.watch()
+    assert relist.called
+    assert [call[0][0] for call in write.call_args_list] == ['mine']
+    assert coordinator.stop.called
+    from defournement.models import WatchState
+    assert WatchState.load('deployment@b') == '42'
@@ -44,6 +44,48 @@ def test_create_ko_409(definition1, request_factory):
         service = defournement.service.Defournement()
         assert not service.create(definition1, mock.Mock())
 
+def test_create_ko_status(definition1, request_factory):
+    """
+    Deploy a recipe whose components all fail: must record one error per component.
+    """
+    from defournement.models import Status
+    request = request_factory(400, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)) as deployment:
+        deployment.side_effect = ApiException(400)
+        service = defournement.service.Defournement()
+        service.create(definition1, mock.Mock())
+    uid = definition1['definition']['uid']
+    statuses = set(s.status for s in Status.select().where(Status.uid == uid))
+    assert statuses == set(['deploying', 'error:service', 'error:ingress', 'error:deployment'])
+
+def test_create_timeline_failure(definition1, request_factory):
+    """
+    Deploy a recipe whose timeline cannot be recorded: must still record the errors.
+    """
+    from defournement.models import Status
+    request = request_factory(400, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)) as deployment:
+        deployment.side_effect = ApiException(400)
+        with mock.patch('defournement.models.RolloutStep.insert_many', mock.Mock(side_effect=ValueError())):
+            service = defournement.service.Defournement()
+            assert not service.create(definition1, mock.Mock())
+    uid = definition1['definition']['uid']
+    statuses = set(s.status for s in Status.select().where(Status.uid == uid))
+    assert 'error:deployment' in statuses
+
+def test_create_timeline(definition1, request_factory):
+    """
+    Deploy a recipe: must record the duration and the API server requests of each step.
+    """
+    from defournement.models import RolloutStep
+    request = request_factory(200, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)):
+        service = defournement.service.Defournement()
+        service.create(definition1, mock.Mock())
+    steps = dict((s.step, s) for s in RolloutStep.select().where(RolloutStep.uid == definition1['definition']['uid']))
+    assert sorted(steps) == ['deployment', 'ingress', 'namespace', 'service']
+    assert all(step.success and step.duration >= 0 for step in steps.values())
+    assert steps['deployment'].api_calls >= 1
 
 def test_delete_ok(deploydb1, request_factory):
     """
@@ -81,3 +123,83 @@ def test_delete_ko(deploydb1, request_factory):
             deployment.side_effect = ApiException(409)
             service = defournement.service.Defournement()
             assert not service.delete('deploydb1owner', deploydb1)
+
+def test_create_batch(definition_factory, request_factory):
+    """
+    Deploy a batch of recipes in the same namespace: must deploy the namespace once and ack every message.
+    """
+    from defournement.models import Deployment, RolloutStep
+    definitions = [definition_factory(ports=[80]) for _ in range(3)]
+    for definition in definitions:
+        definition['definition']['namespace'] = 'batch'
+    messages = [mock.Mock() for _ in definitions]
+    request = request_factory(200, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)):
+        with mock.patch('defournement.components.Namespace.deploy', mock.Mock(return_value=True)) as namespace:
+            service = defournement.service.Defournement()
+            service.create_batch_size = 3
+            for definition, message in zip(definitions, messages):
+                service.create(definition, message)
+            service.create_batch.close()
+            assert namespace.call_count == 1
+    assert all(message.ack.called for message in messages)
+    assert Deployment.select().where(Deployment.namespace == 'batch').count() == 3
+    assert RolloutStep.select().join(Deployment).where(Deployment.namespace == 'batch', RolloutStep.step == 'namespace').count() == 3
+
+def test_create_batch_settle(definition_factory, request_factory):
+    """
+    Deploy a batch from the buffer thread, one application already inserted by a requeued batch:
+    must deploy both, and ack the messages on the consumer thread only.
+    """
+    import threading
+    from defournement.models import Deployment, RolloutStep, Status
+    definitions = [definition_factory(ports=[80]) for _ in range(2)]
+    first = dict(definitions[0]['definition'], cluster=None)
+    Deployment.create(uid=first['uid'], owner=first['owner'], name=first['name'], namespace=first['namespace'], status='deploying')
+    Status.create(uid=first['uid'], status='deploying')
+    messages = [mock.Mock() for _ in definitions]
+    request = request_factory(200, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)):
+        with mock.patch('defournement.components.Namespace.deploy', mock.Mock(return_value=True)):
+            service = defournement.service.Defournement()
+            service.create_batch_size = 3
+            for definition, message in zip(definitions, messages):
+                service.create(definition, message)
+            thread = threading.Thread(target=service.create_batch.flush)
+            thread.start()
+            thread.join()
+            assert not any(message.ack.called for message in messages)
+            service.settle()
+            service.create_batch.close()
+    assert all(message.ack.called for message in messages)
+    assert RolloutStep.select().where(RolloutStep.uid == first['uid'], RolloutStep.step == 'deployment').count() == 1
+
+def test_create_batch_backoff(definition1):
+    """
+    A failed batch is requeued once its delay expired, not at once.
+    """
+    import time
+    farine.settings.defournement['create_retry_delay'] = '10'
+    definition1['definition']['cluster'] = None
+    message = mock.Mock()
+    service = defournement.service.Defournement()
+    with mock.patch.object(service, '_insert_many', mock.Mock(side_effect=ValueError())):
+        with pytest.raises(ValueError):
+            service._create_many([(definition1, message)])
+    service.settle()
+    assert not message.requeue.called
+    with mock.patch('time.time', mock.Mock(return_value=time.time() + 10)):
+        service.settle()
+    assert message.requeue.called
+    assert service.create_failures == 1
+
+def test_create_async(definition1, request_factory):
+    """
+    Deploy a recipe on the engine: must return the pending rollout.
+    """
+    request = request_factory(200, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)):
+        service = defournement.service.Defournement()
+        service.create_async = True
+        result = service.create(definition1, mock.Mock())
+        assert result.get(timeout=10)
@@ -26,3 +26,21 @@ def test_detail_no_owner(deploydb1):
     """
     entries = defournement.service.Defournement().detail('toto', deploydb1)
     assert len(entries['results']) == 0
+
+def test_detail_cursor(deploydb1):
+    """
+    Test the detail method by pages of one status : must succeed.
+    """
+    service = defournement.service.Defournement()
+    first = service.detail('deploydb1owner', deploydb1, limit=1)
+    assert first['count'] == 2
+    assert len(first['results']) == 1
+    #Counted once: the cursor carries the count of the first page.
+    from defournement.models import Status
+    Status.create(uid=deploydb1, status='running')
+    second = service.detail('deploydb1owner', deploydb1, limit=1, cursor=first['next'])
+    assert second['count'] == 2
+    assert len(second['results']) == 1
+    assert second['results'] != first['results']
+    assert second['next'] is None
+    assert second['previous']
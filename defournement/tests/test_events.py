@@ -0,0 +1,55 @@
+#-*- coding:utf-8 -*-
+"""
+Test the watch events decoding.
+"""
+import json
+import mock
+from kubernetes import client
+from defournement.events import RawWatch, summary
+
+DEPLOYMENT = {
+    'kind': 'Deployment',
+    'apiVersion': 'extensions/v1beta1',
+    'metadata': {'name': 'toto', 'namespace': 'toto-default', 'resourceVersion': '42', 'labels': {'uid': 'uid'}},
+    'spec': {'replicas': 1, 'template': {'spec': {'containers': [{'name': 'toto', 'image': 'toto:latest'}]}}},
+    'status': {'unavailableReplicas': 1, 'conditions': [
+        {'type': 'Available', 'status': 'False', 'lastUpdateTime': '2018-01-01T00:00:00Z', 'lastTransitionTime': '2018-01-01T00:00:00Z'},
+        {'type': 'Progressing', 'status': 'True', 'lastUpdateTime': '2018-01-01T00:01:00Z', 'lastTransitionTime': '2018-01-01T00:00:00Z'}]},
+}
+
+def _stream(watcher):
+    """
+    Stream an event through `watcher`, from a fake response.
+    """
+    resp = mock.Mock()
+    resp.read_chunked.return_value = [json.dumps({'type': 'MODIFIED', 'object': DEPLOYMENT}) + '\n']
+    api = client.ExtensionsV1beta1Api(mock.Mock())
+    with mock.patch.object(api.api_client, 'call_api', mock.Mock(return_value=resp)):
+        return list(watcher.stream(api.list_deployment_for_all_namespaces))
+
+def test_raw_watch():
+    """
+    The raw watch yields the decoded JSON, not the models.
+    """
+    events = _stream(RawWatch())
+    assert events[0]['object'] == DEPLOYMENT
+
+def test_summary_raw_model():
+    """
+    The raw and the model deployments have the same summary, but their timezone.
+    """
+    from kubernetes import watch
+    raw = summary(_stream(RawWatch())[0]['object'])
+    model = summary(_stream(watch.Watch())[0]['object'])
+    assert raw[:6] == model[:6] == ('Deployment', 'toto-default', 'toto', '42', {'uid': 'uid'}, 1)
+    assert max(raw.updates).isoformat() == '2018-01-01T00:01:00'
+    assert max(model.updates).replace(tzinfo=None) == max(raw.updates)
+
+def test_summary_missing():
+    """
+    A deployment without status nor labels.
+    """
+    obj = summary({'metadata': {'name': 'toto'}})
+    assert obj.labels is None
+    assert obj.unavailable_replicas is None
+    assert obj.updates == []
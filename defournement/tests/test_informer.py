@@ -0,0 +1,59 @@
+#-*- coding:utf-8 -*-
+"""
+Test the informer.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+import defournement.informer
+
+def _obj(namespace, name):
+    obj = mock.Mock()
+    obj.metadata.namespace = namespace
+    obj.metadata.name = name
+    return obj
+
+@pytest.fixture()
+def informer(defour):
+    """
+    A synced informer holding one service, without any thread.
+    """
+    informer = defournement.informer.Informer(defournement.utils.api_client(), ['kube-system'], kinds=['service'])
+    listing = mock.Mock(items=[_obj('toto', 'repo'), _obj('kube-system', 'dns')])
+    listing.metadata._continue = None
+    with mock.patch('kubernetes.client.CoreV1Api.list_service_for_all_namespaces', mock.Mock(return_value=listing)):
+        informer._list('service')
+    with mock.patch('defournement.informer.informer', mock.Mock(return_value=informer)):
+        yield informer
+
+def test_informer_store(informer):
+    """
+    The listed objects are indexed, the excluded namespaces ignored.
+    """
+    assert informer.has_synced('service')
+    assert informer.get('service', 'toto', 'repo') is not None
+    assert informer.get('service', 'kube-system', 'dns') is None
+    informer.stores['service'].apply('DELETED', _obj('toto', 'repo'))
+    assert informer.get('service', 'toto', 'repo') is None
+
+def test_informer_exists(informer):
+    """
+    The components existence is answered from the informer, without any request.
+    """
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request') as request:
+        assert defournement.components.Service({'namespace': 'toto', 'repo': 'repo'}).exists()
+        assert not defournement.components.Service({'namespace': 'toto', 'repo': 'other'}).exists()
+        assert not request.called
+
+def test_informer_namespace_create(defour):
+    """
+    A namespace missing from the informer must be created, not answered from the store.
+    """
+    informer = defournement.informer.Informer(defournement.utils.api_client(), ['kube-system'], kinds=['namespace'])
+    listing = mock.Mock(items=[])
+    listing.metadata._continue = None
+    with mock.patch('kubernetes.client.CoreV1Api.list_namespace', mock.Mock(return_value=listing)):
+        informer._list('namespace')
+    with mock.patch('defournement.informer.informer', mock.Mock(return_value=informer)), \
+         mock.patch('kubernetes.client.CoreV1Api.create_namespace') as create:
+        assert defournement.components.Namespace('toto-new').deploy()
+        assert create.called
@@ -39,3 +39,52 @@ def test_get_specific_offset(deploydb1, deploydb1bis, deploydb2):
     ##
     entry = json.loads(entries['results'][0])
     assert entry['uid'] == deploydb1
+
+def test_get_status(deploydb1, deploydb1bis, deploydb2):
+    """
+    Test the get method returns the latest status of each deployment: must succeed.
+    """
+    entries = defournement.service.Defournement().list('deploydb1owner')
+    assert json.loads(entries['results'][0])['status'] == 'aborted'
+    assert json.loads(entries['results'][1])['status'] == 'running'
+
+def test_get_out_of_range(deploydb1, deploydb1bis, deploydb2):
+    """
+    Test the get method with an offset beyond the last deployment: must still count.
+    """
+    entries = defournement.service.Defournement().list('deploydb1owner', 5)
+    assert entries['count'] == 2
+    assert len(entries['results']) == 0
+
+def test_backfill_status(deploydb1, deploydb1bis):
+    """
+    Backfill the deployments without status : must use their latest status.
+    """
+    from defournement.models import Deployment, backfill_status
+    Deployment.update(status=None).execute()
+    assert backfill_status() == 2
+    assert Deployment.get(Deployment.uid == deploydb1).status == 'running'
+    assert Deployment.get(Deployment.uid == deploydb1bis).status == 'aborted'
+    assert backfill_status() == 0
+
+def test_get_cursor(deploydb1, deploydb1bis, deploydb2):
+    """
+    Test the get method with the cursors : must walk the pages both ways.
+    """
+    service = defournement.service.Defournement()
+    first = service.list('deploydb1owner', 0, 1)
+    assert first['previous'] is None
+    second = service.list('deploydb1owner', limit=1, cursor=first['next'])
+    assert second['count'] == 2
+    assert json.loads(second['results'][0])['uid'] == deploydb1
+    assert second['next'] is None
+    back = service.list('deploydb1owner', limit=1, cursor=second['previous'])
+    assert json.loads(back['results'][0])['uid'] == deploydb1bis
+    assert back['previous'] is None
+
+def test_get_invalid_cursor(deploydb1):
+    """
+    Test the get method with an invalid cursor : return an empty list.
+    """
+    entries = defournement.service.Defournement().list('deploydb1owner', cursor='toto')
+    assert entries['results'] == []
@@ -0,0 +1,85 @@
+#-*- coding:utf-8 -*-
+"""
+Test the manifest compiler against the client models serialization.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+import defournement.components
+import defournement.manifests
+import defournement.utils
+
+def _health(command, kind, **extras):
+    """
+    A healthcheck of `command` type.
+    """
+    health = {'command': command, 'type': kind}
+    health.update(extras)
+    return health
+
+@pytest.fixture()
+def probed(definition_factory):
+    """
+    A definition with probes, as expected by the deployment component.
+    """
+    definition = definition_factory(ports=[80, 8000], health=[
+        _health('HTTP', 'readiness', path='/', port=8000),
+        _health('COMMAND', 'liveness', value=['/usr/bin/ls'])], domain='mybranch.myrepo.owner.projects.baguette.io')['definition']
+    definition.update({'failure_threshold': 5, 'initial_delay_seconds': 3, 'interval_seconds': 10,
+                       'success_threshold': 1, 'timeout_seconds': 10})
+    return definition
+
+def _assert_same(component, compiled):
+    """
+    The compiled manifest must serialize exactly as the client models.
+    """
+    expected = defournement.utils.api_client().sanitize_for_serialization(component.specifications())
+    assert json.dumps(compiled, sort_keys=True) == json.dumps(expected, sort_keys=True)
+
+def test_service(definition1):
+    """
+    Render the service manifest.
+    """
+    definition = definition1['definition']
+    _assert_same(defournement.components.Service(definition), defournement.manifests.service(definition))
+
+def test_ingress(probed):
+    """
+    Render the ingress manifest.
+    """
+    _assert_same(defournement.components.Ingress(probed), defournement.manifests.ingress(probed))
+
+def test_deployment(probed):
+    """
+    Render the deployment manifest, with an HTTP and a COMMAND probe.
+    """
+    _assert_same(defournement.components.Deployment(probed), defournement.manifests.deployment(probed))
+
+def test_deployment_tcp(probed):
+    """
+    Render the deployment manifest, with a TCP probe.
+    """
+    probed['healthchecks'] = [_health('TCP', 'liveness', port=8000)]
+    _assert_same(defournement.components.Deployment(probed), defournement.manifests.deployment(probed))
+
+def test_deployment_no_probe(probed):
+    """
+    Render the deployment manifest, without any probe nor port.
+    """
+    probed['healthchecks'] = []
+    probed['ports'] = []
+    _assert_same(defournement.components.Deployment(probed), defournement.manifests.deployment(probed))
+
+def test_compiler_disabled(definition1):
+    """
+    With `manifest_compiler` off, the manifest is serialized from the client models.
+    """
+    definition = definition1['definition']
+    component = defournement.components.Service(definition)
+    compiled = component.manifest()
+    farine.settings.defournement['manifest_compiler'] = 'false'
+    try:
+        with mock.patch.object(component, 'compiler') as compiler:
+            assert component.manifest() == compiled
+            assert not compiler.called
+    finally:
+        farine.settings.defournement['manifest_compiler'] = 'true'
@@ -0,0 +1,97 @@
+#-*- coding:utf-8 -*-
+"""
+Test the metrics.
+"""
+import os
+import pytest
+import defournement.metrics
+from defournement.metrics import Counter, Gauge, Histogram
+
+@pytest.fixture(autouse=True)
+def registry():
+    """
+    Unregister the metrics, and the children, created by a test.
+    """
+    registered = dict((metric, set(metric._children)) for metric in defournement.metrics._REGISTRY)
+    yield
+    defournement.metrics._REGISTRY[:] = [metric for metric in defournement.metrics._REGISTRY if metric in registered]
+    for metric, children in registered.items():
+        for values in set(metric._children) - children:
+            del metric._children[values]
+
+def test_counter_render():
+    """
+    Render a labelled counter.
+    """
+    counter = Counter('test_requests_total', 'Requests.', ('method',))
+    counter.labels('GET').inc()
+    counter.labels('GET').inc(2)
+    counter.labels('a"b').inc()
+    assert counter.render().split('\n') == [
+        '# HELP test_requests_total Requests.',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{method="GET"} 3.0',
+        'test_requests_total{method="a\\"b"} 1.0',
+    ]
+
+def test_gauge_function():
+    """
+    A gauge read from a function, skipped if it fails.
+    """
+    gauge = Gauge('test_depth', 'Depth.')
+    gauge.labels().set_function(lambda: 4)
+    assert gauge.render().split('\n')[-1] == 'test_depth 4.0'
+    gauge.labels().set_function(lambda: 1 / 0)
+    assert len(gauge.render().split('\n')) == 2
+
+def test_histogram_buckets():
+    """
+    The buckets are cumulative, the sum and count follow.
+    """
+    histogram = Histogram('test_seconds', 'Durations.', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.labels().observe(value)
+    assert histogram.render().split('\n')[2:] == [
+        'test_seconds_bucket{le="0.1"} 2.0',
+        'test_seconds_bucket{le="1.0"} 3.0',
+        'test_seconds_bucket{le="+Inf"} 4.0',
+        'test_seconds_sum 5.65',
+        'test_seconds_count 4.0',
+    ]
+
+def test_component_failures():
+    """
+    The component calls are timed, their failures counted.
+    """
+    class Component(object):
+        kind = 'test'
+        @defournement.metrics.component('create')
+        def create(self, result):
+            if result is None:
+                raise ValueError()
+            return result
+        @defournement.metrics.component('exists', checked=False)
+        def exists(self):
+            return False
+    component = Component()
+    assert component.create(True)
+    assert not component.create(False)
+    with pytest.raises(ValueError):
+        component.create(None)
+    assert not component.exists()
+    failures = defournement.metrics.COMPONENT_FAILURES
+    assert failures.labels('test', 'create').value == 2
+    assert failures.labels('test', 'exists').value == 0
+    assert sum(defournement.metrics.COMPONENT_SECONDS.labels('test', 'create').counts) == 3
+
+def test_textfile(tmpdir):
+    """
+    Write all the metrics in a textfile.
+    """
+    path = str(tmpdir.join('defournement.prom'))
+    defournement.metrics.write_textfile(path)
+    with open(path) as textfile:
+        content = textfile.read()
+    assert '# TYPE defournement_watch_lag_seconds histogram' in content
+    assert 'test_' not in content
+    assert os.listdir(str(tmpdir)) == ['defournement.prom']
@@ -0,0 +1,39 @@
+#-*- coding:utf-8 -*-
+"""
+Test the schema migrations.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+
+def test_migrate_idempotent():
+    """
+    Migrate an up to date database: must not apply anything.
+    """
+    assert defournement.migrations.migrate() == []
+
+def test_migrate_indexes():
+    """
+    The list() and detail() indexes exist and are valid.
+    """
+    from defournement.models import Deployment
+    cursor = Deployment._meta.database.execute_sql(
+        'SELECT pg_class.relname FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+        'WHERE pg_index.indisvalid AND pg_class.relname IN (%s, %s)',
+        ('deployment_owner_date_created_uid', 'status_uid_id_date_created_id'))
+    assert len(cursor.fetchall()) == 2
+
+def test_migrate_pending():
+    """
+    Nothing is pending once migrated: the watch does not wait.
+    """
+    assert defournement.migrations.pending() == []
+
+def test_watch_pending(defour):
+    """
+    Watch while the schema is not migrated: must wait, without writing anything.
+    """
+    defour.stopping.set()
+    with mock.patch('defournement.migrations.pending', mock.Mock(return_value=[1])), \
+         mock.patch.object(defour, '_warm_status_cache') as warm:
+        defour.watch()
+    assert not warm.called
@@ -0,0 +1,96 @@
+#-*- coding:utf-8 -*-
+"""
+Test the status notifications and the wait RPC.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+import threading
+import time
+from .fixtures import *
+import defournement.consumer
+import defournement.notify
+from defournement.models import Deployment, Status
+
+@pytest.fixture()
+def deploying():
+    """
+    A deployment still deploying.
+    """
+    uid = uuid.uuid4().hex
+    Deployment.create(uid=uid, owner='owner', namespace='default', name='name', status='deploying')
+    Status.create(uid=uid, status='deploying')
+    return uid
+
+def test_hub():
+    """
+    A waiter is only woken up by the statuses it waits for.
+    """
+    hub = defournement.notify.Hub()
+    waiter = hub.subscribe('uid', ['running'])
+    hub.dispatch([{'uid': 'uid', 'status': 'unhealthy'}, {'uid': 'other', 'status': 'running'}])
+    assert waiter.wait(0) is None
+    hub.dispatch([{'uid': 'uid', 'status': 'running'}])
+    assert waiter.wait(0) == {'uid': 'uid', 'status': 'running'}
+    hub.unsubscribe(waiter)
+    assert len(hub) == 0
+
+def test_wait_reached(deploydb2):
+    """
+    Wait for a status already reached: must return at once.
+    """
+    service = defournement.service.Defournement()
+    assert service.wait('deploydb2owner', deploydb2, timeout=10) == {'uid': deploydb2, 'status': 'running', 'reached': True}
+    assert service.wait('other', deploydb2)['status'] is None
+
+def test_wait_transition(defour, deploying):
+    """
+    Wait for a deployment to run: must be woken up by the watch write.
+    """
+    row = {'uid': deploying, 'status': 'running', 'date_created': datetime.datetime.now()}
+    timer = threading.Timer(0.5, defour._flush_statuses, ([row],))
+    timer.start()
+    start = time.time()
+    assert defour.wait('owner', deploying, ['running'], timeout=30) == {'uid': deploying, 'status': 'running', 'reached': True}
+    assert time.time() - start < 10
+    assert defour.wait('owner', deploying, ['terminated'], timeout=0.1) == {'uid': deploying, 'status': 'running', 'reached': False}
+
+def test_publish_exchange(defour, deploying):
+    """
+    The transitions are published on the exchange, by batches.
+    """
+    farine.settings.defournement['status_exchange'] = 'deployment_status'
+    defournement.notify._STATE['pid'] = None
+    try:
+        with mock.patch('defournement.notify.Publisher') as publisher, \
+             mock.patch('defournement.components.Deployment.exists', mock.Mock(return_value=False)):
+            defour.delete('owner', deploying)
+            defournement.notify._STATE['buffer'].flush()
+        message = publisher.return_value.send.call_args[0][0]
+        assert [(t['uid'], t['owner'], t['status']) for t in message['transitions']] == [(deploying, 'owner', 'terminating'), (deploying, 'owner', 'terminated')]
+    finally:
+        defournement.notify._STATE['buffer'].close()
+        defournement.notify._STATE['pid'] = None
+
+def test_wait_server():
+    """
+    A wait is served and replied to on a thread of its own, then acked on the consumer thread.
+    """
+    served = []
+    class Service(object):
+        def wait(self, uid):
+            served.append(threading.current_thread())
+            return uid
+    message = mock.Mock(properties={'reply_to': 'reply', 'correlation_id': 'id'})
+    with mock.patch('defournement.consumer.sql.setup', mock.Mock(return_value=None)):
+        with mock.patch('farine.amqp.publisher.Publisher.send') as send:
+            server = defournement.consumer.WaitServer(service='defournement', callback_name='wait', callback=Service().wait)
+            server.main_callback({'args': ['uid'], 'kwargs': {}}, message)
+            for _ in range(100):
+                if server.settled:
+                    break
+                time.sleep(0.05)
+            assert send.call_count == 2
+            assert not message.ack.called
+            server.on_iteration()
+            assert message.ack.called
+    assert served and served[0] is not threading.current_thread()
+    assert send.call_args_list[0][0][0] == {'body': 'uid', '__end__': False}
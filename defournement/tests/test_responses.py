@@ -0,0 +1,55 @@
+#-*- coding:utf-8 -*-
+"""
+Test the list() and detail() responses cache.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+import defournement.notify
+import defournement.service
+
+@pytest.fixture()
+def cached(request):
+    """
+    Enable the responses cache.
+    """
+    def cleanup():
+        defournement.notify.remove_listener(defournement.service._RESPONSES['listener'])
+        defournement.service._RESPONSES.update(pid=None, listener=None)
+    request.addfinalizer(cleanup)
+    farine.settings.defournement['response_cache_size'] = '100'
+    defournement.service._RESPONSES['pid'] = None
+    return defournement.service._responses()
+
+def test_list_cached(cached, defour, deploydb1, deploydb1bis):
+    """
+    The second call is served from the cache, until the owner writes.
+    """
+    first = defour.list('deploydb1owner')
+    with mock.patch('defournement.service.Model.select') as select:
+        assert defour.list('deploydb1owner') == first
+        assert not select.called
+    row = {'uid': deploydb1, 'status': 'unhealthy', 'date_created': datetime.datetime.now()}
+    defour._flush_statuses([row])
+    assert [d['status'] for d in defour.list('deploydb1owner')['results'] if d['uid'] == deploydb1] == ['unhealthy']
+    assert cached.stats()['hits'] == 1
+
+def test_detail_cached(cached, defour, deploydb1):
+    """
+    The detail of a deployment is invalidated by its statuses only.
+    """
+    first = defour.detail('deploydb1owner', deploydb1)
+    assert defour.detail('deploydb1owner', deploydb1, None) is first
+    defour._flush_statuses([{'uid': deploydb1, 'status': 'unhealthy', 'date_created': datetime.datetime.now()}])
+    assert defour.detail('deploydb1owner', deploydb1)['count'] == first['count'] + 1
+
+def test_maintain_invalidates(cached, defour, deploydb1):
+    """
+    A maintenance pass removing history drops the cached responses.
+    """
+    defour.detail('deploydb1owner', deploydb1)
+    def run(stopping):
+        stopping.set()
+        return {'deleted': 1, 'created': [], 'dropped': [], 'steps': 0}
+    with mock.patch('defournement.retention.run', mock.Mock(side_effect=run)):
+        defour.maintain()
+    assert len(cached) == 0
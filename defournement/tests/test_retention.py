@@ -0,0 +1,122 @@
+#-*- coding:utf-8 -*-
+"""
+Test the status history retention.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+import defournement.retention
+from defournement.models import Deployment, RolloutStep, Status
+
+def _history(uid):
+    return [row.status for row in Status.select().where(Status.uid == uid).order_by(Status.date_created, Status.id)]
+
+@pytest.fixture()
+def old_deployment():
+    """
+    A 60 days old deployment, with redundant statuses.
+    """
+    start = datetime.datetime.now() - datetime.timedelta(days=60)
+    uid = uuid.uuid4().hex
+    Deployment.create(uid=uid, owner='owner', namespace='default', name='name', date_created=start)
+    for i, status in enumerate(['deploying', 'running', 'running', 'unhealthy', 'unhealthy', 'running', 'running']):
+        Status.record(uid, status, date_created=start + datetime.timedelta(days=i))
+    Status.record(uid, 'running')
+    return uid
+
+def test_rollup(old_deployment, db_factory):
+    """
+    Roll the old history up: the transitions and the recent statuses are kept.
+    """
+    recent = db_factory('owner', 'repo', 'branch')
+    before = datetime.datetime.now() - datetime.timedelta(days=30)
+    assert defournement.retention.rollup(before, batch_size=1) == 3
+    assert _history(old_deployment) == ['deploying', 'running', 'unhealthy', 'running', 'running']
+    assert _history(recent) == ['deploying', 'running']
+    assert Deployment.get(Deployment.uid == old_deployment).status == 'running'
+    assert defournement.retention.rollup(before) == 0
+
+def test_rollup_since(old_deployment):
+    """
+    Roll up the statuses dated since the previous pass only.
+    """
+    before = datetime.datetime.now() - datetime.timedelta(days=30)
+    since = datetime.datetime.now() - datetime.timedelta(days=57)
+    assert defournement.retention.rollup(before, since=since) == 2
+    assert _history(old_deployment) == ['deploying', 'running', 'running', 'unhealthy', 'running', 'running']
+
+def test_run_checkpoint(old_deployment):
+    """
+    A maintenance pass checkpoints its limit: the next one only reads the statuses dated since.
+    """
+    from defournement.models import WatchState
+    assert defournement.retention.run()['deleted'] == 3
+    assert WatchState.load(defournement.retention.CHECKPOINT)
+    with mock.patch('defournement.retention.rollup', mock.Mock(return_value=0)) as rollup:
+        defournement.retention.run()
+    assert rollup.call_args[0][4] is not None
+
+def test_purge_steps(old_deployment):
+    """
+    Purge the old rollouts timeline, by batches: the recent steps are kept.
+    """
+    old = datetime.datetime.now() - datetime.timedelta(days=60)
+    for step in ('namespace', 'service', 'deployment'):
+        RolloutStep.create(uid=old_deployment, step=step, success=True, duration=0.1, api_calls=1, date_created=old)
+    RolloutStep.create(uid=old_deployment, step='ingress', success=True, duration=0.1, api_calls=1)
+    before = datetime.datetime.now() - datetime.timedelta(days=30)
+    assert defournement.retention.purge_steps(before, batch_size=2) == 3
+    assert [step.step for step in RolloutStep.select().where(RolloutStep.uid == old_deployment)] == ['ingress']
+
+def test_run_default(old_deployment):
+    """
+    A maintenance pass with the default settings: no partitioning.
+    """
+    result = defournement.retention.run()
+    assert result == {'deleted': 3, 'created': [], 'dropped': [], 'steps': 0}
+    assert not defournement.retention.is_partitioned()
+
+def test_partition(old_deployment):
+    """
+    Convert the status table: the history is kept, new statuses go to the monthly partitions.
+    """
+    now = datetime.datetime.now()
+    assert defournement.retention.partition()
+    assert defournement.retention.is_partitioned()
+    assert not defournement.retention.partition()
+    created = defournement.retention.ensure_partitions(ahead=2)
+    assert created == ['status_p{:%Y%m}'.format(defournement.retention._month(now, months)) for months in (1, 2)]
+    assert defournement.retention.ensure_partitions(ahead=2) == []
+    Status.record(old_deployment, 'terminating', date_created=defournement.retention._month(now, 1))
+    assert len(_history(old_deployment)) == 9
+    assert defournement.retention.rollup(now - datetime.timedelta(days=30)) == 3
+    assert defournement.retention.purge_partitions(defournement.retention._month(now, 3)) == created
+    assert _history(old_deployment)[-1] == 'running'
+
+def test_partition_default(old_deployment):
+    """
+    A status dated past the last partition goes to the default one, then moves to its month once created.
+    """
+    now = datetime.datetime.now()
+    assert defournement.retention.partition()
+    assert defournement.retention.ensure_partitions(ahead=0) == []
+    Status.record(old_deployment, 'terminating', date_created=defournement.retention._month(now, 2))
+    name = 'status_p{:%Y%m}'.format(defournement.retention._month(now, 2))
+    assert defournement.retention.ensure_partitions(ahead=2)[-1] == name
+    db = Deployment._meta.database
+    assert db.execute_sql('SELECT count(*) FROM "status_default"').fetchone()[0] == 0
+    assert db.execute_sql('SELECT "status" FROM "{}"'.format(name)).fetchall() == [('terminating',)]
+
+def test_maintain_loop(defour):
+    """
+    The maintain task runs pass after pass, a failed pass included, until stopped.
+    """
+    passes = []
+    def run(stopping):
+        passes.append(stopping)
+        if len(passes) == 1:
+            raise ValueError()
+        stopping.set()
+    farine.settings.defournement['status_retention_interval'] = '0'
+    with mock.patch('defournement.retention.run', mock.Mock(side_effect=run)):
+        defour.maintain()
+    assert len(passes) == 2
@@ -0,0 +1,52 @@
+#-*- coding:utf-8 -*-
+"""
+Test the rollouts statistics.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+from defournement.models import Deployment, RolloutStep, Status
+
+@pytest.fixture()
+def rollouts():
+    """
+    Ten deployments running after 1 to 10 seconds, and one still deploying.
+    """
+    start = datetime.datetime.now() - datetime.timedelta(hours=1)
+    for i in xrange(11):
+        uid = uuid.uuid4().hex
+        Deployment.create(uid=uid, owner='owner{}'.format(i % 2), namespace='default', name='name', date_created=start)
+        Status.record(uid, 'deploying', date_created=start)
+        if i < 10:
+            Status.record(uid, 'running', date_created=start + datetime.timedelta(seconds=i + 1))
+            Status.record(uid, 'running', date_created=start + datetime.timedelta(seconds=100))
+        for step, duration in (('namespace', 0.1), ('deployment', i + 0.5)):
+            RolloutStep.create(uid=uid, step=step, duration=duration, api_calls=2, success=i != 10, date_created=start)
+    return start
+
+def test_stats(rollouts):
+    """
+    Compute the time to running percentiles, and the steps ones.
+    """
+    service = defournement.service.Defournement()
+    stats = service.stats()
+    assert stats['count'] == 11
+    assert stats['running']['count'] == 10
+    assert stats['running']['p50'] == pytest.approx(5.5)
+    assert stats['running']['p90'] == pytest.approx(9.1)
+    assert stats['steps']['deployment']['count'] == 11
+    assert stats['steps']['deployment']['failures'] == 1
+    assert stats['steps']['deployment']['p50'] == pytest.approx(5.5)
+    assert stats['steps']['namespace']['api_calls'] == pytest.approx(2)
+
+def test_stats_filters(rollouts):
+    """
+    Restrict the statistics to an owner, and to the recent deployments.
+    """
+    service = defournement.service.Defournement()
+    assert service.stats(owner='owner1')['count'] == 5
+    since = (rollouts + datetime.timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%S')
+    stats = service.stats(since=since)
+    assert stats['count'] == 0
+    assert stats['running']['p50'] is None
+    assert stats['steps'] == {}
+    assert service.stats(since='yesterday') == {}
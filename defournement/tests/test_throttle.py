@@ -0,0 +1,71 @@
+#-*- coding:utf-8 -*-
+"""
+Test the API server protections.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+from defournement.throttle import CircuitBreaker, RateLimiter, TokenBucket
+
+def test_token_bucket():
+    """
+    Past the burst, the requests wait for the rate.
+    """
+    bucket = TokenBucket(rate=100, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() > 0
+
+def test_rate_limiter_lanes():
+    """
+    The bulk creates do not consume the deletes and reads tokens.
+    """
+    limiter = RateLimiter(high_rate=100, bulk_rate=100, burst=1)
+    limiter.acquire('POST')
+    assert limiter.acquire('DELETE') == 0
+    assert limiter.acquire('GET') > 0
+    assert RateLimiter.lane('PATCH') == 'bulk'
+
+def test_circuit_breaker():
+    """
+    Open after the threshold, half-open after the cooldown, closed by a success.
+    """
+    circuit = CircuitBreaker(threshold=2, cooldown=0.05)
+    circuit.failure()
+    assert circuit.allow()
+    circuit.failure()
+    assert circuit.state == 'open'
+    assert not circuit.allow()
+    assert not circuit.wait_closed(timeout=0.01)
+    assert circuit.wait_closed(timeout=1)
+    assert circuit.allow()
+    assert not circuit.allow()
+    circuit.success()
+    assert circuit.state == 'closed'
+
+def test_retry_after(defour, request_factory):
+    """
+    A 429 is retried after its Retry-After delay.
+    """
+    throttled = ApiException(429)
+    throttled.headers = {'Retry-After': '0'}
+    request = request_factory(200, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(side_effect=[throttled, request])) as rest:
+        assert defournement.components.Service({'namespace': 'toto', 'repo': 'repo'}).exists()
+        assert rest.call_count == 2
+
+def test_retry_post(defour, definition1):
+    """
+    A POST answered by a 5xx may have been applied: it is not retried.
+    """
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(side_effect=ApiException(503))) as rest:
+        assert not defournement.components.Service(definition1['definition']).create()
+        assert rest.call_count == 1
+
+def test_circuit_open_deploy(defour, definition1):
+    """
+    An open circuit is not a failure of the component: it is raised to the rollout.
+    """
+    from defournement.throttle import CircuitOpen
+    with mock.patch('defournement.throttle.CircuitBreaker.allow', mock.Mock(return_value=False)):
+        with pytest.raises(CircuitOpen):
+            defournement.components.Service(definition1['definition']).deploy()
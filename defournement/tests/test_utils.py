@@ -0,0 +1,25 @@
+#-*- coding:utf-8 -*-
+"""
+Test the utils.
+"""
+#pylint:disable=wildcard-import,unused-wildcard-import,redefined-outer-name
+from .fixtures import *
+import defournement.utils
+
+def test_api_client_shared(defour):
+    """
+    The API client is built once per process and shared by the components.
+    """
+    api = defournement.utils.api_client()
+    assert api is defournement.utils.api_client()
+    assert defournement.components.Service({}).api_client is api
+    assert defournement.components.Namespace('toto').api_client is api
+
+def test_api_client_timeout(defour, request_factory):
+    """
+    The requests get the default timeout, the streams do not.
+    """
+    request = request_factory(200, {})
+    with mock.patch('kubernetes.client.rest.RESTClientObject.request', mock.Mock(return_value=request)) as rest:
+        defournement.components.Namespace('toto').exists()
+        assert rest.call_args[1]['_request_timeout'] == (5.0, 30.0)
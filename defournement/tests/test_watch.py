@@ -1,6 +1,15 @@
 import json
 from .fixtures import *
 
+def stream_factory(defour, events):
+    """
+    Stream `events` once, then stop the watcher.
+    """
+    def stream(*args, **kwargs):
+        defour.stopping.set()
+        return events
+    return mock.Mock(side_effect=stream)
+
 def test_watch_ok(defour, caplog):
     """
     Watch deployments: must succeed anyway.
@@ -13,7 +22,7 @@ def test_watch_ok(defour, caplog):
     obj.metadata.name = 'toto'
     obj.metadata.labels = {'owner':'owner', 'branch': 'branch', 'repo': 'repo', 'uid':'uid'}
     events = [{'type':'MODIFIED', 'object':obj}]
-    with mock.patch('kubernetes.watch.Watch.stream', mock.Mock(return_value=events)) as stream:
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)) as stream:
         defour.watch()
         assert caplog.record_tuples == [('defournement.service', logging.INFO, 'MODIFIED deployment [toto-default] toto'),
                                          ('defournement.service', logging.ERROR, 'Unknown deployment uid')]
@@ -29,6 +38,204 @@ def test_watch_exclude(defour, caplog):
     obj.metadata.name = 'toto'
     obj.metadata.labels = {'owner':'owner', 'branch': 'branch', 'repo': 'repo', 'uid':'uid'}
     events = [{'type':'MODIFIED', 'object':obj}]
-    with mock.patch('kubernetes.watch.Watch.stream', mock.Mock(return_value=events)) as stream:
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)) as stream:
         defour.watch()
         assert caplog.record_tuples == []
+
+def test_watch_resume(defour):
+    """
+    Watch deployments after a restart: must resume from the last processed version.
+    """
+    from defournement.models import WatchState
+    obj = mock.Mock()
+    obj.metadata.namespace = 'kube-system'
+    obj.metadata.resource_version = '42'
+    events = [{'type':'MODIFIED', 'object':obj}]
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)) as stream:
+        defour.watch()
+        assert stream.call_args[1]['resource_version'] == 0
+    assert WatchState.load('deployment') == '42'
+    defour.stopping.clear()
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, [])) as stream:
+        defour.watch()
+        assert stream.call_args[1]['resource_version'] == '42'
+
+def test_watch_gone(defour, deploydb1):
+    """
+    Watch deployments from a version gone: must relist and reconcile the statuses.
+    """
+    from defournement.models import Deployment, WatchState
+    WatchState.store('deployment', '1')
+    item = mock.Mock()
+    item.metadata.namespace = 'toto-default'
+    item.metadata.labels = {'uid': deploydb1}
+    item.status.unavailable_replicas = 1
+    listing = mock.Mock(items=[item])
+    listing.metadata._continue = None
+    listing.metadata.resource_version = '100'
+    streams = [[{'type': 'ERROR', 'object': None, 'raw_object': {'code': 410}}], []]
+    def stream(*args, **kwargs):
+        events = streams.pop(0)
+        if not streams:
+            defour.stopping.set()
+        return events
+    with mock.patch('kubernetes.watch.Watch.stream', mock.Mock(side_effect=stream)) as watch_stream:
+        with mock.patch('kubernetes.client.ExtensionsV1beta1Api.list_deployment_for_all_namespaces', mock.Mock(return_value=listing)):
+            defour.watch()
+        assert watch_stream.call_args[1]['resource_version'] == '100'
+    assert Deployment.get(Deployment.uid == deploydb1).status == 'unhealthy'
+
+def test_watch_transitions(defour, deploydb1):
+    """
+    Watch the same state twice: must only write the transition.
+    """
+    from defournement.models import Status
+    obj = mock.Mock()
+    obj.kind = 'deployment'
+    obj.metadata.namespace = 'toto-default'
+    obj.metadata.name = 'toto'
+    obj.metadata.labels = {'uid': deploydb1}
+    obj.status.unavailable_replicas = 1
+    events = [{'type':'MODIFIED', 'object':obj}, {'type':'MODIFIED', 'object':obj}]
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)):
+        defour.watch()
+    statuses = [s.status for s in Status.select().where(Status.uid == deploydb1).order_by(Status.id)]
+    assert statuses == ['deploying', 'running', 'unhealthy']
+    assert defour.skipped_writes == 1
+    assert defour.last_status.stats()['hits'] == 2
+
+def test_watch_batch_unknown(defour, deploydb1, caplog):
+    """
+    Watch a known and an unknown deployment: the unknown one must not fail the batch.
+    """
+    import logging
+    from defournement.models import Deployment
+    known, unknown = mock.Mock(), mock.Mock()
+    for obj, uid in ((known, deploydb1), (unknown, 'uid')):
+        obj.kind = 'deployment'
+        obj.metadata.namespace = 'toto-default'
+        obj.metadata.name = 'toto'
+        obj.metadata.labels = {'uid': uid}
+        obj.status.unavailable_replicas = 1
+    events = [{'type':'MODIFIED', 'object':unknown}, {'type':'MODIFIED', 'object':known}]
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)):
+        defour.watch()
+    assert Deployment.get(Deployment.uid == deploydb1).status == 'unhealthy'
+    assert ('defournement.service', logging.ERROR, 'Unknown deployment uid') in caplog.record_tuples
+
+def test_watch_selectors(defour):
+    """
+    Watch deployments: the uid label and the excluded namespaces are filtered server-side.
+    """
+    obj = mock.Mock()
+    obj.kind = 'deployment'
+    obj.metadata.namespace = 'toto-default'
+    obj.metadata.name = 'toto'
+    obj.metadata.labels = None
+    events = [{'type':'MODIFIED', 'object':obj}]
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)) as stream, \
+         mock.patch.object(defour, '_write_status') as write:
+        defour.watch()
+        assert stream.call_args[0][0].__name__ == 'list_deployment_for_all_namespaces'
+        assert stream.call_args[1]['label_selector'] == 'uid'
+        assert stream.call_args[1]['field_selector'] == 'metadata.namespace!=default,metadata.namespace!=kube-public,metadata.namespace!=kube-system'
+    assert not write.called
+
+def test_watch_namespaces(defour, deploydb1):
+    """
+    Watch the listed namespaces only, one stream and one version each.
+    """
+    from defournement.models import WatchState
+    farine.settings.defournement['watch_namespaces'] = 'toto-default'
+    obj = mock.Mock()
+    obj.kind = 'deployment'
+    obj.metadata.namespace = 'toto-default'
+    obj.metadata.name = 'toto'
+    obj.metadata.resource_version = '42'
+    obj.metadata.labels = {'uid': deploydb1}
+    obj.status.unavailable_replicas = 1
+    events = [{'type':'MODIFIED', 'object':obj}]
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)) as stream:
+        defour.watch()
+        assert stream.call_args[0][0].__name__ == 'list_namespaced_deployment'
+        assert stream.call_args[0][1] == 'toto-default'
+        assert 'field_selector' not in stream.call_args[1]
+    assert WatchState.load('deployment/toto-default') == '42'
+    assert WatchState.load('deployment') is None
+
+def test_watch_flush_failure(defour, deploydb1):
+    """
+    Watch while the statuses cannot be written: the version must not be checkpointed.
+    """
+    from defournement.models import Status, WatchState
+    obj = mock.Mock()
+    obj.kind = 'deployment'
+    obj.metadata.namespace = 'toto-default'
+    obj.metadata.name = 'toto'
+    obj.metadata.resource_version = '42'
+    obj.metadata.labels = {'uid': deploydb1}
+    obj.status.unavailable_replicas = 1
+    events = [{'type':'MODIFIED', 'object':obj}]
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)), \
+         mock.patch.object(Status, 'record_many', mock.Mock(side_effect=ValueError())):
+        defour.watch()
+    assert WatchState.load('deployment') is None
+    assert defour.last_status.get(deploydb1) is None
+
+def test_watch_gone_terminating(defour, deploydb1):
+    """
+    Relist a terminating deployment still listed: it must not be marked terminated.
+    """
+    from defournement.models import Deployment, Status, WatchState
+    Status.record(deploydb1, 'terminating')
+    WatchState.store('deployment', '1')
+    item = mock.Mock()
+    item.metadata.namespace = 'toto-default'
+    item.metadata.labels = {'uid': deploydb1}
+    item.status.unavailable_replicas = 1
+    listing = mock.Mock(items=[item])
+    listing.metadata._continue = None
+    listing.metadata.resource_version = '100'
+    streams = [[{'type': 'ERROR', 'object': None, 'raw_object': {'code': 410}}], []]
+    def stream(*args, **kwargs):
+        events = streams.pop(0)
+        if not streams:
+            defour.stopping.set()
+        return events
+    with mock.patch('kubernetes.watch.Watch.stream', mock.Mock(side_effect=stream)):
+        with mock.patch('kubernetes.client.ExtensionsV1beta1Api.list_deployment_for_all_namespaces', mock.Mock(return_value=listing)):
+            defour.watch()
+    assert Deployment.get(Deployment.uid == deploydb1).status == 'unhealthy'
+
+def test_watch_checkpoint_processed(defour, deploydb1):
+    """
+    Watch an event failing to process: its version must not be checkpointed.
+    """
+    from defournement.models import WatchState
+    farine.settings.defournement['watch_checkpoint'] = '1'
+    obj = mock.Mock()
+    obj.kind = 'deployment'
+    obj.metadata.namespace = 'toto-default'
+    obj.metadata.name = 'toto'
+    obj.metadata.resource_version = '42'
+    obj.metadata.labels = {'uid': deploydb1}
+    obj.status.unavailable_replicas = 1
+    events = [{'type':'MODIFIED', 'object':obj}]
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, events)), \
+         mock.patch.object(defour, '_write_status', mock.Mock(side_effect=ValueError())):
+        defour.watch()
+    assert WatchState.load('deployment') is None
+
+def test_watch_forget_statuses(defour, deploydb1):
+    """
+    Write a status outside of the watch: the last status cache must not serve the stale one.
+    """
+    import datetime
+    import defournement.service
+    with mock.patch('kubernetes.watch.Watch.stream', stream_factory(defour, [])):
+        defour.watch()
+    defour.last_status.set(deploydb1, 'running')
+    defournement.service._notify([{'uid': deploydb1, 'owner': 'deploydb1owner', 'status': 'running', 'date_created': datetime.datetime.now()}])
+    assert defour.last_status.get(deploydb1) == 'running'
+    defournement.service._notify([{'uid': deploydb1, 'owner': 'deploydb1owner', 'status': 'terminating', 'date_created': datetime.datetime.now()}])
+    assert defour.last_status.get(deploydb1) is None
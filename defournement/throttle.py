@@ -0,0 +1,215 @@
+#-*- coding:utf-8 -*-
+"""
+Client-side protection of the API server:
+- TokenBucket
+- RateLimiter
+- CircuitBreaker
+- limiter()
+- breaker()
+"""
+import threading
+import time
+import farine.settings
+import defournement.clusters
+
+_LOCK = threading.Lock()
+_SINGLETONS = {}
+
+class CircuitOpen(Exception):
+    """
+    The API server is considered unhealthy: the request is not sent.
+    """
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket: `rate` tokens per second, up to `burst`.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: The tokens added per second.
+        :type rate: float
+        :param burst: The bucket capacity.
+        :type burst: int
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for it if needed.
+        :returns: The time waited, in seconds.
+        :rtype: float
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            #Reserve the token now: the waiters are served in order.
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class RateLimiter(object):
+    """
+    One token bucket per priority lane, so that the deletes and the reads
+    are never queued behind the bulk creates and updates.
+    """
+    BULK_METHODS = ('POST', 'PUT', 'PATCH')
+
+    def __init__(self, high_rate, bulk_rate, burst):
+        """
+        :param high_rate: The requests per second of the deletes and reads.
+        :type high_rate: float
+        :param bulk_rate: The requests per second of the creates and updates.
+        :type bulk_rate: float
+        :param burst: The requests allowed at once, per lane.
+        :type burst: int
+        """
+        self.lanes = {'high': TokenBucket(high_rate, burst), 'bulk': TokenBucket(bulk_rate, burst)}
+
+    @classmethod
+    def lane(cls, method):
+        """
+        The priority lane of an HTTP method.
+        :rtype: str
+        """
+        return 'bulk' if (method or '').upper() in cls.BULK_METHODS else 'high'
+
+    def acquire(self, method):
+        """
+        Wait for the lane of `method`.
+        :returns: The time waited, in seconds.
+        :rtype: float
+        """
+        return self.lanes[self.lane(method)].acquire()
+
+class CircuitBreaker(object):
+    """
+    Open after `threshold` consecutive failures, for `cooldown` seconds.
+    Then half-open: one trial request closes it again, or reopens it.
+    """
+
+    def __init__(self, threshold, cooldown):
+        """
+        :param threshold: The consecutive failures opening the circuit.
+        :type threshold: int
+        :param cooldown: The time the circuit stays open, in seconds.
+        :type cooldown: float
+        """
+        self.threshold = threshold
+        self.cooldown = float(cooldown)
+        self.failures = 0
+        self.opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._closed.set()
+
+    @property
+    def state(self):
+        """
+        closed, open or half-open.
+        """
+        if self.opened is None:
+            return 'closed'
+        if time.time() - self.opened < self.cooldown:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """
+        Check if a request may be sent.
+        :rtype: bool
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        """
+        Record a successful request: close the circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self._trial = False
+            self._closed.set()
+
+    def failure(self):
+        """
+        Record a failed request, opening the circuit past the threshold.
+        """
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.threshold:
+                self.opened = time.time()
+                self._closed.clear()
+
+    def wait_closed(self, timeout=None):
+        """
+        Block while the circuit is open, e.g. to pause a consumer.
+        The wait ends when the cooldown allows a trial request.
+        :param timeout: The maximum time to wait, in seconds.
+        :type timeout: float
+        :returns: True if the circuit is not open anymore.
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.state == 'open':
+            remaining = self.cooldown - (time.time() - (self.opened or 0))
+            if deadline is not None:
+                remaining = min(remaining, deadline - time.time())
+                if remaining <= 0:
+                    return False
+            self._closed.wait(max(remaining, 0.01))
+        return True
+
+def limiter(cluster=None):
+    """
+    The process-wide rate limiter of a cluster.
+    Settings:
+     - api_rate_high : the deletes and reads per second. Default to 50.
+     - api_rate_bulk : the creates and updates per second. Default to 50.
+     - api_burst : the requests allowed at once, per lane. Default to 100.
+    :param cluster: The cluster name. Default to the first one.
+    :type cluster: str
+    :rtype: RateLimiter
+    """
+    key = ('limiter', defournement.clusters.resolve(cluster))
+    with _LOCK:
+        if key not in _SINGLETONS:
+            settings = farine.settings.defournement
+            _SINGLETONS[key] = RateLimiter(float(settings.get('api_rate_high', 50)),
+                                           float(settings.get('api_rate_bulk', 50)),
+                                           int(settings.get('api_burst', 100)))
+        return _SINGLETONS[key]
+
+def breaker(cluster=None):
+    """
+    The process-wide circuit breaker of a cluster API server.
+    Settings:
+     - breaker_threshold : the consecutive failures opening the circuit. Default to 5.
+     - breaker_cooldown : the time the circuit stays open, in seconds. Default to 30.
+    :param cluster: The cluster name. Default to the first one.
+    :type cluster: str
+    :rtype: CircuitBreaker
+    """
+    key = ('breaker', defournement.clusters.resolve(cluster))
+    with _LOCK:
+        if key not in _SINGLETONS:
+            settings = farine.settings.defournement
+            _SINGLETONS[key] = CircuitBreaker(int(settings.get('breaker_threshold', 5)),
+                                              float(settings.get('breaker_cooldown', 30)))
+        return _SINGLETONS[key]
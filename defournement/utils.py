@@ -2,18 +2,155 @@
 """
 Utils:
 - k8s_config()
+- api_client()
+- api_calls()
+- exclude_selector()
 """
+import os
+import random
+import socket
+import threading
+import time
 import farine.settings
 from kubernetes import client
+from kubernetes.client.rest import ApiException
+from urllib3.connection import HTTPConnection
+from urllib3.exceptions import HTTPError
+import defournement.clusters
+import defournement.metrics
+from defournement.engine import api_slot
+from defournement.throttle import CircuitOpen, breaker, limiter
+
+_LOCK = threading.Lock()
+_CLIENT = {'pid': None, 'clients': {}}
+_CALLS = threading.local()
+
+def api_calls():
+    """
+    The number of API server requests sent by the current thread, retries included.
+    :rtype: int
+    """
+    return getattr(_CALLS, 'count', 0)
+
+def _retry_delay(exc, attempt):
+    """
+    The delay before retrying a request: its Retry-After header,
+    or a jittered exponential backoff.
+    :rtype: float
+    """
+    headers = getattr(exc, 'headers', None) or {}
+    try:
+        return min(30.0, float(headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return min(30.0, 0.1 * 2 ** attempt) * random.uniform(0.5, 1)
+
+#The requests sent again on a 5xx or a connection error: a POST may have been applied.
+IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE')
+
+class ApiClient(client.ApiClient):
+    """
+    Kubernetes API client applying to every request:
+    - a default timeout,
+    - the rate limiter lane of its method, and the limit of requests in flight,
+    - retries of the 429 responses, and of the 5xx of the idempotent requests, honouring Retry-After,
+    - the circuit breaker.
+    The limiter and the breaker are those of its cluster.
+    """
+    cluster = None
+    request_timeout = None
+    max_retries = 3
+
+    def call_api(self, *args, **kwargs):#pylint:disable=arguments-differ
+        #Streams (watches) are long-lived: no read timeout, no slot.
+        if not kwargs.get('_preload_content', True):
+            return super(ApiClient, self).call_api(*args, **kwargs)
+        if kwargs.get('_request_timeout') is None:
+            kwargs['_request_timeout'] = self.request_timeout
+        method = args[1] if len(args) > 1 else kwargs.get('method')
+        with defournement.metrics.API_SECONDS.labels(self.cluster, method).time():
+            return self._call_api(method, *args, **kwargs)
+
+    def _call_api(self, method, *args, **kwargs):
+        """
+        Send a request, retrying it.
+        """
+        circuit = breaker(self.cluster)
+        attempt = 0
+        while True:
+            if not circuit.allow():
+                raise CircuitOpen('The API server of {} is unhealthy'.format(defournement.clusters.resolve(self.cluster)))
+            limiter(self.cluster).acquire(method)
+            _CALLS.count = api_calls() + 1
+            try:
+                with api_slot():
+                    result = super(ApiClient, self).call_api(*args, **kwargs)
+            except (ApiException, HTTPError) as exc:
+                status = getattr(exc, 'status', None)
+                if isinstance(exc, ApiException) and status != 429 and (status or 0) < 500:
+                    #The API server answered: it is healthy.
+                    circuit.success()
+                    raise
+                circuit.failure()
+                #A 429 was not applied.
+                if attempt >= self.max_retries or (status != 429 and method not in IDEMPOTENT):
+                    raise
+                defournement.metrics.API_RETRIES.labels(self.cluster).inc()
+                time.sleep(_retry_delay(exc, attempt))
+                attempt += 1
+                continue
+            circuit.success()
+            return result
 
 def k8s_config():
     """
-    Setup the kubernetes config.
+    Setup the kubernetes config: the default one is the first cluster.
     """
-    configuration = client.Configuration()
-    configuration.host = farine.settings.defournement['api_host']
-    configuration.ssl_ca_cert = farine.settings.defournement['api_ca_file']
-    configuration.api_key['authorization'] = farine.settings.defournement['api_key']
-    configuration.api_key_prefix['authorization'] = 'Bearer'
-    client.Configuration.set_default(configuration)
+    client.Configuration.set_default(defournement.clusters.configuration(defournement.clusters.names()[0]))
+    with _LOCK:
+        _CLIENT['pid'] = None
 
+def api_client(cluster=None):
+    """
+    Retrieve the process-wide kubernetes API client of a cluster, built on first use.
+    It is thread-safe and shares one connection pool between all the components.
+    Settings:
+     - api_connect_timeout : the connect timeout, in seconds. Default to 5.
+     - api_read_timeout : the read timeout, in seconds. Default to 30.
+     - api_keepalive : enable TCP keep-alive on the connections. Default to true.
+     - api_max_retries : the retries of the 429 responses, and of the 5xx of the idempotent requests. Default to 3.
+    :param cluster: The cluster name. Default to the first one.
+    :type cluster: str
+    :returns: The API client.
+    :rtype: ApiClient
+    """
+    cluster = defournement.clusters.resolve(cluster)
+    with _LOCK:
+        #Sockets must not be shared with a forked process.
+        if _CLIENT['pid'] != os.getpid():
+            _CLIENT['clients'] = {}
+            _CLIENT['pid'] = os.getpid()
+        if cluster not in _CLIENT['clients']:
+            settings = farine.settings.defournement
+            api = ApiClient(defournement.clusters.configuration(cluster))
+            api.cluster = cluster
+            api.request_timeout = (float(settings.get('api_connect_timeout', 5)),
+                                   float(settings.get('api_read_timeout', 30)))
+            api.max_retries = int(settings.get('api_max_retries', 3))
+            if settings.get('api_keepalive', 'true').lower() == 'true':
+                pool_kw = api.rest_client.pool_manager.connection_pool_kw
+                pool_kw['socket_options'] = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            _CLIENT['clients'][cluster] = api
+        return _CLIENT['clients'][cluster]
+
+def exclude_selector(namespaces, field='metadata.namespace'):
+    """
+    The field selector excluding namespaces server-side.
+    :param namespaces: The namespaces to exclude.
+    :type namespaces: list
+    :param field: The namespace field: metadata.name to list the namespaces themselves.
+    :type field: str
+    :returns: The selector, None if nothing is excluded.
+    :rtype: str
+    """
+    selector = ','.join('{}!={}'.format(field, namespace) for namespace in sorted(set(namespaces)) if namespace)
+    return selector or None